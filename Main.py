@@ -1,23 +1,99 @@
+import time
+
+PROCESS_STARTED = time.perf_counter()  # taken before the app imports, so the startup profile includes them
+
+import argparse
+import logging
+import threading
+from contextlib import contextmanager
+
 from main_menu_app import MainMenuApp
-from services import DataManager, GeminiService
+from services import DataManager, GeminiService, ResponseCache
+from context_builder import ContextBuilder
+from entity_repository import EntityRepository
+from fake_gemini import FakeGeminiClient
+from job_queue import JobQueue
+from async_data_manager import AsyncDataManager
 import config
 
+IMPORTS_DONE = time.perf_counter()
+
+
+class StartupProfile:
+    """Collects how long each startup phase took; reported with --profile-startup."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = [("imports", (IMPORTS_DONE - PROCESS_STARTED) * 1000)]
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        yield
+        self.phases.append((name, (time.perf_counter() - started) * 1000))
+
+    def report(self):
+        if not self.enabled: return
+        lines = [f"  {name:<28}{ms:>9.1f}ms" for name, ms in self.phases]
+        lines.append(f"  {'first frame (since launch)':<28}{(time.perf_counter() - PROCESS_STARTED) * 1000:>9.1f}ms")
+        logging.info("Startup profile:\n" + "\n".join(lines))
+
 
 def main():
     """
     Initializes and runs the D&D Toolkit application.
     """
-    api_key = config.load_api_key()
-    data_manager = DataManager(db_filepath=config.DB_FILE)
-    gemini_service = GeminiService(
-        api_key=api_key,
-        text_model_name=config.TEXT_MODEL_NAME,
-        image_model_name=config.IMAGE_MODEL_NAME
-    )
-
-    app = MainMenuApp(data_manager=data_manager, api_service=gemini_service)
+    parser = argparse.ArgumentParser(description="DM's AI Toolkit")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="log how long imports and each startup phase took (use python -X importtime for more)")
+    args = parser.parse_args()
+    profile = StartupProfile(args.profile_startup)
+
+    with profile.phase("api key"):
+        api_key = config.load_api_key()
+    with profile.phase("database"):
+        data_manager = DataManager(db_filepath=config.DB_FILE)
+        repository = EntityRepository(data_manager)
+        async_data = AsyncDataManager(data_manager, repository)
+    with profile.phase("ai service"):
+        response_cache = ResponseCache(data_manager) if config.RESPONSE_CACHE_ENABLED else None
+        gemini_service = GeminiService(
+            api_key=api_key,
+            text_model_name=config.TEXT_MODEL_NAME,
+            image_model_name=config.IMAGE_MODEL_NAME,
+            response_cache=response_cache,
+            context_builder=ContextBuilder(data_manager),
+            client=FakeGeminiClient(latency=0.5, chunk_latency=0.05) if config.USE_FAKE_GEMINI else None,
+            metrics=data_manager.metrics
+        )
+
+    with profile.phase("job queue"):
+        job_queue = JobQueue(data_manager, gemini_service)
+        job_queue.resume()
+
+    with profile.phase("main menu"):
+        app = MainMenuApp(data_manager=data_manager, api_service=gemini_service, job_queue=job_queue,
+                          repository=repository, async_data=async_data)
+
+    def background_maintenance():
+        # These read the database, so they run off the Tk thread.
+        repository.npc_count()  # the roster summaries, ready before the NPC Manager first opens
+        job_queue.backfill_thumbnails()
+        job_queue.collect_blob_garbage()
+
+    def on_first_idle():
+        profile.report()
+        if config.WARM_UP_AI_CLIENT:
+            on_ready = (lambda seconds: logging.info(f"Startup profile: AI client ready in the background after "
+                                                     f"{seconds * 1000:.1f}ms.")) if profile.enabled else None
+            gemini_service.warm_up(on_ready)
+        threading.Thread(target=background_maintenance, name="startup-maintenance", daemon=True).start()
+
+    app.after_idle(on_first_idle)
     app.mainloop()
+    async_data.close()  # saves still queued are written before the database closes
+    data_manager.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,165 @@
+import logging
+import queue
+import threading
+import tkinter
+from concurrent.futures import Future
+
+from config import DB_EXECUTOR_BATCH_SIZE
+
+READ, WRITE, CALL = "read", "write", "call"
+
+
+def when_done(widget, future, handler):
+    """Calls handler(future) on `widget`'s Tk thread once `future` finishes, unless the window has closed."""
+
+    def deliver(done):
+        try:
+            widget.after(0, handler, done)
+        except (RuntimeError, tkinter.TclError):
+            pass  # The window closed; a save has still been made.
+
+    future.add_done_callback(deliver)
+
+
+class AsyncDataManager:
+    """
+    Runs the windows' database work on one dedicated thread, so a slow disk or a large portrait write never
+    stalls the Tk main loop. Every call returns a Future; when_done() continues on the Tk thread with it.
+
+    Requests run in the order they were made, so a read made after a save sees it. Whatever has queued up by
+    the time the thread is free is taken as one batch of up to `batch_size`: consecutive writes share a
+    transaction (one commit, one change notification to the repository), and identical consecutive reads,
+    such as the same thumbnails asked for by two lists, run once. call() requests run on their own.
+    """
+
+    def __init__(self, data_manager, repository, batch_size=DB_EXECUTOR_BATCH_SIZE):
+        self.db = data_manager
+        self.repo = repository
+        self.batch_size = batch_size
+        self._requests = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-executor", daemon=True)
+        self._thread.start()
+
+    # --- Reads ---
+
+    def get_npc(self, name):
+        return self.read(self.repo.get_npc, name)
+
+    def search_npcs(self, query="", facets=None, limit=50, offset=None, count_facets=True):
+        return self.read(self.db.search_npcs, query, facets, limit=limit, offset=offset, count_facets=count_facets)
+
+    def get_thumbnails(self, names, pixels):
+        return self.read(self.db.get_thumbnails, tuple(names), pixels)
+
+    # --- Writes ---
+
+    def save_npc(self, npc_data, old_name=None):
+        return self.write(self.repo.save_npc, npc_data, old_name=old_name)
+
+    def update_npc(self, name, changes):
+        return self.write(self.repo.update_npc, name, changes)
+
+    def delete_npc(self, name):
+        return self.write(self.repo.delete_npc, name)
+
+    def save_campaign(self, campaign_data, old_name=None):
+        return self.write(self.repo.save_campaign, campaign_data, old_name=old_name)
+
+    def delete_campaign(self, name):
+        return self.write(self.repo.delete_campaign, name)
+
+    # --- Executor ---
+
+    def read(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on the database thread and returns a Future for its result."""
+        return self._submit(READ, fn, args, kwargs)
+
+    def write(self, fn, *args, **kwargs):
+        """Like read(), but fn may write: it runs inside the transaction of its batch."""
+        return self._submit(WRITE, fn, args, kwargs)
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Like write(), but fn runs alone, outside any shared transaction and never coalesced: for work whose
+        effects must follow its own commit, such as JobQueue.submit scheduling a job it has just recorded.
+        """
+        return self._submit(CALL, fn, args, kwargs)
+
+    def _submit(self, kind, fn, args, kwargs):
+        if self._closed: raise RuntimeError("The database thread has been shut down.")
+        future = Future()
+        self._requests.put((kind, fn, args, kwargs, future))
+        return future
+
+    def close(self):
+        """Finishes the requests already queued, then stops the thread."""
+        if self._closed: return
+        self._closed = True
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            batch = [self._requests.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            if stopping: batch.pop()
+            start = 0
+            while start < len(batch):
+                end = start + 1
+                while end < len(batch) and batch[end][0] == batch[start][0]: end += 1
+                run = {READ: self._run_reads, WRITE: self._run_writes, CALL: self._run_calls}[batch[start][0]]
+                run([request for request in batch[start:end] if request[4].set_running_or_notify_cancel()])
+                start = end
+            if stopping: return
+
+    def _run_reads(self, requests):
+        outcomes = {}  # identical reads in this run -> (result, error)
+        for _, fn, args, kwargs, future in requests:
+            try:
+                key = (fn, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                key = None  # e.g. a facets dict; not shared
+            outcome = outcomes.get(key) if key is not None else None
+            if outcome is None:
+                outcome = self._call(fn, args, kwargs)
+                if key is not None: outcomes[key] = outcome
+            self._settle(future, outcome)
+
+    def _run_writes(self, requests):
+        if len(requests) > 1:
+            try:
+                with self.db.transaction():
+                    results = [fn(*args, **kwargs) for _, fn, args, kwargs, _ in requests]
+            except Exception as e:
+                # Rolled back as a whole; run them one at a time so only the failing write fails.
+                logging.warning(f"A batch of {len(requests)} database writes failed, retrying one by one: {e}")
+            else:
+                for request, result in zip(requests, results): request[4].set_result(result)
+                return
+        for _, fn, args, kwargs, future in requests: self._settle(future, self._call(fn, args, kwargs))
+
+    def _run_calls(self, requests):
+        for _, fn, args, kwargs, future in requests: self._settle(future, self._call(fn, args, kwargs))
+
+    @staticmethod
+    def _call(fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs), None
+        except Exception as e:
+            logging.error(f"Database request {getattr(fn, '__name__', fn)} failed: {e}")
+            return None, e
+
+    @staticmethod
+    def _settle(future, outcome):
+        result, error = outcome
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
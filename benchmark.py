@@ -0,0 +1,338 @@
+"""
+Benchmarks the toolkit's hot paths against synthetic databases and a deterministic fake Gemini backend.
+
+    python benchmark.py --sizes 1000,10000 --output bench_data/run.json
+    python benchmark.py --compare bench_data/run.json        # prints p50 changes against an earlier run
+    xvfb-run python benchmark.py                             # include the Tk roster timings headless
+
+Synthetic databases are cached in --workdir and reused while their parameters match. Without a display
+(or without customtkinter) the roster rebuild is timed on a widget stand-in and the result says so.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import time
+import zlib
+
+import config
+from fake_gemini import FakeGeminiClient
+from metrics import percentile
+
+BENCH_VERSION = 1
+WORDS = ("ancient ember harbor whisper iron vale shadow guild lantern moss crown oath tide raven marsh forge "
+         "silver hollow thorn beacon rune saint wolf ash copper mire ledger tower spire plague relic").split()
+FIRST_NAMES = ("Ara Bram Cael Dorn Elra Fenn Garr Hild Isen Jory Kael Lira Mott Nyx Orin Pell Quill Rhea Sorn "
+               "Tamsin Ulric Vesna Wren Yara Zed").split()
+
+
+# --- Synthetic data ---
+
+def noise_png(pixels, seed):
+    """An RGB PNG of random pixels: it barely compresses, so its size is close to a real portrait's."""
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(pixels * 3) for _ in range(pixels))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", pixels, pixels, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def prose(rng, words):
+    sentences, remaining = [], words
+    while remaining > 0:
+        length = min(remaining, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(length)).capitalize() + ".")
+        remaining -= length
+    return " ".join(sentences)
+
+
+def synthetic_npc(rng, index, portrait):
+    return {
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(WORDS).capitalize()} {index}",
+        "race_class": f"{rng.choice(config.RACE_OPTIONS[1:])} {rng.choice(config.CLASS_OPTIONS[1:])}",
+        "appearance": prose(rng, 60), "personality": prose(rng, 50), "backstory": prose(rng, 160),
+        "plot_hooks": prose(rng, 60), "roleplaying_tips": prose(rng, 40),
+        "attitude": rng.choice(config.ATTITUDE_OPTIONS[1:]), "rarity": rng.choice(config.RARITY_OPTIONS[1:]),
+        "race": rng.choice(config.RACE_OPTIONS[1:]), "character_class": rng.choice(config.CLASS_OPTIONS[1:]),
+        "environment": rng.choice(config.ENVIRONMENT_OPTIONS[1:]),
+        "background": rng.choice(config.BACKGROUND_OPTIONS[1:]), "gender": rng.choice(config.GENDER_OPTIONS[1:]),
+        "image_data": portrait, "custom_prompt": "",
+    }
+
+
+def build_database(path, npc_count, args):
+    """Creates (or reuses) a synthetic database of `npc_count` NPCs and a few campaigns with long histories."""
+    from services import DataManager
+    marker = f"{path}.json"
+    spec = {"version": BENCH_VERSION, "npcs": npc_count, "seed": args.seed, "portrait_px": args.portrait_px,
+            "portrait_ratio": args.portrait_ratio, "history_words": args.history_words}
+    if os.path.exists(path) and os.path.exists(marker) and not args.rebuild:
+        with open(marker) as f:
+            if json.load(f) == spec: return
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(path + suffix): os.remove(path + suffix)
+    rng = random.Random(args.seed)
+    portraits = [noise_png(args.portrait_px, args.seed + i) for i in range(8)]
+    started = time.perf_counter()
+    db = DataManager(db_filepath=path)
+    batch = []
+    for index in range(npc_count):
+        portrait = rng.choice(portraits) if rng.random() < args.portrait_ratio else None
+        batch.append(synthetic_npc(rng, index, portrait))
+        if len(batch) == 1000:
+            db.save_npcs(batch)
+            batch = []
+    if batch: db.save_npcs(batch)
+    for number in range(3):
+        db.save_campaign({"campaign_name": f"Campaign {number + 1}", "campaign_lore": prose(rng, 3000),
+                          "party_info": prose(rng, 800), "session_history": prose(rng, args.history_words)})
+    db.close()
+    with open(marker, "w") as f:
+        json.dump(spec, f)
+    logging.warning(f"Built {path} with {npc_count} NPCs in {time.perf_counter() - started:.1f}s.")
+
+
+# --- Measurement ---
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {"n": len(ordered), "mean_ms": round(statistics.fmean(ordered), 3),
+            "p50_ms": round(percentile(ordered, 0.50), 3), "p95_ms": round(percentile(ordered, 0.95), 3),
+            "p99_ms": round(percentile(ordered, 0.99), 3), "min_ms": round(ordered[0], 3),
+            "max_ms": round(ordered[-1], 3)}
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+class RosterStandIn:
+    """Does the non-widget part of VirtualList.set_items when Tk is unavailable."""
+
+    def set_items(self, keys):
+        self.items = sorted(keys)
+
+    def update_idletasks(self):
+        pass
+
+
+def make_roster():
+    """Returns (roster, mode): a real VirtualList in a hidden window when possible, else a stand-in."""
+    try:
+        import customtkinter
+        from virtual_list import VirtualList
+        root = customtkinter.CTk()
+        root.withdraw()
+        roster = VirtualList(root)
+        roster.grid(row=0, column=0, sticky="nsew")
+        roster.update_idletasks = root.update_idletasks
+        return roster, "tk"
+    except Exception as e:  # no display, or no customtkinter installed
+        logging.warning(f"Timing the roster on a stand-in ({e}).")
+        return RosterStandIn(), "stand-in"
+
+
+def decode_portrait(image_bytes):
+    """What the portrait cache worker does for each cache miss."""
+    import io
+    from PIL import Image
+    with Image.open(io.BytesIO(image_bytes)) as source:
+        source.convert("RGBA").resize((250, 250), Image.LANCZOS)
+
+
+def bench_database(path, args):
+    from services import DataManager
+    from portrait_storage import HAS_PORTRAIT
+    results = {}
+    db = DataManager(db_filepath=path)
+    db.metrics = None  # measure the calls themselves, not the recorder
+    rng = random.Random(args.seed)
+    summaries = db.load_npc_summaries()
+    names = sorted(summaries)
+    with_portraits = [row[0] for row in db._get_connection().execute(
+        f"SELECT name FROM npcs WHERE {HAS_PORTRAIT} LIMIT 200")]
+
+    results["load_data"] = timed(db.load_data, max(1, args.repeat // 5))
+    results["load_npc_summaries"] = timed(db.load_npc_summaries, args.repeat)
+    results["load_campaigns"] = timed(db.load_campaigns, args.repeat)
+
+    roster, mode = make_roster()
+    results["roster_rebuild"] = timed(lambda: (roster.set_items(db.load_npc_summaries().keys()),
+                                               roster.update_idletasks()), args.repeat)
+    results["roster_rebuild"]["mode"] = mode
+
+    results["select_npc"] = timed(lambda: db.get_npc(rng.choice(names)), args.repeat * 10)
+    if with_portraits:
+        results["select_npc_with_portrait"] = timed(lambda: db.get_npc(rng.choice(with_portraits)), args.repeat * 10)
+    results["search_npcs_first_page"] = timed(
+        lambda: db.search_npcs(rng.choice(WORDS), limit=config.NPC_SEARCH_PAGE_SIZE, count_facets=False),
+        args.repeat * 5)
+    results["search_npcs_with_facets"] = timed(
+        lambda: db.search_npcs(rng.choice(WORDS), facets={"race": rng.choice(config.RACE_OPTIONS[1:])}),
+        args.repeat)
+
+    template = db.get_npc(names[0])
+    counter = iter(range(10 ** 9))
+    results["save_npc_insert"] = timed(lambda: db.save_npc(dict(template, name=f"Bench NPC {next(counter)}")),
+                                       args.repeat * 10)
+    results["save_npc_update"] = timed(lambda: db.save_npc(dict(template, backstory=prose(rng, 160))),
+                                       args.repeat * 10)
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM npcs WHERE name LIKE 'Bench NPC %'")
+
+    if with_portraits:
+        image = db.get_portrait(with_portraits[0])
+        try:
+            results["portrait_decode"] = timed(lambda: decode_portrait(image), args.repeat)
+            results["portrait_decode"]["bytes"] = len(image)
+        except ImportError:
+            results["portrait_decode"] = {"skipped": "Pillow is not installed"}
+    db.close()
+    return results
+
+
+def bench_ai(path, args):
+    """End-to-end generation and simulation throughput through GeminiService with the fake client."""
+    from services import DataManager, GeminiService, RateLimiter, PRIORITY_INTERACTIVE
+    from context_builder import ContextBuilder
+    db = DataManager(db_filepath=path)
+    client = FakeGeminiClient(latency=args.latency, chunk_latency=args.chunk_latency, seed=args.seed)
+    service = GeminiService("benchmark", config.TEXT_MODEL_NAME, config.IMAGE_MODEL_NAME, client=client,
+                            context_builder=ContextBuilder(db), metrics=db.metrics)
+    if not args.respect_rate_limits:
+        service.rate_limiters = {model: RateLimiter(10 ** 6, burst=10 ** 6) for model in service.rate_limiters}
+    campaign = next(iter(db.load_campaigns().values()))
+    params = {"gender": "Random", "attitude": "Random", "rarity": "Random", "environment": "Random",
+              "race": "Random", "character_class": "Random", "background": "Random", "custom_prompt": ""}
+    results = {}
+
+    started = time.perf_counter()
+    batch = service.generate_npc_batch(params, args.ai_items, campaign_data=campaign)
+    elapsed = time.perf_counter() - started
+    failures = [result['error'] for result in batch if result['error'] is not None]
+    results["generation_throughput"] = {"items": args.ai_items, "seconds": round(elapsed, 3),
+                                        "per_second": round(args.ai_items / elapsed, 3), "failed": len(failures),
+                                        "errors": sorted({str(error) for error in failures})}
+
+    def simulate():
+        first_chunk_at = None
+        submitted = time.perf_counter()
+        for _ in service.simulate_reaction_stream({"name": "Bench"}, "The party bursts in.", campaign_data=campaign):
+            if first_chunk_at is None: first_chunk_at = time.perf_counter()
+        return (first_chunk_at - submitted) * 1000 if first_chunk_at else None
+
+    started = time.perf_counter()
+    futures = [service.submit(simulate, priority=PRIORITY_INTERACTIVE) for _ in range(args.ai_items)]
+    first_chunks, failures = [], []
+    for future in futures:
+        try:
+            first_chunks.append(future.result())
+        except Exception as e:
+            failures.append(e)
+    elapsed = time.perf_counter() - started
+    results["simulation_throughput"] = {"items": args.ai_items, "seconds": round(elapsed, 3),
+                                        "per_second": round(args.ai_items / elapsed, 3), "failed": len(failures),
+                                        "errors": sorted({str(error) for error in failures}),
+                                        "time_to_first_chunk": summarize([ms for ms in first_chunks if ms])
+                                        if any(first_chunks) else None}
+    results["api_calls"] = service.call_stats()
+    db.close()
+    return results
+
+
+# --- Reporting ---
+
+def run_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"version": BENCH_VERSION, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("compare", "output")}}
+
+
+def compare(previous, current):
+    """Prints the p50 change of every timing present in both runs."""
+    print(f"{'Benchmark':<48}{'before':>12}{'after':>12}{'change':>10}")
+    for size, timings in current["databases"].items():
+        for name, stats in timings.items():
+            before = previous.get("databases", {}).get(size, {}).get(name, {})
+            if "p50_ms" not in stats or "p50_ms" not in before: continue
+            change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+            print(f"{size + ' ' + name:<48}{before['p50_ms']:>10.2f}ms{stats['p50_ms']:>10.2f}ms{change:>+9.1f}%")
+    for name, stats in current.get("ai", {}).items():
+        before = previous.get("ai", {}).get(name, {})
+        if "per_second" in stats and "per_second" in before:
+            print(f"{name + ' (items/s)':<48}{before['per_second']:>12.2f}{stats['per_second']:>12.2f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated NPC counts")
+    parser.add_argument("--workdir", default="bench_data", help="where synthetic databases are kept")
+    parser.add_argument("--output", help="JSON results file (default: <workdir>/results-<timestamp>.json)")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    parser.add_argument("--repeat", type=int, default=20, help="base repetitions per timing")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--portrait-px", type=int, default=256, help="side of the synthetic portraits")
+    parser.add_argument("--portrait-ratio", type=float, default=0.1, help="share of NPCs with a portrait")
+    parser.add_argument("--history-words", type=int, default=40000, help="session history length per campaign")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate databases even if cached")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake API latency per call, in seconds")
+    parser.add_argument("--chunk-latency", type=float, default=0.02, help="fake delay between streamed chunks")
+    parser.add_argument("--ai-items", type=int, default=20, help="NPCs and simulations in the throughput runs")
+    parser.add_argument("--respect-rate-limits", action="store_true",
+                        help="keep the configured per-minute limits instead of lifting them")
+    parser.add_argument("--skip-ai", action="store_true")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.WARNING)
+    os.makedirs(args.workdir, exist_ok=True)
+    report = {"meta": run_metadata(args), "databases": {}}
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    for size in sizes:
+        path = os.path.join(args.workdir, f"bench_{size}.db")
+        build_database(path, size, args)
+        logging.warning(f"Benchmarking {size} NPCs...")
+        report["databases"][str(size)] = bench_database(path, args)
+    if not args.skip_ai and sizes:
+        report["ai"] = bench_ai(os.path.join(args.workdir, f"bench_{sizes[0]}.db"), args)
+
+    output = args.output or os.path.join(args.workdir, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    failed = {name: stats["failed"] for name, stats in report.get("ai", {}).items() if stats.get("failed")}
+    if failed:
+        # Throughput of requests that errored out says nothing; don't let a broken run pass for a fast one.
+        for name, count in failed.items():
+            print(f"{name}: {count} of {args.ai_items} items failed: {'; '.join(report['ai'][name]['errors'])}",
+                  file=sys.stderr)
+        return 1
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
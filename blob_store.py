@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import BLOB_GC_GRACE_SECONDS
+
+HASH_LENGTH = 64  # hex SHA-256
+
+
+def blob_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def store_path_for(db_filepath):
+    """The blob store folder that goes with a database file: dnd_toolkit.db keeps its portraits in dnd_toolkit_blobs/."""
+    return os.path.splitext(db_filepath)[0] + "_blobs"
+
+
+class BlobStore:
+    """
+    Immutable files named by the SHA-256 of their content, under `root`/<first two hex digits>/. Writing the same
+    content twice stores it once. Reads return plain bytes, like a portrait kept inline in the database, so
+    callers can hash, compare, cache and pass them to the SDK without knowing where the portrait came from.
+
+    The store itself doesn't know which blobs are in use: that is the 'portrait_hash' column of the npcs table,
+    counted per hash in 'blob_refs' by triggers. collect_garbage and check_consistency compare the two.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def path(self, blob_hash):
+        return os.path.join(self.root, blob_hash[:2], blob_hash)
+
+    def put(self, data):
+        """Stores `data` (if it isn't already) and returns its hash."""
+        key = blob_hash(data)
+        path = self.path(key)
+        with self._lock:  # not while collect_garbage is deciding what to delete
+            if os.path.exists(path):
+                # Refresh the time so garbage collection's grace period covers the save about to reference it.
+                os.utime(path)
+                return key
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)  # a reader sees the whole file or none of it
+        return key
+
+    def read(self, blob_hash):
+        """The blob's bytes; None (and an error logged) if it's missing."""
+        try:
+            with open(self.path(blob_hash), "rb") as f:
+                return f.read()
+        except OSError as e:
+            logging.error(f"Portrait blob {blob_hash} could not be read: {e}")
+            return None
+
+    def exists(self, blob_hash):
+        return os.path.exists(self.path(blob_hash))
+
+    def delete(self, blob_hash):
+        """Removes a blob; returns False if it is still open elsewhere (Windows) and has to wait for the next run."""
+        try:
+            os.remove(self.path(blob_hash))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Could not remove portrait blob {blob_hash}: {e}")
+            return False
+        return True
+
+    def files(self):
+        """Yields (name, path, modified time) for every file in the store, blobs and leftover temp files alike."""
+        if not os.path.isdir(self.root): return
+        for fan_out in os.scandir(self.root):
+            if not fan_out.is_dir(): continue
+            for entry in os.scandir(fan_out.path):
+                if entry.is_file(): yield entry.name, entry.path, entry.stat().st_mtime
+
+
+def _is_blob_name(name):
+    return len(name) == HASH_LENGTH and all(c in "0123456789abcdef" for c in name)
+
+
+def _referenced_hashes(conn):
+    return {row[0]: row[1] for row in conn.execute(
+        "SELECT portrait_hash, COUNT(*) FROM npcs WHERE portrait_hash IS NOT NULL GROUP BY portrait_hash")}
+
+
+def collect_garbage(db, store, grace_seconds=BLOB_GC_GRACE_SECONDS):
+    """
+    Deletes blobs no NPC references any more, and temp files left by interrupted writes, and returns the counts.
+    Files younger than `grace_seconds` are kept: a save writes its blob before committing the row that points
+    at it. Counts that dropped to zero are removed from 'blob_refs' once their file is gone.
+    """
+    stats = {"deleted": 0, "bytes_freed": 0, "kept_recent": 0}
+    cutoff = time.time() - grace_seconds
+    try:
+        in_use = {row[0] for row in db._get_connection().execute(
+            "SELECT blob_hash FROM blob_refs WHERE refcount > 0")}
+    except sqlite3.Error as e:
+        logging.error(f"Failed to read portrait references for garbage collection: {e}")
+        return stats
+    with store._lock:
+        for name, path, modified in list(store.files()):
+            if _is_blob_name(name) and name in in_use: continue
+            if modified > cutoff:
+                stats["kept_recent"] += 1
+                continue
+            size = os.path.getsize(path)
+            if _is_blob_name(name):
+                # Re-checked right before deleting, in case a save referenced it since the scan started.
+                row = db._get_connection().execute("SELECT refcount FROM blob_refs WHERE blob_hash = ?",
+                                                   (name,)).fetchone()
+                if row is not None and row[0] > 0: continue
+                if not store.delete(name): continue
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            stats["deleted"] += 1
+            stats["bytes_freed"] += size
+    try:
+        with db.transaction() as conn:
+            for row in conn.execute("SELECT blob_hash FROM blob_refs WHERE refcount <= 0").fetchall():
+                if not store.exists(row[0]): conn.execute("DELETE FROM blob_refs WHERE blob_hash = ?", (row[0],))
+    except sqlite3.Error as e:
+        logging.error(f"Failed to prune portrait reference counts: {e}")
+    if stats["deleted"]: logging.info(f"Portrait blob garbage collection: {stats}")
+    return stats
+
+
+def check_consistency(db, store, verify=False, repair=False):
+    """
+    Compares the blob store with the database and returns what disagrees:
+    'missing' maps hashes NPCs point at but the store lacks to those NPCs' names; 'orphaned' lists blobs nothing
+    references (collect_garbage removes them); 'miscounted' maps hashes to (recorded, actual) reference counts;
+    'corrupt' lists blobs whose content no longer matches their name (only checked with `verify`, which reads
+    every blob). With `repair`, reference counts are rebuilt from the npcs table.
+    """
+    conn = db._get_connection()
+    report = {"missing": {}, "orphaned": [], "miscounted": {}, "corrupt": []}
+    with db.transaction(write=False):
+        actual = _referenced_hashes(conn)
+        recorded = {row[0]: row[1] for row in conn.execute("SELECT blob_hash, refcount FROM blob_refs")}
+        for key in actual:
+            if not store.exists(key):
+                report["missing"][key] = [row[0] for row in conn.execute(
+                    "SELECT name FROM npcs WHERE portrait_hash = ? ORDER BY name", (key,))]
+    for key in set(actual) | set(recorded):
+        if recorded.get(key, 0) != actual.get(key, 0):
+            report["miscounted"][key] = (recorded.get(key, 0), actual.get(key, 0))
+    for name, path, _ in store.files():
+        if not _is_blob_name(name): continue
+        if name not in actual: report["orphaned"].append(name)
+        if verify:
+            data = store.read(name)
+            if data is not None and blob_hash(data) != name: report["corrupt"].append(name)
+    if repair and report["miscounted"]:
+        try:
+            with db.transaction() as conn:
+                conn.execute("DELETE FROM blob_refs")
+                conn.execute("INSERT INTO blob_refs (blob_hash, refcount) SELECT portrait_hash, COUNT(*) FROM npcs "
+                             "WHERE portrait_hash IS NOT NULL GROUP BY portrait_hash")
+            logging.info(f"Rebuilt {len(report['miscounted'])} portrait reference counts.")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to rebuild portrait reference counts: {e}")
+    return report
+
+
+def move_portraits(db, to_store=True, batch_size=50):
+    """
+    Moves existing portraits into the blob store (or back inline with `to_store=False`), `batch_size` rows per
+    transaction, and returns how many moved. New saves follow config.PORTRAIT_BLOB_STORE either way.
+    """
+    moved, last_id = 0, 0
+    condition = "image_data IS NOT NULL" if to_store else "portrait_hash IS NOT NULL"
+    while True:
+        rows = db._get_connection().execute(
+            f"SELECT npc_id, image_data, portrait_hash FROM npcs WHERE npc_id > ? AND {condition} ORDER BY npc_id "
+            f"LIMIT ?", (last_id, batch_size)).fetchall()
+        if not rows: break
+        last_id = rows[-1]['npc_id']
+        with db.transaction() as conn:
+            for row in rows:
+                if to_store:
+                    values = (None, db.blobs.put(row['image_data']))
+                else:
+                    image_bytes = db.blobs.read(row['portrait_hash'])
+                    if image_bytes is None: continue  # reported by check_consistency; leave the row as it is
+                    values = (image_bytes, None)
+                moved += conn.execute("UPDATE npcs SET image_data = ?, portrait_hash = ? WHERE npc_id = ? AND "
+                                      "image_data IS ? AND portrait_hash IS ?",
+                                      values + (row['npc_id'], row['image_data'], row['portrait_hash'])).rowcount
+        if len(rows) < batch_size: break
+    logging.info(f"Moved {moved} portraits {'into' if to_store else 'out of'} the blob store.")
+    return moved
+
+
+def main():
+    import config
+    from services import DataManager
+    parser = argparse.ArgumentParser(description="Maintain the portrait blob store beside the toolkit database.")
+    parser.add_argument("--db", default=config.DB_FILE, help="database file (default: %(default)s)")
+    parser.add_argument("--verify", action="store_true", help="also re-hash every blob to find damaged files")
+    parser.add_argument("--repair", action="store_true", help="rebuild reference counts that don't match")
+    parser.add_argument("--gc", action="store_true", help="delete unreferenced blobs after the check")
+    parser.add_argument("--move-in", action="store_true", help="move inline portraits into the blob store")
+    parser.add_argument("--move-out", action="store_true", help="move portraits from the blob store back inline")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    db = DataManager(db_filepath=args.db)
+    try:
+        if args.move_in or args.move_out: move_portraits(db, to_store=args.move_in)
+        report = check_consistency(db, db.blobs, verify=args.verify, repair=args.repair)
+        for kind, found in report.items():
+            print(f"{kind}: {len(found)}")
+            for item in sorted(found)[:20]:
+                print(f"  {item}" + (f" {found[item]}" if isinstance(found, dict) else ""))
+        if args.gc: print(f"garbage collection: {collect_garbage(db, db.blobs)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import customtkinter
 import logging
 
+from async_data_manager import when_done
+from virtual_list import VirtualList
+
 
 class CampaignManagerApp(customtkinter.CTkToplevel):
     """
@@ -8,32 +11,44 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
     now with a tabbed interface for better organization.
     """
 
-    def __init__(self, master, data_manager):
+    def __init__(self, master, repository, async_data):
         super().__init__(master)
         self.master = master
-        self.db = data_manager
+        self.repo = repository
+        self.data = async_data
 
         self.title("Campaign Manager")
         self.geometry("900x600")
         self.minsize(600, 400)
 
-        self.campaigns = self.db.load_campaigns()
         self.selected_campaign_name = None
+        self._campaign_request = None  # Future of the latest campaign read; older ones are dropped
 
         self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(0, weight=1)
 
         self._create_widgets()
-        self.update_campaign_list()
-        self.select_first_campaign()
+        self.update_campaign_list(on_loaded=self.select_first_campaign)
+        self.repo.subscribe(self._on_entities_changed, self)
 
         self.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def on_close(self):
-        """Handles window closing and triggers a refresh in the main menu."""
-        self.master.refresh_campaign_list()
+        """Closes the window; the main menu follows campaign changes on its own."""
+        self.repo.unsubscribe(self._on_entities_changed)
         self.destroy()
 
+    def _on_entities_changed(self, changes):
+        """Keeps the list in step with saves, including this window's own and campaigns added by an import."""
+        for change in changes:
+            if change.kind != "campaign": continue
+            if change.deleted:
+                self.campaign_list_frame.remove(change.name)
+            elif change.old_name:
+                self.campaign_list_frame.rename(change.old_name, change.name)
+            else:
+                self.campaign_list_frame.insert(change.name)
+
     def _create_widgets(self):
         """Initializes and lays out all the main UI components."""
         # --- Sidebar ---
@@ -45,9 +60,8 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
                                font=customtkinter.CTkFont(size=20, weight="bold")).grid(row=0, column=0, padx=20,
                                                                                         pady=(20, 10))
 
-        self.campaign_list_frame = customtkinter.CTkScrollableFrame(self.sidebar_frame)
+        self.campaign_list_frame = VirtualList(self.sidebar_frame, command=self.select_campaign)
         self.campaign_list_frame.grid(row=1, column=0, padx=20, pady=10, sticky="nsew")
-        self.campaign_buttons = {}
 
         button_frame = customtkinter.CTkFrame(self.sidebar_frame, fg_color="transparent")
         button_frame.grid(row=2, column=0, padx=20, pady=10, sticky="ew")
@@ -96,32 +110,33 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
             row=0, column=0, padx=(0, 5), sticky="ew")
         customtkinter.CTkButton(bottom_button_frame, text="Close", height=40, fg_color="gray50", hover_color="gray30",
                                 command=self.on_close).grid(row=0, column=1, padx=(5, 0), sticky="ew")
+        self.status_label = customtkinter.CTkLabel(bottom_button_frame, text="", text_color="gray")
+        self.status_label.grid(row=1, column=0, columnspan=2, pady=(5, 0), sticky="w")
 
-    def update_campaign_list(self):
-        """Clears and repopulates the campaign list in the sidebar."""
-        for widget in self.campaign_list_frame.winfo_children():
-            widget.destroy()
-        sorted_campaign_names = sorted(self.campaigns.keys())
-        self.campaign_buttons = {}
-        for name in sorted_campaign_names:
-            button = customtkinter.CTkButton(self.campaign_list_frame, text=name,
-                                             command=lambda n=name: self.select_campaign(n))
-            button.pack(pady=5, padx=5, fill="x")
-            self.campaign_buttons[name] = button
+    def update_campaign_list(self, on_loaded=None):
+        """Repopulates the campaign list in the sidebar once it has been read, then calls on_loaded()."""
+        when_done(self, self.data.read(self.repo.campaign_names),
+                  lambda done: self._show_campaign_list(done, on_loaded))
+
+    def _show_campaign_list(self, future, on_loaded):
+        self.campaign_list_frame.set_items(future.result() if future.exception() is None else [])
         self.highlight_selected_campaign()
+        if on_loaded: on_loaded()
 
     def highlight_selected_campaign(self):
         """Visually highlights the currently selected campaign."""
-        for name, button in self.campaign_buttons.items():
-            is_selected = (name == self.selected_campaign_name)
-            button.configure(fg_color=customtkinter.ThemeManager.theme["CTkButton"]["hover_color"] if is_selected else
-            customtkinter.ThemeManager.theme["CTkButton"]["fg_color"])
+        self.campaign_list_frame.select(self.selected_campaign_name)
 
     def select_campaign(self, name):
-        """Handles the selection of a campaign from the list and populates the fields."""
-        if name in self.campaigns:
+        """Handles the selection of a campaign from the list and populates the fields once it has been read."""
+        self._campaign_request = request = self.data.read(self.repo.get_campaign, name)
+        when_done(self, request, lambda done: self._show_campaign(done, name))
+
+    def _show_campaign(self, future, name):
+        if future is not self._campaign_request: return  # another campaign was selected in the meantime
+        campaign_data = future.result() if future.exception() is None else None
+        if campaign_data is not None:
             self.selected_campaign_name = name
-            campaign_data = self.campaigns.get(name, {})
             self.populate_fields(campaign_data)
             self.highlight_selected_campaign()
         else:
@@ -129,8 +144,8 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
 
     def select_first_campaign(self):
         """Selects the first campaign in the list, or prepares a new one."""
-        if self.campaigns:
-            first_name = sorted(self.campaigns.keys())[0]
+        if self.campaign_list_frame.items:
+            first_name = self.campaign_list_frame.items[0]
             self.select_campaign(first_name)
         else:
             self.new_campaign()
@@ -152,6 +167,7 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
     def new_campaign(self):
         """Clears the fields to start a new campaign entry."""
         self.selected_campaign_name = None
+        self._campaign_request = None
         self.populate_fields({})
         self.highlight_selected_campaign()
         self.campaign_name_entry.focus()
@@ -161,6 +177,7 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
         new_name = self.campaign_name_entry.get().strip()
         if not new_name:
             logging.error("Campaign name cannot be empty.")
+            self.status_label.configure(text="Error: Campaign name cannot be empty.")
             return
 
         campaign_data = {
@@ -170,20 +187,35 @@ class CampaignManagerApp(customtkinter.CTkToplevel):
             "session_history": self.session_history_textbox.get("1.0", "end-1c")
         }
 
-        self.db.save_campaign(campaign_data, old_name=self.selected_campaign_name)
-
-        if self.selected_campaign_name and self.selected_campaign_name != new_name:
-            del self.campaigns[self.selected_campaign_name]
-        self.campaigns[new_name] = campaign_data
+        old_name = self.selected_campaign_name
+        self.status_label.configure(text="Saving...")
+        when_done(self, self.data.save_campaign(campaign_data, old_name=old_name),
+                  lambda done: self._on_campaign_saved(done, new_name, old_name))
 
-        self.update_campaign_list()
+    def _on_campaign_saved(self, future, new_name, old_name):
+        if future.exception() is not None:
+            # The fields keep the edits, so saving again retries them.
+            self.status_label.configure(text=f"Error: The campaign could not be saved: {future.exception()}")
+            return
+        self.status_label.configure(text=f"Saved '{new_name}'.")
+        # _on_entities_changed has usually done this already; doing it again is harmless.
+        if old_name and old_name != new_name:
+            self.campaign_list_frame.rename(old_name, new_name)
+        else:
+            self.campaign_list_frame.insert(new_name)
         self.select_campaign(new_name)
 
     def delete_campaign(self):
         """Deletes the currently selected campaign."""
         if not self.selected_campaign_name:
             return
-        self.db.delete_campaign(self.selected_campaign_name)
-        del self.campaigns[self.selected_campaign_name]
-        self.update_campaign_list()
-        self.select_first_campaign()
\ No newline at end of file
+        name = self.selected_campaign_name
+        when_done(self, self.data.delete_campaign(name), lambda done: self._on_campaign_deleted(done, name))
+
+    def _on_campaign_deleted(self, future, name):
+        if future.exception() is not None:
+            self.status_label.configure(text=f"Error: '{name}' could not be deleted: {future.exception()}")
+            return
+        self.status_label.configure(text=f"Deleted '{name}'.")
+        self.campaign_list_frame.remove(name)
+        if self.selected_campaign_name == name: self.select_first_campaign()
\ No newline at end of file
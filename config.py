@@ -8,6 +8,79 @@ DB_FILE = "dnd_toolkit.db"
 TEXT_MODEL_NAME = 'gemini-2.5-flash'
 IMAGE_MODEL_NAME = 'imagen-3.0-generate-002'
 
+# --- API Throughput ---
+TEXT_REQUESTS_PER_MINUTE = 60  # Keep these at or below your Gemini API quota
+IMAGE_REQUESTS_PER_MINUTE = 10
+BATCH_MAX_WORKERS = 4  # Concurrent NPCs in a "Generate N" batch
+TEXT_MODEL_CONCURRENCY = 4  # Text requests in flight at once, across all windows
+IMAGE_MODEL_CONCURRENCY = 2
+SCHEDULER_WORKERS = 8  # Threads running AI tasks; at most BATCH_MAX_WORKERS of them for background work
+
+# --- Job Queue ---
+JOB_MAX_ATTEMPTS = 3  # Times an interrupted job is restarted before it is marked failed
+JOB_RETENTION_SECONDS = 7 * 24 * 60 * 60  # Finished jobs older than this are pruned at startup
+JOB_THROUGHPUT_WINDOW_SECONDS = 600  # Window for the "jobs per minute" figure in the main menu
+JOB_STATUS_REFRESH_MS = 2000
+
+# --- API Resilience ---
+RETRY_MAX_ATTEMPTS = 4  # Tries per call for transient errors (429, 5xx, timeouts)
+RETRY_BASE_DELAY = 1.0  # Seconds; doubles on each retry, with random jitter
+RETRY_MAX_DELAY = 30.0  # Upper bound on any single wait, including server retry hints
+CIRCUIT_FAILURE_THRESHOLD = 5  # Consecutive transient failures before a model's calls are paused
+CIRCUIT_RESET_SECONDS = 30.0  # How long a tripped model is paused before one probe call is tried
+TEXT_REQUEST_DEADLINE_SECONDS = 120.0  # Total time a text call may spend, retries included
+IMAGE_REQUEST_DEADLINE_SECONDS = 180.0
+USE_FAKE_GEMINI = False  # Use the offline fake client from fake_gemini.py instead of the real API
+WARM_UP_AI_CLIENT = True  # Import the SDK and create the client in the background once the menu is up
+
+# --- Response Cache (opt-in) ---
+RESPONSE_CACHE_ENABLED = False  # Reuse identical simulation and portrait responses instead of re-billing them
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+RESPONSE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# --- Prompt Context Budgets ---
+# Approximate tokens allowed per campaign section; longer sections are replaced by cached summaries.
+CONTEXT_TOKEN_BUDGETS = {"campaign_lore": 3000, "party_info": 1000, "session_history": 2500}
+CONTEXT_CHUNK_TOKENS = 800  # Size of the pieces that are summarized (and cached) independently
+CONTEXT_SUMMARY_RATIO = 0.25  # Target summary length relative to its chunk
+
+# --- Database Tuning ---
+DB_CACHE_SIZE_KIB = 32768  # Page cache per connection
+DB_MMAP_SIZE = 256 * 1024 * 1024  # Memory-mapped I/O window, in bytes
+DB_STATEMENT_CACHE_SIZE = 256  # Prepared statements kept per connection
+DB_BUSY_TIMEOUT = 10.0  # Seconds a writer waits on a locked database
+MIGRATION_BATCH_SIZE = 500  # Rows copied per transaction when a schema upgrade rebuilds a table
+ARCHIVE_IMPORT_BATCH_SIZE = 200  # Records committed per transaction when importing a world archive
+DB_EXECUTOR_BATCH_SIZE = 64  # Queued window requests the database thread takes at once (writes share a commit)
+
+# --- UI Caches ---
+PORTRAIT_CACHE_ENTRIES = 64  # Decoded, resized portraits kept in memory
+AVATAR_CACHE_ENTRIES = 256  # Decoded list avatars kept in memory, separately from the portraits
+LIST_AVATAR_SIZE = 36  # Avatar size in the NPC roster and selection lists
+REPOSITORY_NPC_RECORDS = 32  # Full NPC records, portraits included, kept in the shared repository
+NPC_SEARCH_PAGE_SIZE = 200  # Search results fetched per page in the NPC roster
+STREAM_FLUSH_INTERVAL_MS = 50  # How often streamed AI text is appended to the screen
+
+# --- Portrait Storage ---
+PORTRAIT_FORMAT = None  # "WEBP", "JPEG" or "PNG" to re-encode portraits as they are saved; None keeps them as received
+PORTRAIT_QUALITY = 85  # Encoder quality for WEBP and JPEG
+PORTRAIT_MAX_DIMENSION = 640  # Longest side kept; portraits are shown at 300px at most (600px on HiDPI screens)
+PORTRAIT_KEEP_ORIGINALS = False  # Also keep each untouched image in the portrait_originals table
+PORTRAIT_RECOMPRESS_FORMAT = "WEBP"  # What "Compress Portraits" (Maintenance window) re-encodes stored portraits to
+PORTRAIT_RECOMPRESS_BATCH_SIZE = 20  # Portraits re-encoded per transaction by "Compress Portraits"
+THUMBNAIL_SIZES = (48, 96)  # Square thumbnails stored for every portrait; 96px serves HiDPI screens
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_BACKFILL_BATCH_SIZE = 50  # Portraits given thumbnails per transaction by the startup backfill
+PORTRAIT_BLOB_STORE = False  # Save new portraits as files in a folder beside the database (see blob_store.py)
+BLOB_GC_GRACE_SECONDS = 60 * 60  # Unreferenced portrait files younger than this are kept by garbage collection
+
+# --- Metrics ---
+METRICS_ENABLED = True  # Record timings of every API request and database call for the stats panel
+METRICS_MAX_ROWS = 20000  # Newest records kept in the metrics table
+METRICS_FLUSH_SIZE = 50  # Records buffered in memory before they are written
+METRICS_FLUSH_INTERVAL_SECONDS = 5  # ...or at the latest after this long, by a background thread
+
 # --- Logging Configuration ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
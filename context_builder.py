@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import time
+
+from config import CONTEXT_TOKEN_BUDGETS, CONTEXT_CHUNK_TOKENS, CONTEXT_SUMMARY_RATIO
+
+CHARS_PER_TOKEN = 4  # Rough average for English prose with Gemini's tokenizer
+SECTION_LABELS = {
+    "campaign_lore": "campaign lore",
+    "party_info": "player party information",
+    "session_history": "session history",
+}
+
+
+def estimate_tokens(text):
+    """A cheap, offline token estimate, so sizing a prompt never costs an API call."""
+    return (len(text or "") + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class ContextBuilder:
+    """
+    Fits campaign context sections into per-section token budgets.
+
+    Text is cut into paragraph-aligned chunks greedily from the start, so appending to a section
+    (the usual case for session history) leaves every earlier chunk byte-for-byte unchanged. Each
+    chunk's summary is cached in SQLite by content hash, so only new or edited chunks are ever sent
+    to the summarizer. Session history keeps its newest chunks verbatim and summarizes the rest;
+    if the joined summaries are still over budget they are chunked and summarized again.
+    """
+
+    def __init__(self, data_manager, budgets=None, chunk_tokens=CONTEXT_CHUNK_TOKENS,
+                 summary_ratio=CONTEXT_SUMMARY_RATIO):
+        self.db = data_manager
+        self.budgets = dict(CONTEXT_TOKEN_BUDGETS, **(budgets or {}))
+        self.chunk_tokens = chunk_tokens
+        self.summary_ratio = summary_ratio
+
+    def build(self, campaign_data, summarize, sections=("campaign_lore", "party_info", "session_history")):
+        """
+        Returns ({section: fitted_text}, {section: token_estimate}) for the requested sections.
+        `summarize(text, target_tokens, section_label)` is called for chunks that have no cached summary.
+        """
+        fitted, tokens = {}, {}
+        for section in sections:
+            text = (campaign_data or {}).get(section) or ""
+            fitted[section] = self.fit(section, text, summarize)
+            tokens[section] = estimate_tokens(fitted[section])
+        return fitted, tokens
+
+    def fit(self, section, text, summarize):
+        budget = self.budgets.get(section)
+        if not text or budget is None or estimate_tokens(text) <= budget: return text
+        chunks = self._split(text)
+        recent = []
+        if section == "session_history":
+            # The latest sessions matter most, so up to half the budget stays word-for-word.
+            recent_tokens = 0
+            while len(chunks) > 1 and recent_tokens + estimate_tokens(chunks[-1]) <= budget // 2:
+                recent_tokens += estimate_tokens(chunks[-1])
+                recent.insert(0, chunks.pop())
+        remaining_budget = budget - sum(estimate_tokens(chunk) for chunk in recent)
+        try:
+            condensed = self._condense(section, chunks, remaining_budget, summarize)
+        except Exception as e:
+            logging.error(f"Summarizing {section} failed, truncating instead: {e}")
+            condensed = self._truncate("\n\n".join(chunks), remaining_budget, keep_end=section == "session_history")
+        result = "\n\n".join(part for part in [condensed] + recent if part)
+        logging.info(f"Compacted {section} from ~{estimate_tokens(text)} to ~{estimate_tokens(result)} tokens.")
+        return result
+
+    def _condense(self, section, chunks, budget, summarize):
+        label = SECTION_LABELS.get(section, section)
+        target = max(32, int(self.chunk_tokens * self.summary_ratio))
+        for _ in range(4):  # summary levels; each one shrinks the text by roughly summary_ratio
+            summaries = [self._cached_summary(chunk, target, label, summarize) for chunk in chunks]
+            combined = "\n\n".join(summaries)
+            if estimate_tokens(combined) <= budget or len(chunks) == 1: break
+            chunks = self._split(combined)
+        return self._truncate(combined, budget, keep_end=False)
+
+    def _cached_summary(self, chunk, target_tokens, label, summarize):
+        content_hash = hashlib.sha256(f"{label}\0{target_tokens}\0{chunk}".encode("utf-8")).hexdigest()
+        try:
+            row = self.db._get_connection().execute("SELECT summary FROM context_summaries WHERE content_hash = ?",
+                                                    (content_hash,)).fetchone()
+            if row: return row['summary']
+        except sqlite3.Error as e:
+            logging.error(f"Context summary lookup failed: {e}")
+        summary = summarize(chunk, target_tokens, label).strip()
+        try:
+            with self.db.transaction() as conn:
+                conn.execute("INSERT OR REPLACE INTO context_summaries (content_hash, target_tokens, summary, "
+                             "created_at) VALUES (?, ?, ?, ?)", (content_hash, target_tokens, summary, time.time()))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store context summary: {e}")
+        return summary
+
+    def _split(self, text):
+        """Greedy, paragraph-aligned chunks of about `chunk_tokens`; long paragraphs are cut at sentences."""
+        limit = self.chunk_tokens * CHARS_PER_TOKEN
+        pieces = []
+        for paragraph in re.split(r"\n\s*\n", text.strip()):
+            while len(paragraph) > limit:
+                cut = max(paragraph.rfind(". ", 0, limit), paragraph.rfind("\n", 0, limit))
+                cut = cut + 1 if cut > 0 else limit
+                pieces.append(paragraph[:cut].strip())
+                paragraph = paragraph[cut:].strip()
+            if paragraph: pieces.append(paragraph)
+        chunks, current = [], ""
+        for piece in pieces:
+            if current and len(current) + len(piece) + 2 > limit:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current}\n\n{piece}" if current else piece
+        if current: chunks.append(current)
+        return chunks
+
+    @staticmethod
+    def _truncate(text, budget, keep_end):
+        limit = budget * CHARS_PER_TOKEN
+        if len(text) <= limit: return text
+        return "…" + text[-(limit - 1):] if keep_end else text[:limit - 1] + "…"
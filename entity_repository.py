@@ -0,0 +1,179 @@
+import threading
+import tkinter
+from collections import OrderedDict
+
+from config import REPOSITORY_NPC_RECORDS
+
+
+class EntityRepository:
+    """
+    The NPCs and campaigns every window works from, loaded once and kept current from the DataManager's
+    committed changes instead of being re-read by each window.
+
+    NPC summaries and campaigns are held in full; complete NPC records (portraits included) are kept for the
+    `max_records` most recently used. Callers get copies, which don't change under them; a window that shows an
+    entity reads it again when told it changed. A committed change only drops what it touched, without
+    querying on the committing thread; the next read of it loads it again.
+
+    Reads that have to load something query outside the lock, so one that waits on a large portrait never
+    holds up another served from memory. They can still query, so windows make them through AsyncDataManager.
+
+    Windows subscribe to hear which entities changed; callbacks run on the Tk thread, whichever thread
+    committed the change (the Tk thread, a job worker, or an archive import).
+    """
+
+    def __init__(self, data_manager, max_records=REPOSITORY_NPC_RECORDS):
+        self.db = data_manager
+        self.max_records = max_records
+        self._lock = threading.RLock()
+        self._summaries = None  # name -> summary row (None until reloaded after a change), loaded on first use
+        self._campaigns = None  # name -> campaign row (None until reloaded after a change), loaded on first use
+        self._records = OrderedDict()  # name -> full NPC record, least recently used first
+        self._generation = 0  # bumped by every committed change; a load that straddles one isn't kept
+        self._subscribers = []  # (callback, widget)
+        self.db.add_listener(self._on_change)
+
+    # --- NPCs ---
+
+    def _loaded(self, attribute, load):
+        """
+        The rows held in `attribute`, loaded with load() (outside the lock) if there are none yet. Rows loaded
+        while a change committed are returned but not kept, since they may predate it.
+        """
+        with self._lock:
+            rows = getattr(self, attribute)
+            if rows is not None: return rows
+            generation = self._generation
+        rows = load()
+        with self._lock:
+            if self._generation != generation: return rows
+            if getattr(self, attribute) is None: setattr(self, attribute, rows)
+            return getattr(self, attribute)
+
+    def _entry(self, rows, name, load):
+        """A copy of rows[name], reading it again with load(name) if a change marked it; None if unknown."""
+        with self._lock:
+            if name not in rows: return None
+            row = rows[name]
+            if row is not None: return dict(row)
+            generation = self._generation
+        row = load(name)
+        with self._lock:
+            if self._generation == generation and rows.get(name, False) is None:
+                if row is None:
+                    del rows[name]
+                else:
+                    rows[name] = row
+        return dict(row) if row is not None else None
+
+    def _npc_summaries(self):
+        return self._loaded('_summaries', self.db.load_npc_summaries)
+
+    def npc_names(self):
+        summaries = self._npc_summaries()
+        with self._lock:
+            return sorted(summaries)
+
+    def npc_count(self):
+        summaries = self._npc_summaries()
+        with self._lock:
+            return len(summaries)
+
+    def has_npc(self, name):
+        summaries = self._npc_summaries()
+        with self._lock:
+            return name in summaries
+
+    def npc_summary(self, name):
+        return self._entry(self._npc_summaries(), name, self.db.get_npc_summary)
+
+    def get_npc(self, name):
+        """A copy of an NPC's full record, read from the database only if it isn't already held; None if unknown."""
+        with self._lock:
+            record = self._records.get(name)
+            if record is not None:
+                self._records.move_to_end(name)
+                return dict(record)
+            generation = self._generation
+        record = self.db.get_npc(name)
+        if record is None: return None
+        with self._lock:
+            if self._generation == generation: self._remember(name, record)
+        return dict(record)
+
+    def _remember(self, name, record):
+        self._records[name] = record
+        while len(self._records) > self.max_records:
+            self._records.popitem(last=False)
+
+    def save_npc(self, npc_data, old_name=None):
+        self.db.save_npc(npc_data, old_name=old_name)
+
+    def update_npc(self, name, changes):
+        return self.db.update_npc(name, changes)
+
+    def delete_npc(self, name):
+        self.db.delete_npc(name)
+
+    # --- Campaigns ---
+
+    def _campaign_rows(self):
+        return self._loaded('_campaigns', self.db.load_campaigns)
+
+    def campaign_names(self):
+        campaigns = self._campaign_rows()
+        with self._lock:
+            return sorted(campaigns)
+
+    def get_campaign(self, name):
+        """A copy of a campaign's row, or None if unknown."""
+        return self._entry(self._campaign_rows(), name, self.db.get_campaign)
+
+    def save_campaign(self, campaign_data, old_name=None):
+        self.db.save_campaign(campaign_data, old_name=old_name)
+
+    def delete_campaign(self, name):
+        self.db.delete_campaign(name)
+
+    # --- Change notifications ---
+
+    def subscribe(self, callback, widget):
+        """
+        Calls `callback(changes)` on `widget`'s Tk thread with the EntityChanges of each committed write; reads made
+        from the callback see them. The subscription ends with unsubscribe() or once `widget` is destroyed.
+        """
+        with self._lock:
+            self._subscribers.append((callback, widget))
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [(cb, widget) for cb, widget in self._subscribers if cb != callback]
+
+    def _on_change(self, changes):
+        # Runs on the thread that committed the changes, right after the commit: it only forgets what changed.
+        with self._lock:
+            self._generation += 1
+            for change in changes:
+                if change.kind == "npc":
+                    self._records.pop(change.name, None)
+                    if change.old_name: self._records.pop(change.old_name, None)
+                    self._forget(self._summaries, change)
+                elif change.kind == "campaign":
+                    self._forget(self._campaigns, change)
+            subscribers = list(self._subscribers)
+        for callback, widget in subscribers:
+            try:
+                widget.after(0, callback, changes)
+            except (RuntimeError, tkinter.TclError):
+                # The subscribing window has been closed.
+                self.unsubscribe(callback)
+
+    @staticmethod
+    def _forget(rows, change):
+        """Drops a deleted or renamed entity from `rows` and marks a saved one to be read again."""
+        if rows is None: return
+        if change.old_name: rows.pop(change.old_name, None)
+        if change.deleted:
+            rows.pop(change.name, None)
+        else:
+            rows[change.name] = None
@@ -0,0 +1,117 @@
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+
+
+class FakeAPIError(Exception):
+    """Stands in for a google-genai APIError: carries an HTTP `code` and an optional `retry_after` hint."""
+
+    def __init__(self, code, message="Injected failure", retry_after=None):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Image:
+    def __init__(self, image_bytes):
+        self.image_bytes = image_bytes
+
+
+class _GeneratedImage:
+    def __init__(self, image_bytes):
+        self.image = _Image(image_bytes)
+
+
+class _ImagesResponse:
+    def __init__(self, image_bytes):
+        self.generated_images = [_GeneratedImage(image_bytes)]
+
+
+def solid_png(size=64, color=(120, 90, 160)):
+    """A valid single-colour PNG, so fake portraits decode like real ones."""
+    row = b"\x00" + bytes(color) * size
+    raw = zlib.compress(row * size)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", raw) + chunk(b"IEND", b"")
+
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        self._client._before_call("generate_content", model, config)
+        return _Response(self._client._text_for(contents, config))
+
+    def generate_content_stream(self, model, contents, config=None):
+        self._client._before_call("generate_content_stream", model, config)
+        text = self._client._text_for(contents, config)
+        chunk_size = self._client.stream_chunk_chars
+
+        def chunks():
+            for start in range(0, len(text), chunk_size):
+                if self._client.chunk_latency: time.sleep(self._client.chunk_latency)
+                yield _Response(text[start:start + chunk_size])
+
+        return chunks()
+
+    def generate_images(self, model, prompt, config=None):
+        self._client._before_call("generate_images", model, config)
+        return _ImagesResponse(self._client.image_bytes)
+
+
+class FakeGeminiClient:
+    """
+    An offline drop-in for genai.Client covering the calls this app makes.
+
+    `errors` is a list of exceptions (or HTTP status codes) raised by the next calls, in order; after it runs
+    out, `error_rate` injects a 503 at random. `latency` is added to every call and `chunk_latency` between
+    streamed chunks; a call whose config sets an http_options timeout shorter than `latency` times out instead.
+    Schema-constrained requests get a JSON object with every requested field filled in.
+    """
+
+    def __init__(self, latency=0.0, chunk_latency=0.0, error_rate=0.0, errors=None, stream_chunk_chars=40,
+                 image_bytes=None, seed=None):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.error_rate = error_rate
+        self.errors = list(errors or [])
+        self.stream_chunk_chars = stream_chunk_chars
+        self.image_bytes = image_bytes or solid_png()
+        self.calls = []  # (method, model) for every call, including failed ones
+        self.models = _FakeModels(self)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _before_call(self, method, model, config=None):
+        with self._lock:
+            self.calls.append((method, model))
+            error = self.errors.pop(0) if self.errors else None
+            if error is None and self.error_rate and self._random.random() < self.error_rate:
+                error = 503
+        timeout_ms = (config.get("http_options") or {}).get("timeout") if isinstance(config, dict) else None
+        if timeout_ms is not None and self.latency > timeout_ms / 1000:
+            time.sleep(timeout_ms / 1000)
+            raise TimeoutError(f"The request timed out after {timeout_ms}ms.")
+        if self.latency: time.sleep(self.latency)
+        if isinstance(error, int): error = FakeAPIError(error)
+        if error is not None: raise error
+
+    def _text_for(self, contents, config):
+        schema = config.get("response_schema") if isinstance(config, dict) else getattr(config, "response_schema", None)
+        if isinstance(schema, dict):
+            fields = schema.get("propertyOrdering") or list(schema.get("properties", {}))
+            return json.dumps({field: f"Fake {field.replace('_', ' ')} for testing." for field in fields})
+        return f"A fake response to a {len(contents)}-character prompt.\n\nIt says nothing of note."
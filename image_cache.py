@@ -0,0 +1,142 @@
+import hashlib
+import io
+import logging
+import queue
+import threading
+import tkinter
+from collections import OrderedDict
+
+import customtkinter
+from PIL import Image, UnidentifiedImageError
+
+from config import PORTRAIT_CACHE_ENTRIES, AVATAR_CACHE_ENTRIES
+
+
+class PortraitCache:
+    """
+    A size-bounded LRU of decoded, pre-resized portraits keyed by content hash and display size.
+    Cache misses are decoded on a worker thread and handed back to Tk with after().
+    """
+
+    def __init__(self, max_entries=PORTRAIT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}  # key -> (widget, callback) pairs waiting on a decode already queued
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._worker = None
+
+    @staticmethod
+    def make_key(image_bytes, pixel_size):
+        return hashlib.blake2b(image_bytes, digest_size=16).hexdigest(), tuple(pixel_size)
+
+    def request(self, widget, image_bytes, size, callback):
+        """
+        Calls `callback` on the Tk thread with a CTkImage for `image_bytes` at `size`, or None.
+        Returns True if the image was served from the cache and the callback has already run.
+        """
+        if not image_bytes:
+            callback(None)
+            return True
+        scaling = customtkinter.ScalingTracker.get_widget_scaling(widget)
+        pixel_size = (round(size[0] * scaling), round(size[1] * scaling))
+        key = self.make_key(image_bytes, pixel_size)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+            elif key in self._pending:
+                self._pending[key].append((widget, callback))
+                return False
+            else:
+                self._pending[key] = [(widget, callback)]
+        if cached is not None:
+            callback(cached)
+            return True
+        self._ensure_worker()
+        self._requests.put((key, image_bytes, size, pixel_size))
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._decode_loop, name="portrait-decoder", daemon=True)
+            self._worker.start()
+
+    def _decode_loop(self):
+        while True:
+            key, image_bytes, size, pixel_size = self._requests.get()
+            pil_image = None
+            try:
+                with Image.open(io.BytesIO(image_bytes)) as source:
+                    pil_image = source.convert("RGBA").resize(pixel_size, Image.LANCZOS)
+            except (UnidentifiedImageError, OSError, ValueError) as e:
+                logging.error(f"Failed to decode portrait: {e}")
+            self._hand_over(key, pil_image, size)
+
+    def _hand_over(self, key, pil_image, size):
+        """Schedules _deliver on the Tk thread through any window still waiting on `key`, not only the first."""
+        while True:
+            with self._lock:
+                waiting = list(self._pending.get(key, []))
+            for widget, _ in waiting:
+                try:
+                    widget.after(0, self._deliver, key, pil_image, size)
+                    return
+                except (RuntimeError, tkinter.TclError):
+                    continue  # this window closed before the decode finished
+            with self._lock:
+                # Requests that came in while trying are handed over through their own windows.
+                remaining = [entry for entry in self._pending.get(key, []) if entry not in waiting]
+                if not remaining:
+                    self._pending.pop(key, None)
+                    return
+                self._pending[key] = remaining
+
+    def _deliver(self, key, pil_image, size):
+        ctk_image = None
+        if pil_image is not None:
+            ctk_image = customtkinter.CTkImage(light_image=pil_image, dark_image=pil_image, size=size)
+        with self._lock:
+            callbacks = self._pending.pop(key, [])
+            if ctk_image is not None:
+                self._entries[key] = ctk_image
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        for widget, callback in callbacks:
+            if self._alive(widget): callback(ctk_image)
+
+    @staticmethod
+    def _alive(widget):
+        try:
+            return bool(widget.winfo_exists())
+        except tkinter.TclError:
+            return False
+
+
+portrait_cache = PortraitCache()
+avatar_cache = PortraitCache(max_entries=AVATAR_CACHE_ENTRIES)  # list avatars don't push portraits out
+
+
+def blank_image(size):
+    """A transparent CTkImage, so rows without an avatar keep their text aligned with rows that have one."""
+    pil_image = Image.new("RGBA", size, (0, 0, 0, 0))
+    return customtkinter.CTkImage(light_image=pil_image, dark_image=pil_image, size=size)
+
+
+def show_portrait(label, image_bytes, size, placeholder="No Portrait"):
+    """Displays `image_bytes` on a CTkLabel, ignoring results that arrive after a newer request."""
+    request_token = object()
+    label.portrait_request = request_token
+
+    def apply(ctk_image):
+        if getattr(label, "portrait_request", None) is not request_token or not label.winfo_exists(): return
+        label.configure(image=ctk_image, text="" if ctk_image else placeholder)
+        label.image = ctk_image  # Keep reference
+
+    if not portrait_cache.request(label, image_bytes, size, apply):
+        label.configure(image=None, text="Loading portrait...")
+        label.image = None
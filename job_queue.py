@@ -0,0 +1,192 @@
+import logging
+import os
+import threading
+from concurrent.futures import CancelledError, Future
+
+from blob_store import collect_garbage
+from config import JOB_MAX_ATTEMPTS, JOB_RETENTION_SECONDS, JOB_THROUGHPUT_WINDOW_SECONDS
+from portrait_storage import backfill_thumbnails, recompress_portraits, thumbnails_supported
+from services import PRIORITY_BACKGROUND, PRIORITY_WORKSHOP, CancellationToken
+
+
+class JobQueue:
+    """
+    Durable AI jobs: NPC text, portraits and simulations are recorded in the 'jobs' table before they run,
+    so work interrupted by closing a window or the app is picked up again on the next start.
+
+    Jobs run on the GeminiService scheduler at their stored priority. A job's result is committed in one
+    transaction with its status (and, for batch NPCs, with the NPC itself). Windows get results through
+    the Future returned by submit(); a result no window picked up stays 'undelivered' until one does.
+    """
+
+    def __init__(self, data_manager, api_service):
+        self.db = data_manager
+        self.ai = api_service
+        self.handlers = {"npc": self._run_npc, "portrait": self._run_portrait, "simulation": self._run_simulation,
+                         "recompress_portraits": self._run_recompress_portraits,
+                         "thumbnails": self._run_backfill_thumbnails, "blob_gc": self._run_blob_gc}
+        self._tokens = {}  # job id -> CancellationToken, for jobs scheduled in this session
+        self._lock = threading.Lock()
+
+    def submit(self, kind, payload, priority=PRIORITY_WORKSHOP, owner=None, hooks=None):
+        """
+        Records and schedules a job, returning (job_id, Future). The Future resolves to the finished job dict.
+        `hooks` are live callbacks for this session only (e.g. {'on_field': ...}); they are never persisted.
+        """
+        job_id = self.db.enqueue_job(kind, payload, priority, owner)
+        if job_id is None: raise RuntimeError(f"Could not record the {kind} job in the database.")
+        job = {"id": job_id, "kind": kind, "owner": owner, "priority": priority, "payload": payload}
+        return job_id, self._schedule(job, hooks or {})
+
+    def submit_many(self, kind, payloads, priority=PRIORITY_BACKGROUND, owner=None):
+        """Records several jobs in one transaction, then schedules them; returns a list of (job_id, Future)."""
+        job_ids = self.db.enqueue_jobs(kind, payloads, priority, owner)
+        if job_ids is None: raise RuntimeError(f"Could not record the {kind} jobs in the database.")
+        return [(job_id, self._schedule({"id": job_id, "kind": kind, "owner": owner, "priority": priority,
+                                         "payload": payload}, {}))
+                for job_id, payload in zip(job_ids, payloads)]
+
+    def resume(self):
+        """Requeues jobs interrupted last session and schedules everything still queued. Call once at startup."""
+        self.db.prune_jobs(JOB_RETENTION_SECONDS)
+        jobs = self.db.requeue_interrupted_jobs(JOB_MAX_ATTEMPTS)
+        for job in jobs: self._schedule(job, {})
+        if jobs: logging.info(f"Resumed {len(jobs)} unfinished jobs from a previous session.")
+        return len(jobs)
+
+    def backfill_thumbnails(self):
+        """
+        Queues a background job making thumbnails for portraits that have none, if there are any, and returns
+        (job_id, Future) or None. The check reads the NPC table, so call it off the Tk thread.
+        """
+        if not thumbnails_supported() or not self.db.has_missing_thumbnails(): return None
+        return self.submit("thumbnails", {}, priority=PRIORITY_BACKGROUND)
+
+    def collect_blob_garbage(self):
+        """Queues a background job deleting unreferenced portrait blobs, if the blob store has ever been used."""
+        if not os.path.isdir(self.db.blobs.root): return None
+        return self.submit("blob_gc", {}, priority=PRIORITY_BACKGROUND)
+
+    def cancel(self, job_id):
+        with self._lock:
+            token = self._tokens.get(job_id)
+        if token is not None: token.cancel()
+
+    def undelivered(self, kind, owner):
+        """
+        Finished jobs for `owner` that no window has shown yet, newest first. They stay undelivered until the
+        window has shown them and calls mark_delivered(), so a window closed in between gets them again.
+        """
+        return self.db.load_undelivered_jobs(kind, owner)
+
+    def mark_delivered(self, *job_ids):
+        if job_ids: self.db.mark_jobs_delivered(list(job_ids))
+
+    def stats(self):
+        """Queue depth by status and finished jobs per minute over the recent window."""
+        stats = self.db.job_stats(JOB_THROUGHPUT_WINDOW_SECONDS)
+        stats["per_minute"] = stats["finished_recently"] / (JOB_THROUGHPUT_WINDOW_SECONDS / 60)
+        return stats
+
+    def _schedule(self, job, hooks):
+        token = CancellationToken()
+        future = Future()
+        with self._lock:
+            self._tokens[job['id']] = token
+        self.ai.submit(self._execute, job, hooks, future, priority=job['priority'], token=token,
+                       name=f"{job['kind']}-job-{job['id']}").add_done_callback(
+            lambda task: self._on_task_done(job, task, future))
+        return future
+
+    def _on_task_done(self, job, task, future):
+        with self._lock:
+            self._tokens.pop(job['id'], None)
+        if task.cancelled() and not future.done():
+            # Cancelled while still queued; the scheduler never ran it.
+            self.db.fail_job(job['id'], "Cancelled")
+            future.cancel()
+
+    def _execute(self, job, hooks, future):
+        if not future.set_running_or_notify_cancel(): return
+        self.db.start_job(job['id'])
+        try:
+            result, result_blob, npc_to_save = self.handlers[job['kind']](job['payload'], hooks)
+        except (CancelledError, InterruptedError) as e:
+            self.db.fail_job(job['id'], "Cancelled")
+            future.set_exception(e)
+            return
+        except Exception as e:
+            logging.error(f"{job['kind'].capitalize()} job {job['id']} failed: {e}")
+            self.db.fail_job(job['id'], e)
+            future.set_exception(e)
+            return
+        if not self.db.complete_job(job['id'], result, result_blob, npc_to_save):
+            error = RuntimeError(f"Job {job['id']} finished, but its result could not be saved.")
+            self.db.fail_job(job['id'], error)
+            future.set_exception(error)
+            return
+        future.set_result(dict(job, status="done", result=result, result_blob=result_blob))
+
+    def _campaign(self, payload):
+        """
+        The campaign a job runs in. Payloads name it and it is read when the job runs, so a batch doesn't store
+        a copy of the campaign's lore and history with every job.
+        """
+        if 'campaign_data' in payload: return payload['campaign_data']  # queued before payloads named it
+        name = payload.get('campaign_name')
+        return self.db.get_campaign(name) if name else None
+
+    # --- Handlers: each returns (result, result_blob, npc_to_save) ---
+
+    def _run_npc(self, payload, hooks):
+        generated = self.ai.generate_npc_pipelined(
+            payload['params'],
+            campaign_data=self._campaign(payload),
+            include_party=payload.get('include_party', True),
+            include_session=payload.get('include_session', True),
+            on_field=hooks.get('on_field'),
+            with_portrait=payload.get('with_portrait', True)
+        )
+        npc_data = generated['npc']
+        error = generated['portrait_error']
+        result = {"npc": {key: value for key, value in npc_data.items() if key != 'image_data'},
+                  "portrait_error": str(error) if error else None, "timings": generated['timings']}
+        return result, npc_data.get('image_data'), npc_data if payload.get('save') else None
+
+    def _run_portrait(self, payload, hooks):
+        image_bytes = self.ai.generate_npc_portrait(payload['appearance'], bypass_cache=payload.get('bypass_cache'))
+        return {}, image_bytes, None
+
+    def _run_simulation(self, payload, hooks):
+        on_chunk = hooks.get('on_chunk')
+        received = []
+        for chunk in self.ai.simulate_reaction_stream(
+                npc_data=payload['npc_data'],
+                situation=payload['situation'],
+                campaign_data=self._campaign(payload),
+                sim_type=payload.get('sim_type', "Short"),
+                bypass_cache=payload.get('bypass_cache', False)
+        ):
+            received.append(chunk)
+            if on_chunk: on_chunk(chunk)
+        self.ai.scheduler.check_cancelled()  # a cancelled stream ends early; don't store it as a full response
+        return {"text": "".join(received)}, None, None
+
+    def _run_recompress_portraits(self, payload, hooks):
+        on_progress = hooks.get('on_progress')
+
+        def on_batch(stats):
+            self.ai.scheduler.check_cancelled()
+            if on_progress: on_progress(dict(stats))
+
+        # Rows already under the policy are skipped, so a restarted job just carries on.
+        return recompress_portraits(self.db, on_batch=on_batch), None, None
+
+    def _run_backfill_thumbnails(self, payload, hooks):
+        def on_batch(stats):
+            self.ai.scheduler.check_cancelled()
+
+        return backfill_thumbnails(self.db, on_batch=on_batch), None, None
+
+    def _run_blob_gc(self, payload, hooks):
+        return collect_garbage(self.db, self.db.blobs), None, None
@@ -0,0 +1,69 @@
+import json
+
+
+class IncrementalObjectParser:
+    """
+    Parses a JSON object that arrives in pieces and reports each top-level member as soon as it is complete.
+
+    Text before the opening brace (such as a ```json fence) is skipped. Nested values are tracked by depth
+    and reported whole, once their member ends.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False
+        self._text = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        """Consumes `chunk` and returns a list of (key, value) pairs completed by it."""
+        self._text += chunk
+        completed = []
+        text = self._text
+        while self._position < len(text) and not self.complete:
+            char = text[self._position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                if self._depth > 0: self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    if char != "{":
+                        self._depth = 0  # A top-level array is not an object; keep looking for one.
+                    else:
+                        self._member_start = self._position + 1
+            elif char in "}]":
+                if self._depth == 1:
+                    self._close_member(self._position, completed)
+                    self.complete = True
+                self._depth = max(0, self._depth - 1)
+            elif char == "," and self._depth == 1:
+                self._close_member(self._position, completed)
+                self._member_start = self._position + 1
+            self._position += 1
+        return completed
+
+    def _close_member(self, end, completed):
+        member = self._text[self._member_start:end].strip()
+        if not member: return
+        try:
+            parsed = json.loads("{" + member + "}")
+        except json.JSONDecodeError:
+            return  # Malformed member; the caller can ask again for whatever is missing.
+        for key, value in parsed.items():
+            self.fields[key] = value
+            completed.append((key, value))
+
+    @property
+    def text(self):
+        return self._text
@@ -1,7 +1,13 @@
 import customtkinter
-from npc_manager_app import NpcApp
-from npc_simulator_app import NpcSimulatorApp
+import logging
+import threading
+from tkinter import filedialog
+from async_data_manager import when_done
+from config import JOB_STATUS_REFRESH_MS
 from campaign_manager_app import CampaignManagerApp
+from maintenance_app import MaintenanceApp
+from stats_panel_app import StatsPanelApp
+from world_archive import export_world, import_world
 
 
 class MainMenuApp(customtkinter.CTk):
@@ -9,17 +15,21 @@ class MainMenuApp(customtkinter.CTk):
     The main application window, which now manages all other windows and active campaign.
     """
 
-    def __init__(self, data_manager, api_service):
+    def __init__(self, data_manager, api_service, job_queue, repository, async_data):
         super().__init__()
         self.db = data_manager
+        self.repo = repository
+        self.data = async_data
         self.ai = api_service
+        self.jobs = job_queue
         self.toplevel_window = None
+        self._archive_thread = None
+        self._archive_status = ""  # progress of a running export or import, written by its thread
 
-        self.campaigns = {}
         self.active_campaign_name = customtkinter.StringVar()
 
         self.title("DM's AI Toolkit")
-        self.geometry("500x480")
+        self.geometry("500x575")
         self.resizable(False, False)
 
         self.grid_columnconfigure(0, weight=1)
@@ -27,6 +37,8 @@ class MainMenuApp(customtkinter.CTk):
 
         self._create_widgets()
         self.refresh_campaign_list()
+        self._refresh_job_status()
+        self.repo.subscribe(self._on_entities_changed, self)
 
     def _create_widgets(self):
         main_frame = customtkinter.CTkFrame(self)
@@ -56,17 +68,85 @@ class MainMenuApp(customtkinter.CTk):
         simulator_button = customtkinter.CTkButton(main_frame, text="Launch NPC Simulator", height=50,
                                                    command=self.launch_npc_simulator)
         simulator_button.grid(row=6, column=0, padx=20, pady=10, sticky="ew")
+        tools_frame = customtkinter.CTkFrame(main_frame, fg_color="transparent")
+        tools_frame.grid(row=7, column=0, padx=20, pady=(0, 10), sticky="ew")
+        tools_frame.grid_columnconfigure((0, 1, 2, 3), weight=1)
+        for column, (text, command) in enumerate([("Performance Stats", self.launch_stats_panel),
+                                                  ("Maintenance", self.launch_maintenance),
+                                                  ("Export World", self.export_world),
+                                                  ("Import World", self.import_world)]):
+            customtkinter.CTkButton(tools_frame, text=text, fg_color="transparent", border_width=1,
+                                    command=command).grid(row=0, column=column, padx=(0 if column == 0 else 5, 0),
+                                                          sticky="ew")
+
+        self.api_status_label = customtkinter.CTkLabel(main_frame, text="", font=customtkinter.CTkFont(size=12))
+        self.api_status_label.grid(row=8, column=0, padx=20, pady=(10, 0))
+        self.job_status_label = customtkinter.CTkLabel(main_frame, text="", font=customtkinter.CTkFont(size=12),
+                                                       text_color="gray")
+        self.job_status_label.grid(row=9, column=0, padx=20, pady=(0, 20))
+
+    def _refresh_job_status(self):
+        """Shows the API key state and AI job queue depth and throughput, refreshed on a timer."""
+        # The client is created in the background after startup, so a bad key only shows up later.
+        api_ok = self.ai.is_api_key_valid()
+        self.api_status_label.configure(text="API Key Loaded" if api_ok else "API Key Missing!",
+                                        text_color="green" if api_ok else "red")
+        # The counts are a query; the timer restarts once they have been shown.
+        when_done(self, self.data.read(self.jobs.stats), self._show_job_status)
+
+    def _show_job_status(self, future):
+        if future.exception() is None:  # a failed query has been logged; try again on the next tick
+            stats = future.result()
+            status = f"Jobs: {stats['queued']} queued, {stats['running']} running, " \
+                     f"{stats['failed']} failed · {stats['per_minute']:.1f} finished/min"
+            if self._archive_status: status += f"\n{self._archive_status}"
+            self.job_status_label.configure(text=status)
+        self.after(JOB_STATUS_REFRESH_MS, self._refresh_job_status)
+
+    def export_world(self):
+        path = filedialog.asksaveasfilename(title="Export World", defaultextension=".zip",
+                                            filetypes=[("World archive", "*.zip")])
+        if path: self._run_archive_task("Export", export_world, path)
+
+    def import_world(self):
+        path = filedialog.askopenfilename(title="Import World", filetypes=[("World archive", "*.zip")])
+        if path: self._run_archive_task("Import", import_world, path)
+
+    def _run_archive_task(self, label, task, path):
+        """Runs an export or import on a background thread; progress shows under the job status."""
+        if self._archive_thread is not None and self._archive_thread.is_alive(): return
+
+        def on_progress(done, total):
+            self._archive_status = f"{label}: {done} of {total} NPCs"
+
+        def run():
+            try:
+                result = task(self.db, path, on_progress=on_progress)
+            except Exception as e:
+                logging.error(f"World {label.lower()} of {path} failed: {e}")
+                self._archive_status = f"{label} failed: {e}"
+                return
+            if label == "Import":
+                self._archive_status = f"Import finished: {result['npcs']} NPCs and {result['campaigns']} " \
+                                       f"campaigns added, {result['duplicates']} already present."
+                self.jobs.backfill_thumbnails()  # imported portraits come without thumbnails
+            else:
+                self._archive_status = f"Exported {result['counts']['npcs']} NPCs to {path}."
+
+        self._archive_status = f"{label} started..."
+        self._archive_thread = threading.Thread(target=run, name=f"world-{label.lower()}", daemon=True)
+        self._archive_thread.start()
 
-        api_status_text = "API Key Loaded" if self.ai.is_api_key_valid() else "API Key Missing!"
-        api_status_color = "green" if self.ai.is_api_key_valid() else "red"
-        api_status_label = customtkinter.CTkLabel(main_frame, text=api_status_text, font=customtkinter.CTkFont(size=12),
-                                                  text_color=api_status_color)
-        api_status_label.grid(row=7, column=0, padx=20, pady=(10, 20))
+    def _on_entities_changed(self, changes):
+        # Campaigns saved in the Campaign Manager or added by an import.
+        if any(change.kind == "campaign" for change in changes): self.refresh_campaign_list()
 
     def refresh_campaign_list(self):
-        """Reloads campaigns from the DB and updates the dropdown menu."""
-        self.campaigns = self.db.load_campaigns()
-        campaign_names = sorted(self.campaigns.keys())
+        """Updates the dropdown menu from the shared campaign list once it has been read."""
+        when_done(self, self.data.read(self.repo.campaign_names), self._show_campaign_list)
+
+    def _show_campaign_list(self, future):
+        campaign_names = future.result() if future.exception() is None else []
         if not campaign_names:
             self.campaign_dropdown.configure(values=["No Campaigns Found"])
             self.active_campaign_name.set("No Campaigns Found")
@@ -81,19 +161,35 @@ class MainMenuApp(customtkinter.CTk):
     def open_toplevel(self, window_class, **kwargs):
         if self.toplevel_window is not None and self.toplevel_window.winfo_exists():
             self.toplevel_window.destroy()
-        if window_class not in [CampaignManagerApp]:
+        if window_class not in [CampaignManagerApp, StatsPanelApp, MaintenanceApp]:
             self.withdraw()
         self.toplevel_window = window_class(master=self, **kwargs)
         self.toplevel_window.grab_set()
 
     def launch_campaign_manager(self):
-        self.open_toplevel(CampaignManagerApp, data_manager=self.db)
+        self.open_toplevel(CampaignManagerApp, repository=self.repo, async_data=self.data)
+
+    def launch_stats_panel(self):
+        self.open_toplevel(StatsPanelApp, data_manager=self.db, api_service=self.ai, async_data=self.data)
+
+    def launch_maintenance(self):
+        self.open_toplevel(MaintenanceApp, job_queue=self.jobs, async_data=self.data)
+
+    def _with_active_campaign(self, open_window):
+        """Reads the active campaign on the database thread, then calls open_window(campaign_data) ({} if none)."""
+        def opened(future):
+            open_window((future.result() if future.exception() is None else None) or {})
+
+        when_done(self, self.data.read(self.repo.get_campaign, self.active_campaign_name.get()), opened)
 
     def launch_npc_manager(self):
         """Opens the NPC Manager, passing the full active campaign data dictionary."""
-        active_campaign_name = self.active_campaign_name.get()
-        campaign_data = self.campaigns.get(active_campaign_name, {})
-        self.open_toplevel(NpcApp, data_manager=self.db, api_service=self.ai, campaign_data=campaign_data)
+        self._with_active_campaign(self._open_npc_manager)
+
+    def _open_npc_manager(self, campaign_data):
+        from npc_manager_app import NpcApp  # imported on first use; it pulls in Pillow and the portrait cache
+        self.open_toplevel(NpcApp, data_manager=self.db, api_service=self.ai, job_queue=self.jobs,
+                           repository=self.repo, async_data=self.data, campaign_data=campaign_data)
 
     def launch_npc_simulator(self, npc_data=None, campaign_data=None):
         """
@@ -101,8 +197,9 @@ class MainMenuApp(customtkinter.CTk):
         from the main menu button), it gets the active one.
         """
         if campaign_data is None:
-            active_campaign_name = self.active_campaign_name.get()
-            campaign_data = self.campaigns.get(active_campaign_name, {})
+            self._with_active_campaign(lambda campaign: self.launch_npc_simulator(npc_data, campaign))
+            return
 
-        self.open_toplevel(NpcSimulatorApp, data_manager=self.db, api_service=self.ai, npc_data=npc_data,
-                           campaign_data=campaign_data)
\ No newline at end of file
+        from npc_simulator_app import NpcSimulatorApp
+        self.open_toplevel(NpcSimulatorApp, data_manager=self.db, api_service=self.ai, job_queue=self.jobs,
+                           repository=self.repo, async_data=self.data, npc_data=npc_data, campaign_data=campaign_data)
\ No newline at end of file
@@ -0,0 +1,89 @@
+import customtkinter
+import logging
+import tkinter
+
+from async_data_manager import when_done
+from config import PORTRAIT_RECOMPRESS_FORMAT
+from services import PRIORITY_BACKGROUND
+from stats_panel_app import _format_bytes
+
+
+class MaintenanceApp(customtkinter.CTkToplevel):
+    """
+    Database upkeep that changes stored data and so is only ever run on request: re-encoding stored portraits
+    to PORTRAIT_RECOMPRESS_FORMAT, which is lossy and can't be undone unless originals are kept.
+    """
+
+    def __init__(self, master, job_queue, async_data):
+        super().__init__(master)
+        self.master = master
+        self.jobs = job_queue
+        self.data = async_data
+
+        self.title("Maintenance")
+        self.geometry("520x220")
+        self.resizable(False, False)
+
+        self.grid_columnconfigure(0, weight=1)
+
+        self._create_widgets()
+
+    def _create_widgets(self):
+        frame = customtkinter.CTkFrame(self)
+        frame.grid(row=0, column=0, padx=10, pady=10, sticky="nsew")
+        frame.grid_columnconfigure(0, weight=1)
+
+        customtkinter.CTkLabel(frame, text="Compress Portraits", font=customtkinter.CTkFont(weight="bold")).grid(
+            row=0, column=0, padx=10, pady=(10, 0), sticky="w")
+        customtkinter.CTkLabel(frame, text=f"Re-encodes every stored portrait as {PORTRAIT_RECOMPRESS_FORMAT} to save "
+                                           f"space. Some image quality is lost and can't be restored.",
+                               wraplength=460, justify="left").grid(row=1, column=0, padx=10, pady=5, sticky="w")
+        self.compress_button = customtkinter.CTkButton(frame, text="Compress Portraits", width=160,
+                                                       command=self.start_portrait_recompression)
+        self.compress_button.grid(row=2, column=0, padx=10, pady=5, sticky="w")
+        self.compress_status_label = customtkinter.CTkLabel(frame, text="", text_color="gray")
+        self.compress_status_label.grid(row=3, column=0, padx=10, pady=(0, 10), sticky="w")
+
+    def start_portrait_recompression(self):
+        self.compress_button.configure(state="disabled")
+        self.compress_status_label.configure(text="Compressing portraits in the background...")
+        submitted = self.data.call(self.jobs.submit, "recompress_portraits", {}, priority=PRIORITY_BACKGROUND,
+                                   hooks={"on_progress": self._on_recompress_progress})
+        when_done(self, submitted, self._on_recompress_submitted)
+
+    def _on_recompress_submitted(self, submitted):
+        if submitted.exception() is not None:
+            self.compress_button.configure(state="normal")
+            self.compress_status_label.configure(text=str(submitted.exception()))
+            return
+        _, future = submitted.result()
+        future.add_done_callback(lambda done: self._after_safely(self._on_recompress_done, done))
+
+    def _after_safely(self, callback, *args):
+        # Called from the job's thread; the job carries on if this window has been closed.
+        try:
+            self.after(0, callback, *args)
+        except (RuntimeError, tkinter.TclError):
+            pass
+
+    def _on_recompress_progress(self, stats):
+        self._after_safely(self._show_compress_status, self._describe_recompression(stats))
+
+    def _show_compress_status(self, text):
+        self.compress_status_label.configure(text=text)
+
+    def _on_recompress_done(self, future):
+        self.compress_button.configure(state="normal")
+        try:
+            job = future.result()
+        except Exception as e:
+            logging.error(f"Portrait recompression failed: {e}")
+            self.compress_status_label.configure(text=f"Portrait recompression failed: {e}")
+            return
+        self.data.write(self.jobs.mark_delivered, job['id'])
+        self.compress_status_label.configure(text="Done. " + self._describe_recompression(job['result']))
+
+    @staticmethod
+    def _describe_recompression(stats):
+        saved = stats['bytes_before'] - stats['bytes_after']
+        return f"{stats['recompressed']} of {stats['checked']} portraits recompressed, {_format_bytes(saved)} saved."
@@ -0,0 +1,160 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from config import DB_BUSY_TIMEOUT, METRICS_MAX_ROWS, METRICS_FLUSH_SIZE, METRICS_FLUSH_INTERVAL_SECONDS
+
+METRIC_COLUMNS = ["recorded_at", "source", "operation", "model", "wall_ms", "ttfb_ms", "input_tokens",
+                  "output_tokens", "response_bytes", "row_count", "cache_hit", "error"]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list; None when it is empty."""
+    if not sorted_values: return None
+    return sorted_values[max(1, math.ceil(len(sorted_values) * fraction)) - 1]
+
+
+class MetricsRecorder:
+    """
+    Collects one record per API request or DataManager call and stores them in the bounded 'metrics' table.
+
+    Records are buffered in memory and written by a background thread, on its own connection, once
+    `flush_size` have built up or every `flush_interval` seconds. Recording never writes on the caller's
+    thread, so it can't stall the Tk loop or end up inside (and rolled back with) the caller's transaction;
+    neither do flush() and summary(), which hand the buffer to that thread. Only the newest `max_rows` are kept.
+    """
+
+    def __init__(self, data_manager, max_rows=METRICS_MAX_ROWS, flush_size=METRICS_FLUSH_SIZE,
+                 flush_interval=METRICS_FLUSH_INTERVAL_SECONDS):
+        self.db = data_manager
+        self.max_rows = max_rows
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)  # notified after each pass of the background thread
+        self._flush_requests = 0  # flush() calls so far...
+        self._flushes_done = 0  # ...and how many of them the background thread has written for
+        self._wake = threading.Event()
+        self._closed = False
+        self._flusher = None
+
+    def record(self, source, operation, wall_ms, model=None, ttfb_ms=None, input_tokens=None, output_tokens=None,
+               response_bytes=None, row_count=None, cache_hit=None, error=None):
+        entry = (time.time(), source, operation, model, wall_ms, ttfb_ms, input_tokens, output_tokens,
+                 response_bytes, row_count, None if cache_hit is None else int(cache_hit),
+                 None if error is None else str(error)[:200])
+        with self._lock:
+            self._buffer.append(entry)
+            full = len(self._buffer) >= self.flush_size
+        self._ensure_flusher()
+        if full: self._wake.set()
+
+    def _ensure_flusher(self):
+        with self._lock:
+            if self._closed or (self._flusher is not None and self._flusher.is_alive()): return
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._lock:
+                requests = self._flush_requests
+            self._write_buffer()
+            with self._written:
+                self._flushes_done = requests
+                self._written.notify_all()
+
+    def flush(self):
+        """
+        Has the background thread write the buffered records now and waits until it has. Inside a transaction
+        of the calling thread it doesn't wait, since the write would queue behind that transaction's lock.
+        """
+        with self._lock:
+            if self._closed: return
+            self._flush_requests += 1
+            request = self._flush_requests
+        self._ensure_flusher()
+        self._wake.set()
+        if self.db.in_transaction(): return
+        with self._written:
+            self._written.wait_for(lambda: self._flushes_done >= request or self._closed,
+                                   timeout=DB_BUSY_TIMEOUT + 1)
+
+    def close(self):
+        """Stops the background thread and writes whatever is still buffered."""
+        with self._written:
+            self._closed = True
+            flusher = self._flusher
+            self._written.notify_all()
+        self._wake.set()
+        if flusher is not None: flusher.join()
+        self._write_buffer()
+
+    def _write_buffer(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+        if not entries: return
+        placeholders = ", ".join(["?"] * len(METRIC_COLUMNS))
+        try:
+            with self.db.transaction() as conn:
+                conn.executemany(f"INSERT INTO metrics ({', '.join(METRIC_COLUMNS)}) VALUES ({placeholders})",
+                                 entries)
+                newest = conn.execute("SELECT MAX(id) FROM metrics").fetchone()[0] or 0
+                conn.execute("DELETE FROM metrics WHERE id <= ?", (newest - self.max_rows,))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store {len(entries)} metric records: {e}")
+
+    def summary(self, since_seconds=None):
+        """
+        Aggregates records per (source, operation): count, errors, cache hits, wall time and time-to-first-byte
+        percentiles, and token and byte totals. Limited to the last `since_seconds` when given. Buffered records
+        are counted too; the background thread writes them first.
+        """
+        self.flush()
+        sql = "SELECT source, operation, wall_ms, ttfb_ms, input_tokens, output_tokens, response_bytes, " \
+              "row_count, cache_hit, error FROM metrics"
+        params = ()
+        if since_seconds:
+            sql += " WHERE recorded_at >= ?"
+            params = (time.time() - since_seconds,)
+        groups = {}
+        try:
+            for row in self.db._get_connection().execute(sql, params):
+                groups.setdefault((row['source'], row['operation']), []).append(row)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read metrics: {e}")
+            return []
+        summaries = []
+        for (source, operation), rows in sorted(groups.items()):
+            wall = sorted(row['wall_ms'] for row in rows if row['wall_ms'] is not None)
+            ttfb = sorted(row['ttfb_ms'] for row in rows if row['ttfb_ms'] is not None)
+            summaries.append({
+                "source": source,
+                "operation": operation,
+                "count": len(rows),
+                "errors": sum(1 for row in rows if row['error']),
+                "cache_hits": sum(1 for row in rows if row['cache_hit']),
+                "p50_ms": percentile(wall, 0.50),
+                "p95_ms": percentile(wall, 0.95),
+                "p99_ms": percentile(wall, 0.99),
+                "ttfb_p50_ms": percentile(ttfb, 0.50),
+                "input_tokens": sum(row['input_tokens'] or 0 for row in rows),
+                "output_tokens": sum(row['output_tokens'] or 0 for row in rows),
+                "response_bytes": sum(row['response_bytes'] or 0 for row in rows),
+                "rows": sum(row['row_count'] or 0 for row in rows),
+            })
+        return summaries
+
+    def clear(self):
+        with self._lock:
+            self._buffer = []
+        try:
+            with self.db.transaction() as conn:
+                conn.execute("DELETE FROM metrics")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to clear metrics: {e}")
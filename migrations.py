@@ -0,0 +1,245 @@
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+
+from config import MIGRATION_BATCH_SIZE
+
+# A schema step. `prepare(db, batch_size)` does any long, resumable work in its own batched transactions;
+# `apply(conn)` then runs in one transaction together with the PRAGMA user_version bump.
+Migration = namedtuple("Migration", ["version", "description", "apply", "prepare"], defaults=[None])
+
+# Column lists are spelled out here rather than imported, so a migration keeps doing what it did when it
+# was written even after the app's own column lists change.
+NPC_DATA_COLUMNS = ["race_class", "appearance", "personality", "backstory", "plot_hooks", "attitude", "rarity",
+                    "race", "character_class", "environment", "background", "gender", "image_data", "custom_prompt",
+                    "roleplaying_tips"]
+NPC_FTS_COLUMNS = ["name", "appearance", "personality", "backstory", "plot_hooks", "roleplaying_tips"]
+NPC_FACET_COLUMNS = ["race", "character_class", "environment", "rarity", "attitude"]
+CAMPAIGN_DATA_COLUMNS = ["campaign_lore", "party_info", "session_history"]
+
+
+def _add_missing_columns(conn, table, columns):
+    existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for column, column_type in columns:
+        if column not in existing: conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def _npc_search_statements(key):
+    """The FTS5 index over NPC text, keyed on `key`, the triggers that keep it in sync, and the facet indexes."""
+    text_columns = ", ".join(NPC_FTS_COLUMNS)
+    new_values = ", ".join(f"new.{col}" for col in NPC_FTS_COLUMNS)
+    old_values = ", ".join(f"old.{col}" for col in NPC_FTS_COLUMNS)
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS npcs_fts USING fts5({text_columns}, content='npcs', content_rowid='{key}', tokenize='unicode61 remove_diacritics 2');",
+        f"CREATE TRIGGER IF NOT EXISTS npcs_fts_insert AFTER INSERT ON npcs BEGIN INSERT INTO npcs_fts(rowid, {text_columns}) VALUES (new.{key}, {new_values}); END;",
+        f"CREATE TRIGGER IF NOT EXISTS npcs_fts_delete AFTER DELETE ON npcs BEGIN INSERT INTO npcs_fts(npcs_fts, rowid, {text_columns}) VALUES ('delete', old.{key}, {old_values}); END;",
+        f"CREATE TRIGGER IF NOT EXISTS npcs_fts_update AFTER UPDATE OF {text_columns} ON npcs BEGIN INSERT INTO npcs_fts(npcs_fts, rowid, {text_columns}) VALUES ('delete', old.{key}, {old_values}); INSERT INTO npcs_fts(rowid, {text_columns}) VALUES (new.{key}, {new_values}); END;",
+    ]
+    statements += [f"CREATE INDEX IF NOT EXISTS idx_npcs_{col} ON npcs({col} COLLATE NOCASE, name);"
+                   for col in NPC_FACET_COLUMNS]
+    return statements
+
+
+def _copy_in_batches(db, source, target, key, name_column, columns, batch_size):
+    """
+    Copies `source` into `target` in rowid order, one transaction per batch, keeping each row's rowid as its
+    `key`. The largest key already in `target` is therefore where an interrupted copy picks up again.
+    Rows are moved by INSERT ... SELECT, so no batch is ever loaded into Python.
+    """
+    _name_unnamed_rows(db, source, name_column)
+    column_list = ", ".join([name_column] + columns)
+    sql = (f"INSERT INTO {target} ({key}, {column_list}) SELECT rowid, {column_list} FROM {source} "
+           f"WHERE rowid > ? ORDER BY rowid LIMIT ?")
+    copied = 0
+    while True:
+        with db.transaction() as conn:
+            last_key = conn.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {target}").fetchone()[0]
+            count = conn.execute(sql, (last_key, batch_size)).rowcount
+        copied += count
+        if count < batch_size: break
+    if copied: logging.info(f"Copied {copied} rows from '{source}' into '{target}'.")
+
+
+def _name_unnamed_rows(db, table, name_column):
+    """
+    Text primary keys allowed NULL names; the new name column doesn't. Each such row is given a name no other
+    row has ("Unnamed <rowid>", with a further suffix if a real row is already called that).
+    """
+    with db.transaction() as conn:
+        rowids = [row[0] for row in conn.execute(f"SELECT rowid FROM {table} WHERE {name_column} IS NULL")]
+        for rowid in rowids:
+            candidate, suffix = f"Unnamed {rowid}", 1
+            while conn.execute(f"SELECT 1 FROM {table} WHERE {name_column} = ?", (candidate,)).fetchone():
+                suffix += 1
+                candidate = f"Unnamed {rowid} ({suffix})"
+            conn.execute(f"UPDATE {table} SET {name_column} = ? WHERE rowid = ?", (candidate, rowid))
+    if rowids: logging.info(f"Named {len(rowids)} rows of '{table}' that had no name.")
+
+
+# --- Version 1: the NPC and campaign tables as the app first created them ---
+
+def _baseline(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS npcs (name TEXT PRIMARY KEY, race_class TEXT, appearance TEXT, personality TEXT, backstory TEXT, plot_hooks TEXT, attitude TEXT, rarity TEXT, race TEXT, character_class TEXT, environment TEXT, background TEXT, gender TEXT, image_data BLOB, custom_prompt TEXT, roleplaying_tips TEXT);")
+    conn.execute("CREATE TABLE IF NOT EXISTS campaigns (campaign_name TEXT PRIMARY KEY, campaign_lore TEXT, party_info TEXT, session_history TEXT);")
+    # Databases from before party info and session history were added.
+    _add_missing_columns(conn, "campaigns", [("party_info", "TEXT"), ("session_history", "TEXT")])
+
+
+# --- Version 2: full-text search over NPCs and indexes for the roster's facet filters ---
+
+def _npc_search(conn):
+    has_index = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'npcs_fts'").fetchone() is not None
+    for statement in _npc_search_statements("rowid"): conn.execute(statement)
+    if not has_index: conn.execute("INSERT INTO npcs_fts(npcs_fts) VALUES ('rebuild')")
+
+
+# --- Version 3: cached simulation and portrait responses ---
+
+def _response_cache(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS response_cache (cache_key TEXT PRIMARY KEY, model TEXT, kind TEXT, text_value TEXT, blob_hash TEXT, size INTEGER, created_at REAL, last_used REAL);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache(last_used);")
+    conn.execute("CREATE TABLE IF NOT EXISTS response_blobs (blob_hash TEXT PRIMARY KEY, data BLOB, size INTEGER);")
+
+
+# --- Version 4: summaries of campaign context chunks, by content hash ---
+
+def _context_summaries(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS context_summaries (content_hash TEXT PRIMARY KEY, target_tokens INTEGER, summary TEXT, created_at REAL);")
+
+
+# --- Version 5: the durable AI job queue ---
+
+def _jobs(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, owner TEXT, status TEXT NOT NULL, priority INTEGER, payload TEXT, result TEXT, result_blob BLOB, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, delivered INTEGER NOT NULL DEFAULT 0, created_at REAL, started_at REAL, finished_at REAL);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, finished_at);")
+
+
+# --- Version 6: per-call timings for the stats panel ---
+
+def _metrics(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS metrics (id INTEGER PRIMARY KEY AUTOINCREMENT, recorded_at REAL, source TEXT, operation TEXT, model TEXT, wall_ms REAL, ttfb_ms REAL, input_tokens INTEGER, output_tokens INTEGER, response_bytes INTEGER, row_count INTEGER, cache_hit INTEGER, error TEXT);")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_recorded_at ON metrics (recorded_at);")
+
+
+# --- Version 7: NPCs keyed by an integer id, with the name as a unique column ---
+
+def _copy_npcs(db, batch_size):
+    with db.transaction() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS npcs_rebuild (npc_id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE, race_class TEXT, appearance TEXT, personality TEXT, backstory TEXT, plot_hooks TEXT, attitude TEXT, rarity TEXT, race TEXT, character_class TEXT, environment TEXT, background TEXT, gender TEXT, image_data BLOB, custom_prompt TEXT, roleplaying_tips TEXT);")
+    _copy_in_batches(db, "npcs", "npcs_rebuild", "npc_id", "name", NPC_DATA_COLUMNS, batch_size)
+
+
+def _swap_npc_tables(conn):
+    for trigger in ("npcs_fts_insert", "npcs_fts_delete", "npcs_fts_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS npcs_fts")
+    conn.execute("DROP TABLE npcs")
+    conn.execute("ALTER TABLE npcs_rebuild RENAME TO npcs")
+    for statement in _npc_search_statements("npc_id"): conn.execute(statement)
+    conn.execute("INSERT INTO npcs_fts(npcs_fts) VALUES ('rebuild')")
+
+
+# --- Version 8: campaigns keyed by an integer id ---
+
+def _copy_campaigns(db, batch_size):
+    with db.transaction() as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS campaigns_rebuild (campaign_id INTEGER PRIMARY KEY AUTOINCREMENT, campaign_name TEXT NOT NULL UNIQUE, campaign_lore TEXT, party_info TEXT, session_history TEXT);")
+    _copy_in_batches(db, "campaigns", "campaigns_rebuild", "campaign_id", "campaign_name", CAMPAIGN_DATA_COLUMNS,
+                     batch_size)
+
+
+def _swap_campaign_tables(conn):
+    conn.execute("DROP TABLE campaigns")
+    conn.execute("ALTER TABLE campaigns_rebuild RENAME TO campaigns")
+
+
+# --- Version 9: index for a window's undelivered job lookup ---
+
+def _index_job_owners(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs (kind, owner, delivered)")
+
+
+# --- Version 10: progress of world archive imports, so an interrupted import can resume ---
+
+def _archive_import_progress(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS archive_imports (export_id TEXT NOT NULL, member TEXT NOT NULL, lines_done INTEGER NOT NULL, finished_at REAL, PRIMARY KEY (export_id, member));")
+
+
+# --- Version 11: a cold table for the original portraits replaced by compressed copies ---
+
+def _portrait_originals(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS portrait_originals (npc_id INTEGER PRIMARY KEY, image_data BLOB, stored_at REAL);")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS npcs_portrait_originals_delete AFTER DELETE ON npcs BEGIN DELETE FROM portrait_originals WHERE npc_id = old.npc_id; END;")
+
+
+# --- Version 12: small square thumbnails of each portrait, for list avatars ---
+
+def _npc_thumbnails(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS npc_thumbnails (npc_id INTEGER NOT NULL, size INTEGER NOT NULL, portrait_hash TEXT NOT NULL, image_data BLOB NOT NULL, PRIMARY KEY (npc_id, size));")
+    conn.execute("CREATE TRIGGER IF NOT EXISTS npcs_thumbnails_delete AFTER DELETE ON npcs BEGIN DELETE FROM npc_thumbnails WHERE npc_id = old.npc_id; END;")
+    # Thumbnails of a replaced portrait are dropped with the write itself; whoever wrote it stores new ones.
+    conn.execute("CREATE TRIGGER IF NOT EXISTS npcs_thumbnails_invalidate AFTER UPDATE OF image_data ON npcs WHEN old.image_data IS NOT new.image_data BEGIN DELETE FROM npc_thumbnails WHERE npc_id = new.npc_id; END;")
+
+
+# --- Version 13: portraits kept in the external blob store, by hash, with per-hash reference counts ---
+
+def _portrait_blob_refs(conn):
+    _add_missing_columns(conn, "npcs", [("portrait_hash", "TEXT")])
+    conn.execute("CREATE TABLE IF NOT EXISTS blob_refs (blob_hash TEXT PRIMARY KEY, refcount INTEGER NOT NULL);")
+    add_ref = ("INSERT INTO blob_refs (blob_hash, refcount) SELECT new.portrait_hash, 1 WHERE new.portrait_hash IS NOT "
+               "NULL ON CONFLICT(blob_hash) DO UPDATE SET refcount = refcount + 1;")
+    drop_ref = "UPDATE blob_refs SET refcount = refcount - 1 WHERE blob_hash = old.portrait_hash;"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS npcs_blob_refs_insert AFTER INSERT ON npcs BEGIN {add_ref} END;")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS npcs_blob_refs_delete AFTER DELETE ON npcs BEGIN {drop_ref} END;")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS npcs_blob_refs_update AFTER UPDATE OF portrait_hash ON npcs WHEN old.portrait_hash IS NOT new.portrait_hash BEGIN {drop_ref} {add_ref} END;")
+    # Moving a portrait into the store changes both columns but not the picture, so thumbnails made from the
+    # same hash survive it.
+    keep_same = "AND (new.portrait_hash IS NULL OR portrait_hash IS NOT new.portrait_hash)"
+    conn.execute("DROP TRIGGER IF EXISTS npcs_thumbnails_invalidate")
+    conn.execute(f"CREATE TRIGGER npcs_thumbnails_invalidate AFTER UPDATE OF image_data ON npcs WHEN old.image_data IS NOT new.image_data BEGIN DELETE FROM npc_thumbnails WHERE npc_id = new.npc_id {keep_same}; END;")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS npcs_thumbnails_invalidate_blob AFTER UPDATE OF portrait_hash ON npcs WHEN old.portrait_hash IS NOT new.portrait_hash BEGIN DELETE FROM npc_thumbnails WHERE npc_id = new.npc_id {keep_same}; END;")
+
+
+MIGRATIONS = [
+    Migration(1, "NPC and campaign tables", _baseline),
+    Migration(2, "NPC search index", _npc_search),
+    Migration(3, "response cache", _response_cache),
+    Migration(4, "context summaries", _context_summaries),
+    Migration(5, "job queue", _jobs),
+    Migration(6, "metrics", _metrics),
+    Migration(7, "integer keys for NPCs", _swap_npc_tables, _copy_npcs),
+    Migration(8, "integer keys for campaigns", _swap_campaign_tables, _copy_campaigns),
+    Migration(9, "job owner index", _index_job_owners),
+    Migration(10, "archive import progress", _archive_import_progress),
+    Migration(11, "portrait originals", _portrait_originals),
+    Migration(12, "portrait thumbnails", _npc_thumbnails),
+    Migration(13, "portrait blob references", _portrait_blob_refs),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def migrate(db, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Brings the database up to LATEST_VERSION, tracked in PRAGMA user_version, and returns the version it
+    ended at. Each migration commits atomically with its version bump; a failed one stops the run and is
+    retried on the next start, resuming any batched copy where it left off.
+    """
+    version = db._get_connection().execute("PRAGMA user_version").fetchone()[0]
+    if version > LATEST_VERSION:
+        logging.warning(f"Database schema version {version} is newer than this app knows ({LATEST_VERSION}).")
+    for migration in MIGRATIONS:
+        if migration.version <= version: continue
+        started = time.perf_counter()
+        try:
+            if migration.prepare: migration.prepare(db, batch_size)
+            with db.transaction() as conn:
+                migration.apply(conn)
+                conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+        except sqlite3.Error as e:
+            logging.error(f"Database migration {migration.version} ({migration.description}) failed: {e}")
+            return version
+        version = migration.version
+        logging.info(f"Migrated the database to version {version} ({migration.description}) in "
+                     f"{time.perf_counter() - started:.2f}s.")
+    return version
@@ -1,15 +1,18 @@
 import customtkinter
+import tkinter
 from tkinter import filedialog
-import threading
-import io
 import logging
-from PIL import Image, UnidentifiedImageError
+import re
 
+from async_data_manager import when_done
 from config import (
     GENDER_OPTIONS, ATTITUDE_OPTIONS, RARITY_OPTIONS, ENVIRONMENT_OPTIONS,
-    RACE_OPTIONS, CLASS_OPTIONS, BACKGROUND_OPTIONS
+    RACE_OPTIONS, CLASS_OPTIONS, BACKGROUND_OPTIONS, NPC_SEARCH_PAGE_SIZE, LIST_AVATAR_SIZE
 )
-from npc_simulator_app import NpcSimulatorApp
+from image_cache import show_portrait
+from services import NPC_COLUMNS, NPC_FACET_COLUMNS, PRIORITY_WORKSHOP, PRIORITY_BACKGROUND, \
+    format_stage_timings
+from virtual_list import VirtualList
 
 
 class NpcApp(customtkinter.CTkToplevel):
@@ -17,31 +20,38 @@ class NpcApp(customtkinter.CTkToplevel):
     The main application window for the NPC Manager.
     """
 
-    def __init__(self, master, data_manager, api_service, campaign_data=None):
+    def __init__(self, master, data_manager, api_service, job_queue, repository, async_data, campaign_data=None):
         super().__init__(master)
         self.master = master
         self.db = data_manager
+        self.repo = repository
+        self.data = async_data  # queries and saves made from this window, run off the Tk thread
         self.ai = api_service
+        self.jobs = job_queue
         self.campaign_data = campaign_data or {}
 
         self.title("D&D NPC Manager")
         self.geometry("1100x750")
         self.minsize(1100, 750)
 
-        self.npcs = self.db.load_data()
         self.selected_npc_name = None
+        self._roster_npc = {}
+        self._search_after_id = None
+        self._search_next_offset = None
+        self._search_request = None  # Future of the latest search; older results are dropped
+        self._list_request = None  # Future of the latest read of the whole roster, likewise
         self._npc_in_workshop = {}
         self._workshop_original_name = None
-
-        self.roster_ctk_image = None
-        self.workshop_ctk_image = None
+        self._workshop_saved = {}  # the workshop NPC as stored in the database, to find which fields changed
+        self._batch_progress = None
 
         self.grid_columnconfigure(1, weight=1)
         self.grid_rowconfigure(0, weight=1)
 
         self._create_widgets()
-        self.update_npc_list()
-        self.select_first_npc()
+        self.update_npc_list(on_loaded=self.select_first_npc)
+        self._recover_workshop_results()
+        self.repo.subscribe(self._on_npcs_changed, self)
 
         self.protocol("WM_DELETE_WINDOW", self.go_home)
 
@@ -52,7 +62,7 @@ class NpcApp(customtkinter.CTkToplevel):
     def _setup_sidebar(self):
         self.sidebar_frame = customtkinter.CTkFrame(self, width=250, corner_radius=0)
         self.sidebar_frame.grid(row=0, column=0, sticky="nsew")
-        self.sidebar_frame.grid_rowconfigure(3, weight=1)
+        self.sidebar_frame.grid_rowconfigure(4, weight=1)
         customtkinter.CTkLabel(self.sidebar_frame, text="Your NPCs",
                                font=customtkinter.CTkFont(size=20, weight="bold")).grid(row=0, column=0, padx=20,
                                                                                         pady=(20, 10))
@@ -63,9 +73,14 @@ class NpcApp(customtkinter.CTkToplevel):
                                                                                                             padx=20,
                                                                                                             pady=10,
                                                                                                             sticky="ew")
-        self.npc_list_frame = customtkinter.CTkScrollableFrame(self.sidebar_frame, label_text="NPC Roster")
-        self.npc_list_frame.grid(row=3, column=0, padx=20, pady=10, sticky="nsew")
-        self.npc_buttons = {}
+        self.search_entry = customtkinter.CTkEntry(self.sidebar_frame, placeholder_text="Search (e.g. race:elf smuggler)")
+        self.search_entry.grid(row=3, column=0, padx=20, pady=(10, 0), sticky="ew")
+        self.search_entry.bind("<KeyRelease>", self._on_search_changed)
+        self.npc_list_frame = VirtualList(self.sidebar_frame, label_text="NPC Roster", command=self.select_npc,
+                                          empty_text="No matching NPCs.", on_end_reached=self._load_more_results,
+                                          thumbnail_loader=self.data.get_thumbnails, thumbnail_size=LIST_AVATAR_SIZE,
+                                          row_height=LIST_AVATAR_SIZE + 10)
+        self.npc_list_frame.grid(row=4, column=0, padx=20, pady=10, sticky="nsew")
 
     def _setup_main_tabs(self):
         self.tabview = customtkinter.CTkTabview(self, corner_radius=10, command=self._on_tab_change)
@@ -155,6 +170,10 @@ class NpcApp(customtkinter.CTkToplevel):
                                 command=self.start_image_generation_thread).pack(side="left", padx=5, expand=True)
         customtkinter.CTkButton(workshop_portrait_buttons, text="Upload Portrait", command=self.upload_portrait).pack(
             side="left", padx=5, expand=True)
+        self.bypass_cache_var = customtkinter.BooleanVar(value=False)
+        if self.ai.response_cache is not None:
+            customtkinter.CTkCheckBox(workshop_portrait_buttons, text="Fresh", variable=self.bypass_cache_var).pack(
+                side="left", padx=5)
         tags_and_gen_frame = customtkinter.CTkFrame(right_panel_frame)
         tags_and_gen_frame.grid(row=1, column=0, sticky="nsew", pady=(10, 0))
         tags_and_gen_frame.grid_columnconfigure(0, weight=1)
@@ -195,10 +214,19 @@ class NpcApp(customtkinter.CTkToplevel):
         self.custom_prompt_textbox.grid(row=3, column=0, padx=10, pady=5, sticky="ew")
         self.generate_button = customtkinter.CTkButton(tags_and_gen_frame, text="Generate with AI", height=40,
                                                        command=self.start_generation_thread)
-        self.generate_button.grid(row=4, column=0, padx=10, pady=10, sticky="ew")
+        self.generate_button.grid(row=4, column=0, padx=10, pady=(10, 5), sticky="ew")
+        batch_frame = customtkinter.CTkFrame(tags_and_gen_frame, fg_color="transparent")
+        batch_frame.grid(row=5, column=0, padx=10, pady=(0, 5), sticky="ew")
+        batch_frame.grid_columnconfigure(1, weight=1)
+        self.batch_count_entry = customtkinter.CTkEntry(batch_frame, width=60)
+        self.batch_count_entry.insert(0, "10")
+        self.batch_count_entry.grid(row=0, column=0, padx=(0, 10))
+        self.batch_generate_button = customtkinter.CTkButton(batch_frame, text="Generate N and Save to Roster",
+                                                             command=self.start_batch_generation_thread)
+        self.batch_generate_button.grid(row=0, column=1, sticky="ew")
         self.workshop_status_textbox = customtkinter.CTkTextbox(tags_and_gen_frame, height=80, wrap="word",
                                                                 state="disabled")
-        self.workshop_status_textbox.grid(row=5, column=0, padx=10, pady=5, sticky="ew")
+        self.workshop_status_textbox.grid(row=6, column=0, padx=10, pady=5, sticky="ew")
         customtkinter.CTkButton(workshop_tab, text="Save NPC in Workshop", height=40,
                                 command=self.save_workshop_npc).grid(row=1, column=0, padx=10, pady=(10, 10),
                                                                      sticky="s")
@@ -207,48 +235,177 @@ class NpcApp(customtkinter.CTkToplevel):
         if not self.ai.is_api_key_valid():
             self._update_textbox(self.workshop_status_textbox, "Error: Gemini API Key is missing or invalid.")
             return
-        threading.Thread(target=self._run_generation_task, daemon=True).start()
-
-    def _run_generation_task(self):
-        self.after(0, lambda: self.generate_button.configure(state="disabled"))
-        self.after(0, lambda: self._update_textbox(self.workshop_status_textbox, "Generating NPC with Gemini..."))
+        payload = {
+            "params": self._collect_generation_params(),
+            "campaign_name": self.campaign_data.get('campaign_name'),
+            "include_party": self.include_party_var.get(),
+            "include_session": self.include_session_var.get(),
+        }
+        # Stream the text into the workshop; the portrait starts as soon as the appearance is known
+        self._submit_job(self._on_generation_done, "npc", payload, priority=PRIORITY_WORKSHOP, owner="workshop",
+                         hooks={"on_field": self._on_generated_field})
+        self.generate_button.configure(state="disabled")
+        self._update_textbox(self.workshop_status_textbox, "Generating NPC with Gemini...")
+        self._clear_workshop_text_fields()
+
+    def _submit_job(self, handler, *args, **kwargs):
+        """
+        Records and schedules a job (JobQueue.submit) on the database thread, then calls handler(future) on the
+        Tk thread once the job finishes. A job that couldn't be recorded reaches the handler as a failed future.
+        """
+        submitted = self.data.call(self.jobs.submit, *args, **kwargs)
+        submitted.add_done_callback(lambda done: self._deliver_when_done(
+            done.result()[1] if done.exception() is None else done, handler))
+
+    def _deliver_when_done(self, future, handler):
+        """Calls handler(future) on the Tk thread once a job finishes, if this window is still open."""
+
+        def deliver(done):
+            try:
+                self.after(0, handler, done)
+            except (RuntimeError, tkinter.TclError):
+                pass  # The window closed; the result stays undelivered and is recovered on the next open.
+
+        future.add_done_callback(deliver)
+
+    def _on_generation_done(self, future):
+        self.generate_button.configure(state="normal")
         try:
-            params = {
-                'gender': self.gender_var.get(), 'attitude': self.attitude_var.get(),
-                'rarity': self.rarity_var.get(), 'environment': self.environment_var.get(),
-                'race': self.race_var.get(), 'character_class': self.class_var.get(),
-                'background': self.background_var.get(),
-                'custom_prompt': self.custom_prompt_textbox.get("1.0", "end-1c").strip()
-            }
-            include_party = self.include_party_var.get()
-            include_session = self.include_session_var.get()
-
-            # First, get the text data for the NPC
-            npc_data, _ = self.ai.generate_npc(
-                params,
-                campaign_data=self.campaign_data,
-                include_party=include_party,
-                include_session=include_session
-            )
-
-            # Then, immediately generate the image for the new description
-            self.after(0, lambda: self._update_textbox(self.workshop_status_textbox, "Generating portrait..."))
-            image_bytes = self.ai.generate_npc_portrait(npc_data.get("appearance", ""))
-            npc_data['image_data'] = image_bytes
-
-            # Finally, update the UI with all the new data at once
-            self.after(0, self.populate_workshop_fields, npc_data)
-            self.after(0, lambda: self._update_textbox(self.workshop_status_textbox,
-                                                       "NPC and Portrait generated successfully!"))
-
+            job = future.result()
         except Exception as e:
             logging.error(f"Generation failed: {e}")
-            self.after(0,
-                       lambda err=e: self._update_textbox(self.workshop_status_textbox, f"Generation Error:\n\n{err}"))
-        finally:
-            self.after(0, lambda: self.generate_button.configure(state="normal"))
+            self._update_textbox(self.workshop_status_textbox, f"Generation Error:\n\n{e}")
+            return
+        self.data.write(self.jobs.mark_delivered, job['id'])
+        self._apply_generated_npc(job)
+
+    def _apply_generated_npc(self, job, note=""):
+        npc_data = dict(job['result']['npc'])
+        if job.get('result_blob'): npc_data['image_data'] = job['result_blob']
+        self.populate_workshop_fields(npc_data)
+        timing_summary = format_stage_timings(job['result'].get('timings', {}))
+        portrait_error = job['result'].get('portrait_error')
+        if portrait_error:
+            message = f"NPC generated, but the portrait failed:\n{portrait_error}\n\n{timing_summary}"
+        else:
+            message = f"NPC and Portrait generated successfully!\n{timing_summary}"
+        self._update_textbox(self.workshop_status_textbox, note + message)
+
+    def _recover_workshop_results(self):
+        """Shows an NPC or portrait that finished after the workshop was last closed."""
+        npc_jobs = self.data.read(self.jobs.undelivered, "npc", "workshop")
+        portrait_jobs = self.data.read(self.jobs.undelivered, "portrait", "workshop")
+        # Requests run in order, so the NPC jobs have loaded by the time the portrait jobs have.
+        when_done(self, portrait_jobs, lambda done: self._show_recovered_results(npc_jobs.result(), done.result()))
+
+    def _show_recovered_results(self, npc_jobs, portrait_jobs):
+        if npc_jobs:
+            self._apply_generated_npc(npc_jobs[0], note="Recovered an NPC that finished while the workshop was closed.\n")
+        elif portrait_jobs and portrait_jobs[0].get('result_blob'):
+            self._npc_in_workshop['image_data'] = portrait_jobs[0]['result_blob']
+            self._update_workshop_image_display()
+            self._update_textbox(self.workshop_status_textbox,
+                                 "Recovered a portrait that finished while the workshop was closed.")
+        # Shown now; older ones were superseded by the newest.
+        job_ids = [job['id'] for job in npc_jobs + portrait_jobs]
+        if job_ids: self.data.write(self.jobs.mark_delivered, *job_ids)
+
+    def _on_generated_field(self, key, value):
+        # Runs on a worker thread; the job must keep going even if this window has been closed.
+        try:
+            self.after(0, self._set_workshop_field, key, value)
+            if key == 'appearance':
+                self.after(0, lambda: self._update_textbox(self.workshop_status_textbox,
+                                                           "Generating NPC text and portrait in parallel..."))
+        except (RuntimeError, tkinter.TclError):
+            pass
+
+    def start_batch_generation_thread(self):
+        if not self.ai.is_api_key_valid():
+            self._update_textbox(self.workshop_status_textbox, "Error: Gemini API Key is missing or invalid.")
+            return
+        try:
+            count = int(self.batch_count_entry.get())
+            if not 1 <= count <= 500: raise ValueError
+        except ValueError:
+            self._update_textbox(self.workshop_status_textbox, "Error: Batch size must be a number from 1 to 500.")
+            return
+        # Each NPC is its own durable background job, saved to the roster in the transaction that completes it.
+        payload = {
+            "params": self._collect_generation_params(),
+            "campaign_name": self.campaign_data.get('campaign_name'),
+            "include_party": self.include_party_var.get(),
+            "include_session": self.include_session_var.get(),
+            "save": True,
+        }
+        self._batch_progress = {"count": count, "finished": 0, "failures": []}
+        self.batch_generate_button.configure(state="disabled")
+        self._update_textbox(self.workshop_status_textbox, f"Batch: 0/{count} finished.")
+
+        def deliver(submitted):
+            # On the database thread, once all the jobs are recorded in one transaction (or failed to be).
+            futures = [future for _, future in submitted.result()] if submitted.exception() is None \
+                else [submitted] * count
+            for index, future in enumerate(futures):
+                self._deliver_when_done(future, lambda done, i=index: self._on_batch_item_done(i, done))
+
+        self.data.call(self.jobs.submit_many, "npc", [payload] * count, priority=PRIORITY_BACKGROUND,
+                       owner="batch").add_done_callback(deliver)
+
+    def _on_batch_item_done(self, index, future):
+        progress = self._batch_progress
+        progress["finished"] += 1
+        try:
+            job = future.result()  # the saved NPC reaches the roster through _on_npcs_changed
+            if job['result'].get('portrait_error'):
+                progress["failures"].append((index, "portrait", job['result']['portrait_error']))
+        except Exception as e:
+            progress["failures"].append((index, "NPC", e))
+        count, failures = progress["count"], progress["failures"]
+        if progress["finished"] < count:
+            self._update_textbox(self.workshop_status_textbox,
+                                 f"Batch: {progress['finished']}/{count} finished, {len(failures)} with errors.")
+            return
+        saved = count - sum(1 for _, what, _ in failures if what == "NPC")
+        lines = [f"Batch finished: {saved}/{count} NPCs saved."]
+        for failed_index, what, error in sorted(failures, key=lambda failure: failure[0]):
+            lines.append(f"#{failed_index + 1} {what} failed: {error}")
+        self._update_textbox(self.workshop_status_textbox, "\n".join(lines))
+        self.batch_generate_button.configure(state="normal")
+
+    def _on_npcs_changed(self, changes):
+        """Applies NPCs saved or deleted anywhere (batch jobs, imports, the simulator) to the roster list."""
+        npc_changes = [change for change in changes if change.kind == "npc"]
+        if not npc_changes: return
+        for change in npc_changes:
+            if self.selected_npc_name in (change.name, change.old_name) and not change.deleted:
+                # The shown record is a copy; read the new version (a delete is left to _on_npc_deleted).
+                self.selected_npc_name = change.name
+                self._load_selected_npc(change.name)
+        if self.search_entry.get().strip():
+            self._on_search_changed()  # whether they match is up to the search
+            return
+        for change in npc_changes:
+            if change.deleted:
+                self.npc_list_frame.remove(change.name)
+                continue
+            if change.old_name:
+                self.npc_list_frame.rename(change.old_name, change.name)
+            else:
+                self.npc_list_frame.insert(change.name)
+            self.npc_list_frame.refresh_thumbnail(change.name)
+
+    def _collect_generation_params(self):
+        return {
+            'gender': self.gender_var.get(), 'attitude': self.attitude_var.get(),
+            'rarity': self.rarity_var.get(), 'environment': self.environment_var.get(),
+            'race': self.race_var.get(), 'character_class': self.class_var.get(),
+            'background': self.background_var.get(),
+            'custom_prompt': self.custom_prompt_textbox.get("1.0", "end-1c").strip()
+        }
 
     def go_home(self):
+        self.repo.unsubscribe(self._on_npcs_changed)
         self.master.deiconify(); self.destroy()
 
     def _create_roster_label_field(self, parent, text, row):
@@ -280,21 +437,70 @@ class NpcApp(customtkinter.CTkToplevel):
         customtkinter.CTkOptionMenu(parent, variable=variable, values=values).grid(row=row, column=col + 1,
                                                                                    padx=(0, 10), pady=5, sticky="ew")
 
-    def update_npc_list(self):
-        for widget in self.npc_list_frame.winfo_children(): widget.destroy()
-        sorted_npc_names = sorted(self.npcs.keys())
-        self.npc_buttons = {}
-        for name in sorted_npc_names:
-            button = customtkinter.CTkButton(self.npc_list_frame, text=name, command=lambda n=name: self.select_npc(n))
-            button.pack(pady=5, padx=5, fill="x")
-            self.npc_buttons[name] = button
+    def _on_search_changed(self, event=None):
+        # Debounced so a search runs once the user pauses typing, not on every key.
+        if self._search_after_id: self.after_cancel(self._search_after_id)
+        self._search_after_id = self.after(200, self._run_search)
+
+    def _parse_search(self):
+        """Splits the search box into free text and facet filters written as `field:value` or `field:"two words"`."""
+        aliases = {"class": "character_class"}
+        facets = {}
+
+        def take_facet(match):
+            field = aliases.get(match.group(1).lower(), match.group(1).lower())
+            if field not in NPC_FACET_COLUMNS: return match.group(0)
+            facets[field] = match.group(2) if match.group(2) is not None else match.group(3)
+            return " "
+
+        text = re.sub(r'(\w+):(?:"([^"]*)"|(\S+))', take_facet, self.search_entry.get())
+        return text.strip(), facets
+
+    def _run_search(self):
+        self._search_after_id = None
+        query, facets = self._parse_search()
+        if not query and not facets:
+            self._search_request = None
+            self._search_next_offset = None
+            self.update_npc_list()
+            return
+        self._search_request = self.data.search_npcs(query, facets, limit=NPC_SEARCH_PAGE_SIZE, count_facets=False)
+        when_done(self, self._search_request, lambda done: self._on_search_results(done, more=False))
+
+    def _load_more_results(self):
+        if not self._search_next_offset or self._search_request is None: return
+        query, facets = self._parse_search()
+        self._search_request = self.data.search_npcs(query, facets, limit=NPC_SEARCH_PAGE_SIZE,
+                                                     offset=self._search_next_offset)
+        self._search_next_offset = None  # until this page arrives
+        when_done(self, self._search_request, lambda done: self._on_search_results(done, more=True))
+
+    def _on_search_results(self, future, more):
+        if future is not self._search_request: return  # the search text changed since
+        page = future.result()
+        self._search_next_offset = page["next_offset"]
+        names = (npc["name"] for npc in page["results"])
+        if more:
+            self.npc_list_frame.extend(names)
+        else:
+            self.npc_list_frame.set_items(names)
+            self.highlight_selected_npc()
+
+    def update_npc_list(self, on_loaded=None):
+        """Shows the whole roster, read on the database thread, then calls on_loaded()."""
+        self._list_request = self.data.read(self.repo.npc_names)
+        when_done(self, self._list_request, lambda done: self._show_npc_list(done, on_loaded))
+
+    def _show_npc_list(self, future, on_loaded):
+        # Dropped if the roster was asked for again, or a search started, since.
+        if future is not self._list_request or self._search_request is not None: return
+        self.npc_list_frame.set_items(future.result() if future.exception() is None else [])
         self.highlight_selected_npc()
+        if on_loaded: on_loaded()
 
     def highlight_selected_npc(self):
-        for name, button in self.npc_buttons.items():
-            is_selected = (name == self.selected_npc_name)
-            button.configure(fg_color=customtkinter.ThemeManager.theme["CTkButton"]["hover_color"] if is_selected else
-            customtkinter.ThemeManager.theme["CTkButton"]["fg_color"])
+        self.npc_list_frame.select(self.selected_npc_name)
+        if self.selected_npc_name: self.npc_list_frame.see(self.selected_npc_name)
 
     def populate_roster_fields(self, npc_data):
         self.roster_name_label.configure(text=npc_data.get("name", "N/A"))
@@ -307,13 +513,13 @@ class NpcApp(customtkinter.CTkToplevel):
         self._update_textbox(self.roster_backstory_textbox, npc_data.get("backstory", ""))
         self._update_textbox(self.roster_plothooks_textbox, npc_data.get("plot_hooks", ""))
         self._update_textbox(self.roster_roleplaying_textbox, npc_data.get("roleplaying_tips", ""))
-        self.roster_ctk_image = self._create_ctk_image_from_data(npc_data.get("image_data"))
-        self.roster_portrait_label.configure(image=self.roster_ctk_image, text="")  # Set text to empty
-        self.roster_portrait_label.image = self.roster_ctk_image  # Keep reference
+        show_portrait(self.roster_portrait_label, npc_data.get("image_data"), size=(300, 300))
 
-    def populate_workshop_fields(self, npc_data):
+    def populate_workshop_fields(self, npc_data, saved=False):
+        """Loads an NPC into the workshop; `saved` means it is the NPC's current database record."""
         self._npc_in_workshop = npc_data.copy()
         self._workshop_original_name = npc_data.get('name')
+        self._workshop_saved = npc_data.copy() if saved else {}
         self.workshop_name_entry.delete(0, "end");
         self.workshop_name_entry.insert(0, self._npc_in_workshop.get("name", ""))
         self.workshop_race_entry.delete(0, "end");
@@ -339,11 +545,36 @@ class NpcApp(customtkinter.CTkToplevel):
         self._update_workshop_image_display()
         self._update_textbox(self.workshop_status_textbox, "")
 
+    def _workshop_field_widgets(self):
+        return {
+            "name": self.workshop_name_entry, "race_class": self.workshop_race_entry,
+            "appearance": self.workshop_appearance_textbox, "personality": self.workshop_personality_textbox,
+            "backstory": self.workshop_backstory_textbox, "plot_hooks": self.workshop_plothooks_textbox,
+            "roleplaying_tips": self.workshop_roleplaying_textbox,
+            "gender": self.gender_var, "attitude": self.attitude_var, "rarity": self.rarity_var,
+            "environment": self.environment_var, "race": self.race_var, "character_class": self.class_var,
+            "background": self.background_var,
+        }
+
+    def _set_workshop_field(self, key, value):
+        """Fills a single workshop field, e.g. as a streamed NPC arrives."""
+        widget = self._workshop_field_widgets().get(key)
+        if widget is None or not isinstance(value, str): return
+        self._npc_in_workshop[key] = value
+        if isinstance(widget, customtkinter.CTkEntry):
+            widget.delete(0, "end")
+            widget.insert(0, value)
+        elif isinstance(widget, customtkinter.CTkTextbox):
+            self._update_textbox(widget, value, state="normal")
+        else:
+            widget.set(value)
+
+    def _clear_workshop_text_fields(self):
+        for key, widget in self._workshop_field_widgets().items():
+            if isinstance(widget, (customtkinter.CTkEntry, customtkinter.CTkTextbox)): self._set_workshop_field(key, "")
+
     def _update_workshop_image_display(self):
-        self.workshop_ctk_image = self._create_ctk_image_from_data(self._npc_in_workshop.get("image_data"),
-                                                                   size=(250, 250))
-        self.workshop_portrait_label.configure(image=self.workshop_ctk_image, text="")  # Set text to empty
-        self.workshop_portrait_label.image = self.workshop_ctk_image  # Keep reference
+        show_portrait(self.workshop_portrait_label, self._npc_in_workshop.get("image_data"), size=(250, 250))
 
     def _update_textbox(self, textbox, text, state="disabled"):
         textbox.configure(state="normal");
@@ -351,33 +582,32 @@ class NpcApp(customtkinter.CTkToplevel):
         textbox.insert("1.0", text);
         textbox.configure(state=state)
 
-    def _create_ctk_image_from_data(self, image_bytes, size=(300, 300)):
-        if not image_bytes: return None
-        try:
-            return customtkinter.CTkImage(light_image=Image.open(io.BytesIO(image_bytes)),
-                                          dark_image=Image.open(io.BytesIO(image_bytes)), size=size)
-        except (UnidentifiedImageError, io.UnsupportedOperation) as e:
-            logging.error(f"Failed to create image from data: {e}")
-            return None
-
     def _on_tab_change(self):
         selected_tab = self.tabview.get()
-        if selected_tab == "NPC Details" and self.selected_npc_name: self.populate_roster_fields(
-            self.npcs.get(self.selected_npc_name, {}))
+        if selected_tab == "NPC Details" and self.selected_npc_name: self.populate_roster_fields(self._roster_npc)
 
     def select_npc(self, name):
-        if name in self.npcs:
+        if self.npc_list_frame.index(name) is not None:
             self.selected_npc_name = name
-            npc_data = self.npcs.get(name, {})
-            self.populate_roster_fields(npc_data)
+            self._roster_npc = {}  # until the record arrives
             self.highlight_selected_npc()
             self.tabview.set("NPC Details")
+            self._load_selected_npc(name)
         else:
             logging.warning(f"Attempted to select non-existent NPC: {name}")
 
+    def _load_selected_npc(self, name):
+        # Only the NPC being viewed is read in full, portrait included; _on_npcs_changed reads it again on changes.
+        when_done(self, self.data.get_npc(name), lambda done: self._show_selected_npc(name, done))
+
+    def _show_selected_npc(self, name, future):
+        if name != self.selected_npc_name: return  # another NPC was selected in the meantime
+        self._roster_npc = future.result() or {}
+        self.populate_roster_fields(self._roster_npc)
+
     def select_first_npc(self):
-        if self.npcs:
-            self.select_npc(sorted(self.npcs.keys())[0])
+        if self.npc_list_frame.items:
+            self.select_npc(self.npc_list_frame.items[0])
         else:
             self.go_to_workshop_new()
 
@@ -386,8 +616,8 @@ class NpcApp(customtkinter.CTkToplevel):
         self.tabview.set("NPC Workshop")
 
     def go_to_workshop_edit(self):
-        if self.selected_npc_name and self.selected_npc_name in self.npcs:
-            self.populate_workshop_fields(self.npcs[self.selected_npc_name])
+        if self.selected_npc_name and self._roster_npc.get('name') == self.selected_npc_name:
+            self.populate_workshop_fields(self._roster_npc, saved=True)
             self.tabview.set("NPC Workshop")
         else:
             logging.warning("Edit button clicked with no NPC selected.")
@@ -408,28 +638,79 @@ class NpcApp(customtkinter.CTkToplevel):
         self._npc_in_workshop['environment'] = self.environment_var.get()
         self._npc_in_workshop['race'] = self.race_var.get()
         self._npc_in_workshop['character_class'] = self.class_var.get()
-        self.db.save_npc(self._npc_in_workshop, old_name=self._workshop_original_name)
-        if self._workshop_original_name and self._workshop_original_name in self.npcs and self._workshop_original_name != new_name:
-            del self.npcs[self._workshop_original_name]
-        self.npcs[new_name] = self._npc_in_workshop.copy()
-        self.update_npc_list()
+        workshop, snapshot = self._npc_in_workshop, self._npc_in_workshop.copy()
+        saved = self._write_workshop_npc()
+        self._update_textbox(self.workshop_status_textbox, "Saving...")
+        when_done(self, saved, lambda done: self._on_workshop_saved(done, workshop, snapshot))
+
+    def _on_workshop_saved(self, future, workshop, snapshot):
+        new_name = snapshot['name']
+        try:
+            old_name = future.result()
+        except Exception as e:
+            self._update_textbox(self.workshop_status_textbox, f"Error: The NPC could not be saved.\n\n{e}")
+            return
+        if workshop is self._npc_in_workshop:
+            # Still the NPC that was saved (populate_workshop_fields replaces the dict): `snapshot` is now its record.
+            self._workshop_original_name = new_name
+            self._workshop_saved = snapshot
+        self._update_textbox(self.workshop_status_textbox, f"Saved '{new_name}'.")
+        # Not left to _on_npcs_changed: with a search active it only re-runs the search.
+        if old_name:
+            self.npc_list_frame.rename(old_name, new_name)
+        else:
+            self.npc_list_frame.insert(new_name)
+        self.npc_list_frame.refresh_thumbnail(new_name)
         self.select_npc(new_name)
 
+    def _write_workshop_npc(self):
+        """
+        Saves only the fields that differ from the stored record, so editing text doesn't rewrite the portrait
+        and a rename is a single update. New NPCs, or ones no longer in the database, are saved in full.
+        Returns the Future of the save, which resolves to the NPC's previous name if the save renamed it.
+        """
+        npc, old_name, saved_name = self._npc_in_workshop.copy(), self._workshop_original_name, None
+        changes = None
+        if self._workshop_saved:
+            saved_name = self._workshop_saved['name']
+            changes = {col: npc.get(col) for col in NPC_COLUMNS if npc.get(col) != self._workshop_saved.get(col)}
+
+        def write():
+            renamed = old_name if old_name and old_name != npc['name'] and self.repo.has_npc(old_name) else None
+            if changes is not None and (not changes or self.repo.update_npc(saved_name, changes)): return renamed
+            self.repo.save_npc(npc, old_name=old_name)
+            return renamed
+
+        return self.data.write(write)
+
     def delete_npc(self):
         if not self.selected_npc_name: return
-        sorted_names = sorted(self.npcs.keys())
-        current_index = sorted_names.index(self.selected_npc_name)
-        self.db.delete_npc(self.selected_npc_name)
-        del self.npcs[self.selected_npc_name]
-        self.update_npc_list()
-        if not self.npcs:
-            self.selected_npc_name = None
-            self.populate_roster_fields({})
+        name = self.selected_npc_name
+        current_index = self.npc_list_frame.index(name) or 0
+        when_done(self, self.data.delete_npc(name), lambda done: self._on_npc_deleted(done, name, current_index))
+
+    def _on_npc_deleted(self, future, name, current_index):
+        if future.exception() is not None:
+            self._update_textbox(self.workshop_status_textbox,
+                                 f"Error: '{name}' could not be deleted.\n\n{future.exception()}")
+            return
+        self.npc_list_frame.remove(name)
+        if self.selected_npc_name != name: return  # another NPC was selected while it was deleted
+        if self.npc_list_frame.items:
+            new_index = min(current_index, len(self.npc_list_frame.items) - 1)
+            self.select_npc(self.npc_list_frame.items[new_index])
+            return
+        self.selected_npc_name = None
+        self._roster_npc = {}
+        self.populate_roster_fields({})
+        if self._search_request is None:
             self.go_to_workshop_new()
         else:
-            new_index = min(current_index, len(self.npcs) - 1)
-            new_selection = sorted(self.npcs.keys())[new_index]
-            self.select_npc(new_selection)
+            # The last search result was deleted; fall back to the full roster.
+            self.search_entry.delete(0, "end")
+            self._search_request = None
+            self._search_next_offset = None
+            self.update_npc_list(on_loaded=self.select_first_npc)
 
     def upload_portrait(self):
         try:
@@ -445,8 +726,8 @@ class NpcApp(customtkinter.CTkToplevel):
             self._update_textbox(self.workshop_status_textbox, "Error: Image Upload Failed.")
 
     def launch_simulator_app(self):
-        if not self.selected_npc_name: logging.warning("Launch simulator clicked with no NPC selected."); return
-        npc_data = self.npcs.get(self.selected_npc_name)
+        if not self._roster_npc: logging.warning("Launch simulator clicked with no NPC loaded."); return
+        npc_data = self._roster_npc
         self.master.launch_npc_simulator(npc_data=npc_data, campaign_data=self.campaign_data)
 
     def start_image_generation_thread(self, appearance_prompt=None):
@@ -456,21 +737,23 @@ class NpcApp(customtkinter.CTkToplevel):
             appearance_prompt = self.workshop_appearance_textbox.get("1.0", "end-1c").strip()
         if not appearance_prompt: self._update_textbox(self.workshop_status_textbox,
                                                        "Error: 'Appearance' field must be filled out."); return
-        threading.Thread(target=self._image_generation_worker, args=(appearance_prompt,), daemon=True).start()
+        payload = {"appearance": appearance_prompt, "bypass_cache": self.bypass_cache_var.get()}
+        self._submit_job(self._on_portrait_done, "portrait", payload, priority=PRIORITY_WORKSHOP, owner="workshop")
+        self._update_textbox(self.workshop_status_textbox, "Generating portrait...")
 
-    def _image_generation_worker(self, appearance_prompt):
-        self.after(0, lambda: self._update_textbox(self.workshop_status_textbox, "Generating portrait..."))
+    def _on_portrait_done(self, future):
         try:
-            image_bytes = self.ai.generate_npc_portrait(appearance_prompt)
-            self._npc_in_workshop['image_data'] = image_bytes
-            self.after(0, self._update_workshop_image_display)
-            self.after(0,
-                       lambda: self._update_textbox(self.workshop_status_textbox, "Portrait generated successfully!"))
+            job = future.result()
         except PermissionError as e:
             logging.warning(f"Image generation failed: {e}")
-            message = f"{e}\n\nTo generate manually, use a different image generator."
-            self.after(0, lambda msg=message: self._update_textbox(self.workshop_status_textbox, msg))
+            self._update_textbox(self.workshop_status_textbox,
+                                 f"{e}\n\nTo generate manually, use a different image generator.")
+            return
         except Exception as e:
             logging.error(f"Image generation failed in worker: {e}")
-            self.after(0, lambda err=e: self._update_textbox(self.workshop_status_textbox,
-                                                             f"Image Generation Failed:\n\n{err}"))
\ No newline at end of file
+            self._update_textbox(self.workshop_status_textbox, f"Image Generation Failed:\n\n{e}")
+            return
+        self.data.write(self.jobs.mark_delivered, job['id'])
+        self._npc_in_workshop['image_data'] = job['result_blob']
+        self._update_workshop_image_display()
+        self._update_textbox(self.workshop_status_textbox, "Portrait generated successfully!")
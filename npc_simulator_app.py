@@ -1,8 +1,12 @@
 import customtkinter
-import threading
 import logging
-import io
-from PIL import Image, UnidentifiedImageError
+import queue
+
+from async_data_manager import when_done
+from config import STREAM_FLUSH_INTERVAL_MS, LIST_AVATAR_SIZE
+from image_cache import show_portrait
+from services import CancellationToken, PRIORITY_INTERACTIVE
+from virtual_list import VirtualList
 
 
 class NpcSimulatorApp(customtkinter.CTkToplevel):
@@ -10,13 +14,20 @@ class NpcSimulatorApp(customtkinter.CTkToplevel):
     A dedicated Toplevel window for simulating an NPC with different levels of detail.
     """
 
-    def __init__(self, master, api_service, data_manager, npc_data=None, campaign_data=None):
+    def __init__(self, master, api_service, data_manager, job_queue, repository, async_data, npc_data=None,
+                 campaign_data=None):
         super().__init__(master)
         self.master = master
         self.ai = api_service
         self.db = data_manager
+        self.repo = repository
+        self.data = async_data
+        self.jobs = job_queue
         self.npc_data = npc_data
         self.campaign_data = campaign_data or {}
+        self._simulation_cancel = None
+        self._simulation_job_id = None
+        self._npc_list = None  # the selection list, while it is shown
 
         self.title("NPC Simulator")
         self.geometry("1000x700")
@@ -48,22 +59,37 @@ class NpcSimulatorApp(customtkinter.CTkToplevel):
         title_label = customtkinter.CTkLabel(container, text="Select an NPC to Simulate",
                                              font=customtkinter.CTkFont(size=20, weight="bold"))
         title_label.grid(row=0, column=0, pady=(0, 20), sticky="w")
-        scrollable_frame = customtkinter.CTkScrollableFrame(container, label_text="Available NPCs")
-        scrollable_frame.grid(row=1, column=0, sticky="nsew")
+        npc_list = VirtualList(container, label_text="Available NPCs", command=self._on_npc_selected,
+                               empty_text="No NPCs found in the database.", thumbnail_loader=self.data.get_thumbnails,
+                               thumbnail_size=LIST_AVATAR_SIZE, row_height=LIST_AVATAR_SIZE + 10)
+        npc_list.grid(row=1, column=0, sticky="nsew")
         home_button = customtkinter.CTkButton(container, text="🏠 Home", command=self.go_home)
         home_button.grid(row=2, column=0, pady=(10, 0), sticky="ew")
-        npcs = self.db.load_data()
-        if not npcs:
-            customtkinter.CTkLabel(scrollable_frame, text="No NPCs found in the database.").pack(pady=20)
-            return
-        for name in sorted(npcs.keys()):
-            button = customtkinter.CTkButton(scrollable_frame, text=name,
-                                             command=lambda n=name: self._on_npc_selected(n))
-            button.pack(pady=5, padx=10, fill="x")
+        self._npc_list = npc_list
+        when_done(self, self.data.read(self.repo.npc_names), lambda done: self._show_npc_list(npc_list, done))
+        self.repo.subscribe(self._on_npcs_changed, self)
+
+    def _show_npc_list(self, npc_list, future):
+        if npc_list is not self._npc_list: return  # already simulating
+        npc_list.set_items(future.result() if future.exception() is None else [])
+
+    def _on_npcs_changed(self, changes):
+        if self._npc_list is None: return
+        for change in changes:
+            if change.kind != "npc": continue
+            if change.deleted:
+                self._npc_list.remove(change.name)
+            elif change.old_name:
+                self._npc_list.rename(change.old_name, change.name)
+            else:
+                self._npc_list.insert(change.name)
 
     def _on_npc_selected(self, npc_name):
-        npcs = self.db.load_data()
-        self.npc_data = npcs.get(npc_name)
+        when_done(self, self.data.get_npc(npc_name), lambda done: self._on_npc_loaded(npc_name, done))
+
+    def _on_npc_loaded(self, npc_name, future):
+        if self._npc_list is None: return  # already simulating one picked before
+        self.npc_data = future.result()
         if self.npc_data:
             self._create_simulator_view()
         else:
@@ -71,6 +97,8 @@ class NpcSimulatorApp(customtkinter.CTkToplevel):
 
     def _create_simulator_view(self):
         self._clear_window()
+        self.repo.unsubscribe(self._on_npcs_changed)
+        self._npc_list = None
         npc_name = self.npc_data.get('name', 'Unknown NPC')
         self.title(f"Simulator: {npc_name}")
         self.grid_columnconfigure(0, weight=1, minsize=250)
@@ -78,17 +106,29 @@ class NpcSimulatorApp(customtkinter.CTkToplevel):
         self.grid_rowconfigure(0, weight=1)
         self._setup_sidebar()
         self._setup_main_content()
+        self._recover_simulation(npc_name)
+
+    def _recover_simulation(self, npc_name):
+        """Shows a simulation for this NPC that finished after the simulator was closed (e.g. resumed at startup)."""
+        when_done(self, self.data.read(self.jobs.undelivered, "simulation", npc_name),
+                  lambda done: self._show_recovered_simulation(npc_name, done.result()))
+
+    def _show_recovered_simulation(self, npc_name, finished):
+        if not finished or npc_name != self.npc_data.get('name') or self._simulation_cancel is not None: return
+        job = finished[0]
+        self.prompt_entry.delete("1.0", "end")
+        self.prompt_entry.insert("1.0", job['payload']['situation'])
+        self._update_textbox(self.response_textbox, job['result']['text'])
+        self.data.write(self.jobs.mark_delivered, *[job['id'] for job in finished])
 
     def _setup_sidebar(self):
         sidebar = customtkinter.CTkFrame(self, width=250, corner_radius=0)
         sidebar.grid(row=0, column=0, sticky="nsew")
         sidebar.grid_columnconfigure(0, weight=1)
         sidebar.grid_rowconfigure(2, weight=1)
-        portrait_image = self._create_ctk_image_from_data(self.npc_data.get("image_data"), size=(200, 200))
-        portrait_label = customtkinter.CTkLabel(sidebar, image=portrait_image,
-                                                text="" if portrait_image else "No Portrait")
+        portrait_label = customtkinter.CTkLabel(sidebar, text="No Portrait", width=200, height=200)
         portrait_label.grid(row=0, column=0, padx=10, pady=10)
-        portrait_label.image = portrait_image
+        show_portrait(portrait_label, self.npc_data.get("image_data"), size=(200, 200))
         home_button = customtkinter.CTkButton(sidebar, text="🏠 Home", command=self.go_home)
         home_button.grid(row=1, column=0, padx=20, pady=10, sticky="ew")
         info_frame = customtkinter.CTkScrollableFrame(sidebar, label_text="Character Info")
@@ -149,51 +189,112 @@ class NpcSimulatorApp(customtkinter.CTkToplevel):
                                                        command=self.start_simulation_thread)
         self.simulate_button.grid(row=0, column=1, sticky="ew")
 
+        self.bypass_cache_var = customtkinter.BooleanVar(value=False)
+        if self.ai.response_cache is not None:
+            customtkinter.CTkCheckBox(bottom_frame, text="Fresh response", variable=self.bypass_cache_var).grid(
+                row=0, column=2, padx=(10, 0))
+
     def go_home(self):
+        self.repo.unsubscribe(self._on_npcs_changed)
+        self._cancel_simulation()
         self.master.deiconify()
         self.destroy()
 
+    def _cancel_simulation(self):
+        if self._simulation_cancel is not None: self._simulation_cancel.set()
+        if self._simulation_job_id is not None: self.jobs.cancel(self._simulation_job_id)
+
     def start_simulation_thread(self):
         if not self.ai.is_api_key_valid():
             self._update_textbox(self.response_textbox, "Error: Gemini API Key is missing or invalid.")
             return
-        threading.Thread(target=self._run_simulation_task, daemon=True).start()
-
-    def _run_simulation_task(self):
-        self.after(0, lambda: self.simulate_button.configure(state="disabled"))
-        self.after(0, lambda: self._update_textbox(self.response_textbox, "Simulating with Gemini... Please wait."))
-        try:
-            situation = self.prompt_entry.get("1.0", "end-1c").strip()
-            sim_type = self.sim_type_var.get()
-            if not situation:
-                self.after(0,
-                           lambda: self._update_textbox(self.response_textbox, "Please enter a situation to simulate."))
-                return
-
-            response_text = self.ai.simulate_reaction(
-                npc_data=self.npc_data,
-                situation=situation,
-                campaign_data=self.campaign_data,
-                sim_type=sim_type
-            )
-            self.after(0, lambda: self._update_textbox(self.response_textbox, response_text))
-        except Exception as e:
-            logging.error(f"Simulation failed: {e}")
-            self.after(0, lambda err=e: self._update_textbox(self.response_textbox, f"An error occurred:\n\n{err}"))
-        finally:
-            self.after(0, lambda: self.simulate_button.configure(state="normal"))
+        situation = self.prompt_entry.get("1.0", "end-1c").strip()
+        if not situation:
+            self._update_textbox(self.response_textbox, "Please enter a situation to simulate.")
+            return
+        # Starting a new simulation abandons the one still streaming.
+        self._cancel_simulation()
+        self._simulation_cancel = CancellationToken()
+        self._simulation_job_id = None  # until it has been recorded
+        chunks = queue.SimpleQueue()
+        payload = {
+            "npc_data": {key: value for key, value in self.npc_data.items() if key != 'image_data'},
+            "situation": situation,
+            "campaign_name": self.campaign_data.get('campaign_name'),
+            "sim_type": self.sim_type_var.get(),
+            "bypass_cache": self.bypass_cache_var.get(),
+        }
+        cancel_event = self._simulation_cancel
+        submitted = self.data.call(self.jobs.submit, "simulation", payload, priority=PRIORITY_INTERACTIVE,
+                                   owner=self.npc_data.get('name'), hooks={"on_chunk": chunks.put})
+        submitted.add_done_callback(lambda done: self._follow_simulation_job(done, chunks, cancel_event))
+        when_done(self, submitted, lambda done: self._on_simulation_submitted(done, cancel_event))
+        self._update_textbox(self.response_textbox, "Simulating with Gemini... Please wait.")
+        self.after(STREAM_FLUSH_INTERVAL_MS, self._drain_simulation_stream, chunks, cancel_event, False)
+
+    def _follow_simulation_job(self, submitted, chunks, cancel_event):
+        # On the database thread. A job that couldn't be recorded ends the stream with its error, like a failed one.
+        if submitted.exception() is not None:
+            self._on_simulation_job_done(submitted, chunks)
+            return
+        job_id, future = submitted.result()
+        if cancel_event.is_set(): self.jobs.cancel(job_id)  # abandoned, or the window closed, while it was recorded
+        future.add_done_callback(lambda done: self._on_simulation_job_done(done, chunks))
+
+    def _on_simulation_submitted(self, submitted, cancel_event):
+        if submitted.exception() is not None: return  # reported through the stream
+        job_id = submitted.result()[0]
+        if cancel_event.is_set():
+            self.jobs.cancel(job_id)  # abandoned just after _follow_simulation_job looked
+        else:
+            self._simulation_job_id = job_id
+
+    @staticmethod
+    def _on_simulation_job_done(future, chunks):
+        if not future.cancelled() and future.exception() is not None:
+            logging.error(f"Simulation failed: {future.exception()}")
+            chunks.put(future.exception())
+        chunks.put(None)
+
+    def _drain_simulation_stream(self, chunks, cancel_event, started):
+        """Appends whatever the worker has streamed since the last tick, batching many chunks per redraw."""
+        if cancel_event.is_set() or not self.winfo_exists(): return
+        pieces, error, finished = [], None, False
+        while not finished:
+            try:
+                item = chunks.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                finished = True
+            elif isinstance(item, Exception):
+                error = item
+            else:
+                pieces.append(item)
+        if pieces:
+            if not started: self._update_textbox(self.response_textbox, "")
+            started = True
+            self._append_textbox(self.response_textbox, "".join(pieces))
+        if error is not None:
+            if started:
+                self._append_textbox(self.response_textbox, f"\n\n[The simulation was interrupted: {error}]")
+            else:
+                self._update_textbox(self.response_textbox, f"An error occurred:\n\n{error}")
+        elif finished and not started:
+            self._update_textbox(self.response_textbox, "The model returned an empty response.")
+        if not finished:
+            self.after(STREAM_FLUSH_INTERVAL_MS, self._drain_simulation_stream, chunks, cancel_event, started)
+        elif error is None and self._simulation_job_id is not None:
+            self.data.write(self.jobs.mark_delivered, self._simulation_job_id)
+
+    def _append_textbox(self, textbox, text):
+        textbox.configure(state="normal")
+        textbox.insert("end", text)
+        textbox.see("end")
+        textbox.configure(state="disabled")
 
     def _update_textbox(self, textbox, text):
         textbox.configure(state="normal")
         textbox.delete("1.0", "end")
         textbox.insert("1.0", text)
-        textbox.configure(state="disabled")
-
-    def _create_ctk_image_from_data(self, image_bytes, size=(300, 300)):
-        if not image_bytes: return None
-        try:
-            pil_image = Image.open(io.BytesIO(image_bytes))
-            return customtkinter.CTkImage(light_image=pil_image, dark_image=pil_image, size=size)
-        except (UnidentifiedImageError, io.UnsupportedOperation) as e:
-            logging.error(f"Failed to create image from data: {e}")
-            return None
\ No newline at end of file
+        textbox.configure(state="disabled")
\ No newline at end of file
@@ -0,0 +1,206 @@
+import functools
+import io
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+
+from blob_store import blob_hash
+from config import (PORTRAIT_FORMAT, PORTRAIT_QUALITY, PORTRAIT_MAX_DIMENSION, PORTRAIT_KEEP_ORIGINALS,
+                    PORTRAIT_RECOMPRESS_FORMAT, PORTRAIT_RECOMPRESS_BATCH_SIZE, THUMBNAIL_SIZES, THUMBNAIL_FORMAT,
+                    THUMBNAIL_QUALITY, THUMBNAIL_BACKFILL_BATCH_SIZE)
+
+# format: "WEBP", "JPEG" or "PNG", or None to store portraits exactly as received.
+PortraitPolicy = namedtuple("PortraitPolicy", ["format", "quality", "max_dimension", "keep_originals"])
+DEFAULT_POLICY = PortraitPolicy(PORTRAIT_FORMAT, PORTRAIT_QUALITY, PORTRAIT_MAX_DIMENSION, PORTRAIT_KEEP_ORIGINALS)
+# Lossy re-encoding of stored portraits only happens when asked for, from the Maintenance window.
+RECOMPRESS_POLICY = DEFAULT_POLICY._replace(format=PORTRAIT_RECOMPRESS_FORMAT)
+
+# A portrait is kept inline in image_data or, with the blob store, as its portrait_hash.
+HAS_PORTRAIT = "(image_data IS NOT NULL OR portrait_hash IS NOT NULL)"
+UNCHANGED_PORTRAIT = "npc_id = ? AND image_data IS ? AND portrait_hash IS ?"
+
+
+@functools.lru_cache(maxsize=None)
+def _pillow():
+    """Pillow, imported on first use; None (and the policy does nothing) when it is not installed."""
+    try:
+        from PIL import Image
+        return Image
+    except ImportError:
+        logging.warning("Pillow is not installed; portraits are stored as received.")
+        return None
+
+
+def needs_compression(image_bytes, policy=DEFAULT_POLICY):
+    """
+    Whether a portrait is stored in a format or at a size the policy doesn't allow. Only the image header is
+    read, so portraits that already comply are never re-encoded (and never lose quality twice).
+    """
+    if not image_bytes or not policy.format: return False
+    Image = _pillow()
+    if Image is None: return False
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return image.format != policy.format or max(image.size) > policy.max_dimension
+    except (OSError, ValueError):
+        return False  # not an image Pillow can read; leave it alone
+
+
+def compress_portrait(image_bytes, policy=DEFAULT_POLICY):
+    """Re-encodes a portrait under the policy; returns the input unchanged if that doesn't make it smaller."""
+    if not needs_compression(image_bytes, policy): return image_bytes
+    Image = _pillow()
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.thumbnail((policy.max_dimension, policy.max_dimension), Image.LANCZOS)
+            if policy.format == "JPEG" and image.mode not in ("RGB", "L"): image = image.convert("RGB")
+            output = io.BytesIO()
+            options = {"optimize": True} if policy.format == "PNG" else {"quality": policy.quality}
+            image.save(output, format=policy.format, **options)
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to compress a portrait, storing it as received: {e}")
+        return image_bytes
+    compressed = output.getvalue()
+    return compressed if len(compressed) < len(image_bytes) else image_bytes
+
+
+def thumbnails_supported():
+    return _pillow() is not None
+
+
+def portrait_hash(image_bytes):
+    """
+    The hash thumbnails are stored under, so they can be matched against the portrait they were made from. It is
+    the blob store's content hash, so thumbnails survive a portrait moving into the store.
+    """
+    return blob_hash(image_bytes) if image_bytes else None
+
+
+def make_thumbnails(image_bytes, sizes=THUMBNAIL_SIZES):
+    """
+    Square, center-cropped thumbnails of a portrait as {size: encoded bytes}, each scaled down from the next
+    larger one. Empty when there is no portrait, it can't be read, or Pillow is not installed.
+    """
+    if not image_bytes: return {}
+    Image = _pillow()
+    if Image is None: return {}
+    from PIL import ImageOps
+    thumbnails = {}
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft("RGB", (max(sizes), max(sizes)))  # lets JPEG decode at a reduced scale
+            source = image.convert("RGBA")
+        for size in sorted(sizes, reverse=True):
+            source = ImageOps.fit(source, (size, size), Image.LANCZOS)
+            output = io.BytesIO()
+            source.save(output, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+            thumbnails[size] = output.getvalue()
+    except (OSError, ValueError) as e:
+        logging.error(f"Failed to make portrait thumbnails: {e}")
+        return {}
+    return thumbnails
+
+
+def store_thumbnails(conn, npc_id, image_hash, thumbnails):
+    """Replaces an NPC's thumbnails with `thumbnails` ({size: bytes}) made from the portrait hashed `image_hash`."""
+    conn.execute("DELETE FROM npc_thumbnails WHERE npc_id = ?", (npc_id,))
+    conn.executemany("INSERT INTO npc_thumbnails (npc_id, size, portrait_hash, image_data) VALUES (?, ?, ?, ?)",
+                     [(npc_id, size, image_hash, data) for size, data in thumbnails.items()])
+
+
+def backfill_thumbnails(db, batch_size=THUMBNAIL_BACKFILL_BATCH_SIZE, on_batch=None):
+    """
+    Makes thumbnails for every portrait that has none (saved before thumbnails existed, imported, or whose
+    thumbnails were invalidated), `batch_size` rows at a time, and returns the counts of rows checked and
+    given thumbnails. Like recompress_portraits, images are encoded outside any transaction and a portrait
+    replaced in the meantime is skipped; `on_batch(stats)` may raise to stop early.
+    """
+    stats = {"checked": 0, "created": 0}
+    last_id = 0
+    while True:
+        try:
+            rows = db._get_connection().execute(
+                f"SELECT npc_id, image_data, portrait_hash FROM npcs WHERE npc_id > ? AND {HAS_PORTRAIT} AND NOT "
+                f"EXISTS (SELECT 1 FROM npc_thumbnails t WHERE t.npc_id = npcs.npc_id) ORDER BY npc_id LIMIT ?",
+                (last_id, batch_size)).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read portraits for thumbnails: {e}")
+            break
+        if not rows: break
+        last_id = rows[-1]['npc_id']
+        made = [(row, db._portrait_of(row)) for row in rows]
+        made = [(row, image_bytes, make_thumbnails(image_bytes)) for row, image_bytes in made]
+        stats["checked"] += len(rows)
+        try:
+            with db.transaction() as conn:
+                for row, image_bytes, thumbnails in made:
+                    if not thumbnails: continue
+                    if conn.execute(f"SELECT 1 FROM npcs WHERE {UNCHANGED_PORTRAIT}", tuple(row)).fetchone() is None:
+                        continue
+                    store_thumbnails(conn, row['npc_id'], row['portrait_hash'] or portrait_hash(image_bytes),
+                                     thumbnails)
+                    stats["created"] += 1
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store portrait thumbnails: {e}")
+            break
+        if on_batch: on_batch(stats)
+    if stats["checked"]: logging.info(f"Made thumbnails for {stats['created']} of {stats['checked']} portraits.")
+    return stats
+
+
+def recompress_portraits(db, policy=RECOMPRESS_POLICY, batch_size=PORTRAIT_RECOMPRESS_BATCH_SIZE, on_batch=None):
+    """
+    Brings every stored portrait under the policy, `batch_size` rows at a time, and returns the totals:
+    rows checked and recompressed, and bytes before and after. Images are encoded outside any transaction;
+    each batch is then written in one, skipping rows whose portrait changed in the meantime. Recompressed
+    portraits get new thumbnails in the same transaction.
+    `on_batch(stats)` is called after each batch and may raise to stop early.
+    """
+    stats = {"checked": 0, "recompressed": 0, "bytes_before": 0, "bytes_after": 0}
+    last_id = 0
+    while True:
+        try:
+            rows = db._get_connection().execute(
+                f"SELECT npc_id, image_data, portrait_hash FROM npcs WHERE npc_id > ? AND {HAS_PORTRAIT} "
+                f"ORDER BY npc_id LIMIT ?", (last_id, batch_size)).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read portraits for recompression: {e}")
+            break
+        if not rows: break
+        last_id = rows[-1]['npc_id']
+        updates = []
+        for row in rows:
+            stats["checked"] += 1
+            original = db._portrait_of(row)
+            compressed = compress_portrait(original, policy)
+            if compressed is not original:
+                stored = db._stored_portrait({'image_data': compressed})
+                updates.append((row, original, compressed, stored, make_thumbnails(compressed)))
+        try:
+            with db.transaction() as conn:
+                for row, original, compressed, stored, thumbnails in updates:
+                    npc_id = row['npc_id']
+                    if conn.execute(f"UPDATE npcs SET image_data = ?, portrait_hash = ? WHERE {UNCHANGED_PORTRAIT}",
+                                    (stored['image_data'], stored['portrait_hash']) + tuple(row)).rowcount == 0:
+                        continue
+                    if policy.keep_originals: store_original(conn, npc_id, original)
+                    name = conn.execute("SELECT name FROM npcs WHERE npc_id = ?", (npc_id,)).fetchone()[0]
+                    db._record_change("npc", name)
+                    if thumbnails: store_thumbnails(conn, npc_id, portrait_hash(compressed), thumbnails)
+                    stats["recompressed"] += 1
+                    stats["bytes_before"] += len(original)
+                    stats["bytes_after"] += len(compressed)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store recompressed portraits: {e}")
+            break
+        if on_batch: on_batch(stats)
+    logging.info(f"Recompressed {stats['recompressed']} of {stats['checked']} portraits, saving "
+                 f"{stats['bytes_before'] - stats['bytes_after']} bytes.")
+    return stats
+
+
+def store_original(conn, npc_id, image_bytes):
+    """Keeps the untouched image in the cold 'portrait_originals' table, replacing an earlier one."""
+    conn.execute("INSERT OR REPLACE INTO portrait_originals (npc_id, image_data, stored_at) VALUES (?, ?, ?)",
+                 (npc_id, image_bytes, time.time()))
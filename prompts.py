@@ -87,3 +87,28 @@ Session context: {session_context}
 
 # INTENDED FOR: Image Model (e.g., 'imagen-3')
 NPC_PORTRAIT_PROMPT = "Cinematic portrait of a D&D character, 35mm lens, photorealistic, fantasy character art. Character details: {appearance_prompt}. Dramatic lighting, detailed, high quality, digital painting, 4k."
+
+# INTENDED FOR: Text Model (e.g., 'gemini-1.5-flash')
+CONTEXT_SUMMARY_PROMPT = """
+You are condensing a Dungeon Master's campaign notes so they fit into a limited prompt.
+Summarize the following {section_label} in at most {target_words} words.
+Keep proper names, places, unresolved plot threads and any facts a character might later refer to. Do not invent anything.
+Write plain prose without headings or commentary.
+
+**Notes:**
+{text}
+
+**Summary:**
+"""
+
+# INTENDED FOR: Text Model (e.g., 'gemini-1.5-flash')
+NPC_COMPLETION_PROMPT = """
+An earlier request generated part of a D&D NPC, but some fields were missing or malformed.
+Here is the original request:
+{original_prompt}
+
+**Fields generated so far (keep them consistent with these):**
+{partial_json}
+
+Return a JSON object containing ONLY these keys: {missing_fields}
+"""
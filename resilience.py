@@ -0,0 +1,223 @@
+import logging
+import random
+import re
+import threading
+import time
+
+from config import (
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+)
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the API while a model's circuit breaker is open."""
+
+    def __init__(self, model, retry_in):
+        super().__init__(f"'{model}' is temporarily unavailable after repeated failures. "
+                         f"Try again in {max(1, round(retry_in))} seconds.")
+        self.model = model
+        self.retry_in = retry_in
+
+
+class DeadlineExceededError(TimeoutError):
+    """Raised when a call could not succeed before its deadline, including the time spent backing off."""
+
+
+def status_code(error):
+    """The HTTP status of an API error, for both google-genai and google-api-core exception types."""
+    for attribute in ("code", "status_code"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int): return code
+    return None
+
+
+def is_retryable(error):
+    if isinstance(error, (CircuitOpenError, DeadlineExceededError)): return False
+    if isinstance(error, (ConnectionError, TimeoutError)): return True
+    return status_code(error) in RETRYABLE_STATUS_CODES
+
+
+def retry_after(error):
+    """Seconds the server asked us to wait, from a Retry-After header or a RetryInfo detail, if any."""
+    hint = getattr(error, "retry_after", None)
+    if hint is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            hint = headers.get("retry-after") or headers.get("Retry-After")
+    if hint is None:
+        match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+        if match: hint = match.group(1)
+    try:
+        return float(hint) if hint is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Trips after `failure_threshold` consecutive transient failures and rejects calls for `reset_seconds`.
+    After that a single probe call is let through; its outcome closes the circuit or re-opens it.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self, model):
+        with self._lock:
+            if self.state == "open":
+                retry_in = self._opened_at + self.reset_seconds - time.monotonic()
+                if retry_in > 0: raise CircuitOpenError(model, retry_in)
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probe_in_flight: raise CircuitOpenError(model, self.reset_seconds)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, model):
+        with self._lock:
+            self._failures += 1
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    logging.warning(f"Circuit for '{model}' opened after {self._failures} consecutive failures.")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self):
+        """Ends a probe whose error said nothing about the service's health (e.g. a bad request)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class ResilientCaller:
+    """
+    Runs API calls with jittered exponential backoff, per-model circuit breakers and per-call deadlines.
+
+    Only transient errors (429, 5xx, timeouts, dropped connections) are retried; a server-provided
+    retry delay replaces the computed backoff when it is longer. Counts of calls, retries and outcomes
+    are kept per model and returned by stats().
+    """
+
+    def __init__(self, max_attempts=RETRY_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS, sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._sleep = sleep
+        self._breakers = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, model):
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+            return self._breakers[model]
+
+    def call(self, model, request, deadline=None):
+        """
+        Returns request(timeout), retrying transient failures until success, `max_attempts` or `deadline` seconds.
+        `timeout` is the time left before the deadline (None without one); the request must give up after it,
+        e.g. as its HTTP timeout, since a call already in flight can't be interrupted from here.
+        """
+        breaker = self.breaker(model)
+        expires_at = time.monotonic() + deadline if deadline else None
+        for attempt in range(1, self.max_attempts + 1):
+            timeout = expires_at - time.monotonic() if expires_at is not None else None
+            if timeout is not None and timeout <= 0:
+                self._count(model, "deadline_exceeded")
+                raise DeadlineExceededError(f"'{model}' did not succeed within {deadline:.0f} seconds.")
+            try:
+                breaker.before_call(model)
+            except CircuitOpenError:
+                self._count(model, "rejected")
+                raise
+            self._count(model, "attempts")
+            try:
+                result = request(timeout)
+            except Exception as e:
+                if not is_retryable(e):
+                    breaker.release_probe()
+                    self._count(model, "failed")
+                    raise
+                breaker.record_failure(model)
+                delay = self._backoff(attempt, e)
+                if attempt == self.max_attempts:
+                    self._count(model, "failed")
+                    raise
+                if expires_at is not None and time.monotonic() + delay >= expires_at:
+                    self._count(model, "deadline_exceeded")
+                    raise DeadlineExceededError(
+                        f"'{model}' did not succeed within {deadline:.0f} seconds: {e}") from e
+                logging.warning(f"'{model}' call failed ({e}); retry {attempt}/{self.max_attempts - 1} "
+                                f"in {delay:.1f}s.")
+                self._count(model, "retries")
+                self._sleep(delay)
+                continue
+            breaker.record_success()
+            self._count(model, "succeeded")
+            if attempt > 1: self._count(model, "succeeded_after_retry")
+            return result
+
+    def open_stream(self, model, start_stream, deadline=None):
+        """
+        Opens a streaming call, start_stream(timeout), and retries it until the first chunk arrives. Errors after
+        that are not retried, since the caller has already consumed part of the response. Returns an iterator
+        with close().
+        """
+
+        def first_chunk(timeout):
+            stream = start_stream(timeout)
+            iterator = iter(stream)
+            try:
+                return stream, iterator, [next(iterator)]
+            except StopIteration:
+                return stream, iterator, []
+            except BaseException:
+                if hasattr(stream, "close"): stream.close()
+                raise
+
+        stream, iterator, head = self.call(model, first_chunk, deadline)
+
+        def chunks():
+            try:
+                yield from head
+                yield from iterator
+            finally:
+                if hasattr(stream, "close"): stream.close()
+
+        return chunks()
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))  # full jitter
+        hint = retry_after(error)
+        if hint is not None: delay = max(delay, min(hint, self.max_delay))
+        return delay
+
+    def _count(self, model, outcome):
+        with self._lock:
+            counts = self._metrics.setdefault(model, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def stats(self):
+        """{model: {outcome: count, ..., 'circuit': state}} covering every model called so far."""
+        with self._lock:
+            snapshot = {model: dict(counts) for model, counts in self._metrics.items()}
+            for model, breaker in self._breakers.items():
+                snapshot.setdefault(model, {})["circuit"] = breaker.state
+        return snapshot
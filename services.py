@@ -1,159 +1,1188 @@
 import sqlite3
 import logging
-from google import genai
-from google.genai import types
-from google.api_core import exceptions as google_exceptions
+import threading
+import time
+import hashlib
+import functools
+import heapq
+import itertools
+from collections import namedtuple
+from concurrent.futures import Future, CancelledError, as_completed
+from contextlib import contextmanager
 import json
 import re
 
+from config import (
+    DB_CACHE_SIZE_KIB, DB_MMAP_SIZE, DB_STATEMENT_CACHE_SIZE, DB_BUSY_TIMEOUT,
+    TEXT_REQUESTS_PER_MINUTE, IMAGE_REQUESTS_PER_MINUTE, BATCH_MAX_WORKERS, TEXT_MODEL_CONCURRENCY,
+    IMAGE_MODEL_CONCURRENCY, SCHEDULER_WORKERS,
+    RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_MAX_BYTES, TEXT_REQUEST_DEADLINE_SECONDS,
+    IMAGE_REQUEST_DEADLINE_SECONDS, METRICS_ENABLED, THUMBNAIL_SIZES, PORTRAIT_BLOB_STORE
+)
 from prompts import (
     NPC_GENERATION_PROMPT,
     NPC_SIMULATION_SHORT_PROMPT,
     NPC_SIMULATION_LONG_PROMPT,
-    NPC_PORTRAIT_PROMPT
+    NPC_PORTRAIT_PROMPT,
+    NPC_COMPLETION_PROMPT,
+    CONTEXT_SUMMARY_PROMPT
 )
+from context_builder import CHARS_PER_TOKEN, estimate_tokens
+from json_stream import IncrementalObjectParser
+from resilience import DeadlineExceededError, ResilientCaller, status_code
+from metrics import MetricsRecorder
+from migrations import migrate
+from blob_store import BlobStore, store_path_for
+from portrait_storage import (DEFAULT_POLICY, HAS_PORTRAIT, compress_portrait, store_original, make_thumbnails,
+                              portrait_hash, store_thumbnails)
+
+NPC_COLUMNS = ["name", "race_class", "appearance", "personality", "backstory", "plot_hooks", "attitude", "rarity",
+               "race", "character_class", "environment", "background", "gender", "image_data", "custom_prompt",
+               "roleplaying_tips"]
+# What is actually written: with the blob store, image_data stays NULL and the row holds the portrait's hash.
+NPC_STORED_COLUMNS = NPC_COLUMNS + ["portrait_hash"]
+CAMPAIGN_COLUMNS = ["campaign_name", "campaign_lore", "party_info", "session_history"]
+# Columns small enough to load for the whole roster at once.
+NPC_SUMMARY_COLUMNS = ["name", "race_class", "attitude", "rarity", "race", "character_class", "environment",
+                       "background", "gender"]
+NPC_SEARCH_COLUMNS = ["name", "appearance", "personality", "backstory", "plot_hooks", "roleplaying_tips"]
+NPC_FACET_COLUMNS = ["race", "character_class", "environment", "rarity", "attitude"]
+# The keys the generation prompt asks for, in the order they should stream.
+NPC_FIELDS = ["name", "gender", "race_class", "appearance", "personality", "backstory", "plot_hooks",
+              "roleplaying_tips", "attitude", "rarity", "race", "character_class", "environment", "background"]
+NPC_FIELD_RETRIES = 2
+# A committed write to one NPC or campaign, as reported to DataManager listeners. `old_name` is set on renames.
+EntityChange = namedtuple("EntityChange", ["kind", "name", "old_name", "deleted"])
+
+
+def _row_count(result):
+    if isinstance(result, dict) and isinstance(result.get("results"), list): return len(result["results"])
+    if isinstance(result, (list, dict)): return len(result)
+    return None
+
+
+_timing = threading.local()
+
+
+def timed_query(method):
+    """
+    Records the wall time and result size of a DataManager call in its metrics recorder. Only the outermost
+    timed call is recorded; the calls it makes itself (save_npcs -> save_npc) are part of its time.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics is None or getattr(_timing, 'active', False): return method(self, *args, **kwargs)
+        started = time.perf_counter()
+        _timing.active = True
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception as e:
+            self.metrics.record("db", method.__name__, (time.perf_counter() - started) * 1000, error=e)
+            raise
+        finally:
+            _timing.active = False
+        self.metrics.record("db", method.__name__, (time.perf_counter() - started) * 1000,
+                            row_count=_row_count(result))
+        return result
+
+    return wrapper
+
+
+class ConnectionPool:
+    """
+    Keeps one long-lived SQLite connection per thread, tuned for WAL so background
+    writers don't block UI reads.
+    """
+
+    def __init__(self, db_filepath, cache_size_kib=DB_CACHE_SIZE_KIB, mmap_size=DB_MMAP_SIZE,
+                 statement_cache_size=DB_STATEMENT_CACHE_SIZE, busy_timeout=DB_BUSY_TIMEOUT):
+        self.db_filepath = db_filepath
+        self.cache_size_kib = cache_size_kib
+        self.mmap_size = mmap_size
+        self.statement_cache_size = statement_cache_size
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []  # (thread, connection) pairs, so dead threads' connections can be closed
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._close_orphans()
+                self._connections.append((threading.current_thread(), conn))
+        return conn
+
+    def _connect(self):
+        # isolation_level=None leaves transaction control to DataManager.transaction().
+        conn = sqlite3.connect(self.db_filepath, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=self.statement_cache_size)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        logging.info(f"Opened SQLite connection for thread '{threading.current_thread().name}'.")
+        return conn
+
+    def _close_orphans(self):
+        alive = []
+        for thread, conn in self._connections:
+            if thread.is_alive():
+                alive.append((thread, conn))
+            else:
+                conn.close()
+        self._connections = alive
+
+    def close_all(self):
+        with self._lock:
+            for _, conn in self._connections:
+                try:
+                    conn.execute("PRAGMA optimize")
+                    conn.close()
+                except sqlite3.Error as e:
+                    logging.warning(f"Failed to close SQLite connection cleanly: {e}")
+            self._connections = []
+        self._local = threading.local()
 
 
 class DataManager:
-    # ... (no changes in this class)
+    """
+    Reads log SQLite errors and return an empty result. NPC and campaign writes log them and raise, so a
+    transaction they are part of rolls back instead of committing half a save.
+    """
+
     def __init__(self, db_filepath):
         self.db_filepath = db_filepath
-        self._create_npc_table()
-        self._create_campaign_table()
+        self._pool = ConnectionPool(db_filepath)
+        self._tx_state = threading.local()
+        self._listeners = []
+        self.metrics = MetricsRecorder(self) if METRICS_ENABLED else None
+        self.portrait_policy = DEFAULT_POLICY
+        # Always opened, so portraits already in the store stay readable after it's turned off for new saves.
+        self.blobs = BlobStore(store_path_for(db_filepath))
+        self.use_blob_store = PORTRAIT_BLOB_STORE
+        self.schema_version = migrate(self)
 
     def _get_connection(self):
-        return sqlite3.connect(self.db_filepath)
+        return self._pool.get()
 
-    def _create_npc_table(self):
-        create_table_sql = "CREATE TABLE IF NOT EXISTS npcs (name TEXT PRIMARY KEY, race_class TEXT, appearance TEXT, personality TEXT, backstory TEXT, plot_hooks TEXT, attitude TEXT, rarity TEXT, race TEXT, character_class TEXT, environment TEXT, background TEXT, gender TEXT, image_data BLOB, custom_prompt TEXT, roleplaying_tips TEXT);"
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(create_table_sql)
-                conn.commit()
-            logging.info("Database table 'npcs' is ready.")
-        except sqlite3.Error as e:
-            logging.error(f"Database error during NPC table creation: {e}")
+    @contextmanager
+    def transaction(self, write=True):
+        """
+        Runs the enclosed statements in one transaction on this thread's connection.
+        Nested calls join the outermost transaction, so callers can group several saves into one commit. Each
+        nested level is a SAVEPOINT: if it raises, only its own statements (and recorded changes) are undone
+        and the error carries on to the caller, which decides whether the outer transaction still commits.
 
-    def _create_campaign_table(self):
-        create_table_sql = "CREATE TABLE IF NOT EXISTS campaigns (campaign_name TEXT PRIMARY KEY, campaign_lore TEXT, party_info TEXT, session_history TEXT);"
+        Write transactions take the write lock up front (BEGIN IMMEDIATE), waiting out other writers; one that
+        read first and wrote later would fail as soon as another connection committed in between. Pass
+        write=False for a read-only snapshot that doesn't hold writers up.
+        """
+        conn = self._get_connection()
+        depth = getattr(self._tx_state, 'depth', 0)
+        savepoint = f"level_{depth}"
+        if depth == 0:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            self._tx_state.changes = []
+        else:
+            conn.execute(f"SAVEPOINT {savepoint}")
+        changes_before = len(self._tx_state.changes)
+        self._tx_state.depth = depth + 1
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(create_table_sql)
-                try:
-                    cursor.execute("ALTER TABLE campaigns ADD COLUMN party_info TEXT")
-                except sqlite3.OperationalError:
-                    pass
-                try:
-                    cursor.execute("ALTER TABLE campaigns ADD COLUMN session_history TEXT")
-                except sqlite3.OperationalError:
-                    pass
-                conn.commit()
-            logging.info("Database table 'campaigns' is ready.")
-        except sqlite3.Error as e:
-            logging.error(f"Database error during campaign table creation: {e}")
+            yield conn
+        except BaseException:
+            self._tx_state.depth = depth
+            if depth == 0:
+                conn.execute("ROLLBACK")
+                self._tx_state.changes = []
+            else:
+                conn.execute(f"ROLLBACK TO {savepoint}")
+                conn.execute(f"RELEASE {savepoint}")
+                del self._tx_state.changes[changes_before:]
+            raise
+        self._tx_state.depth = depth
+        if depth == 0:
+            conn.execute("COMMIT")
+            changes, self._tx_state.changes = self._tx_state.changes, []
+            if changes: self._announce(changes)
+        else:
+            conn.execute(f"RELEASE {savepoint}")
+
+    def in_transaction(self):
+        """Whether the calling thread is inside transaction()."""
+        return getattr(self._tx_state, 'depth', 0) > 0
+
+    def add_listener(self, callback):
+        """
+        Calls `callback(changes)` with the EntityChanges of each committed transaction that wrote NPCs or
+        campaigns, on the thread that committed it.
+        """
+        self._listeners.append(callback)
+
+    def _record_change(self, kind, name, old_name=None, deleted=False):
+        """Notes a write inside the current transaction; listeners hear of it only if the transaction commits."""
+        self._tx_state.changes.append(EntityChange(kind, name, old_name if old_name != name else None, deleted))
+
+    def _announce(self, changes):
+        for callback in list(self._listeners):
+            try:
+                callback(changes)
+            except Exception as e:
+                logging.error(f"A change listener failed: {e}")
+
+    def close(self):
+        if self.metrics is not None: self.metrics.close()
+        self._pool.close_all()
 
+    @timed_query
     def load_data(self):
         npcs_dict = {}
         try:
-            with self._get_connection() as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM npcs")
-                rows = cursor.fetchall()
-                for row in rows: npcs_dict[row['name']] = dict(row)
+            rows = self._get_connection().execute("SELECT * FROM npcs").fetchall()
+            for row in rows: npcs_dict[row['name']] = self._with_portrait(row)
             logging.info(f"Successfully loaded {len(npcs_dict)} NPCs from {self.db_filepath}.")
             return npcs_dict
         except sqlite3.Error as e:
             logging.error(f"Failed to load data from database: {e}")
             return {}
 
+    @timed_query
+    def load_npc_summaries(self):
+        """Loads the lightweight roster columns for every NPC, leaving text bodies and portraits on disk."""
+        summaries = {}
+        sql = f"SELECT {', '.join(NPC_SUMMARY_COLUMNS)}, {HAS_PORTRAIT} AS has_portrait FROM npcs"
+        try:
+            for row in self._get_connection().execute(sql).fetchall(): summaries[row['name']] = dict(row)
+            logging.info(f"Loaded {len(summaries)} NPC summaries from {self.db_filepath}.")
+            return summaries
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load NPC summaries from database: {e}")
+            return {}
+
+    @timed_query
+    def get_npc(self, name, include_portrait=True):
+        """Loads the full record for a single NPC, or None if it does not exist."""
+        columns = NPC_STORED_COLUMNS if include_portrait else [col for col in NPC_COLUMNS if col != "image_data"]
+        sql = f"SELECT {', '.join(columns)} FROM npcs WHERE name = ?"
+        try:
+            row = self._get_connection().execute(sql, (name,)).fetchone()
+            return self._with_portrait(row) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load NPC '{name}': {e}")
+            return None
+
+    @timed_query
+    def get_npc_summary(self, name):
+        """The roster columns of a single NPC, as load_npc_summaries returns them, or None."""
+        sql = f"SELECT {', '.join(NPC_SUMMARY_COLUMNS)}, {HAS_PORTRAIT} AS has_portrait FROM npcs WHERE name = ?"
+        try:
+            row = self._get_connection().execute(sql, (name,)).fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load the summary of NPC '{name}': {e}")
+            return None
+
+    @timed_query
+    def get_portrait(self, name):
+        """Returns the portrait bytes for a single NPC, or None."""
+        try:
+            row = self._get_connection().execute("SELECT image_data, portrait_hash FROM npcs WHERE name = ?",
+                                                 (name,)).fetchone()
+            return self._portrait_of(row) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load portrait for NPC '{name}': {e}")
+            return None
+
+    @timed_query
+    def get_thumbnails(self, names, pixels):
+        """
+        Thumbnails for the NPCs in `names` that have one, as {name: image bytes}, in a single query. The
+        smallest stored size at least `pixels` wide is used, or the largest if none is.
+        """
+        names = list(names)
+        if not names: return {}
+        size = next((size for size in sorted(THUMBNAIL_SIZES) if size >= pixels), max(THUMBNAIL_SIZES))
+        sql = (f"SELECT n.name, t.image_data FROM npcs n JOIN npc_thumbnails t ON t.npc_id = n.npc_id AND t.size = ? "
+               f"WHERE n.name IN ({', '.join(['?'] * len(names))})")
+        try:
+            return {row['name']: row['image_data'] for row in self._get_connection().execute(sql, [size] + names)}
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load thumbnails for {len(names)} NPCs: {e}")
+            return {}
+
+    @timed_query
+    def has_missing_thumbnails(self):
+        """Whether any NPC with a portrait has no thumbnails yet; see portrait_storage.backfill_thumbnails."""
+        sql = (f"SELECT 1 FROM npcs WHERE {HAS_PORTRAIT} AND NOT EXISTS "
+               f"(SELECT 1 FROM npc_thumbnails t WHERE t.npc_id = npcs.npc_id) LIMIT 1")
+        try:
+            return self._get_connection().execute(sql).fetchone() is not None
+        except sqlite3.Error as e:
+            logging.error(f"Failed to check for missing thumbnails: {e}")
+            return False
+
+    @timed_query
     def save_npc(self, npc_data, old_name=None):
-        if old_name and old_name != npc_data['name']: self.delete_npc(old_name)
-        columns = ["name", "race_class", "appearance", "personality", "backstory", "plot_hooks", "attitude", "rarity",
-                   "race", "character_class", "environment", "background", "gender", "image_data", "custom_prompt",
-                   "roleplaying_tips"]
-        placeholders = ", ".join(["?"] * len(columns))
-        sql = f"INSERT OR REPLACE INTO npcs ({', '.join(columns)}) VALUES ({placeholders})"
-        values = tuple(npc_data.get(col) for col in columns)
+        original = self._compress_portrait(npc_data)
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, values)
-                conn.commit()
+            thumbnails = self._make_thumbnails(npc_data.get('image_data'), old_name or npc_data['name'])
+            stored = self._stored_portrait({col: npc_data.get(col) for col in NPC_COLUMNS})
+            with self.transaction() as conn:
+                renamed = old_name and old_name != npc_data['name'] and self._update_npc(conn, old_name, stored)
+                if not renamed: self._upsert_npc(conn, stored)
+                self._record_change("npc", npc_data['name'], old_name if renamed else None)
+                self._store_portrait_original(conn, npc_data['name'], original)
+                self._store_thumbnails(conn, npc_data['name'], thumbnails)
             logging.info(f"Successfully saved NPC '{npc_data['name']}' to the database.")
         except sqlite3.Error as e:
             logging.error(f"Failed to save NPC '{npc_data['name']}': {e}")
+            raise
+
+    @staticmethod
+    def _upsert_npc(conn, npc_data):
+        columns = NPC_STORED_COLUMNS
+        placeholders = ", ".join(["?"] * len(columns))
+        # An upsert rather than INSERT OR REPLACE, so the row keeps its npc_id and the search triggers fire.
+        updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col != "name")
+        sql = f"INSERT INTO npcs ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT(name) DO UPDATE SET {updates}"
+        conn.execute(sql, tuple(npc_data.get(col) for col in columns))
+
+    @timed_query
+    def update_npc(self, name, changes):
+        """
+        Writes only the given columns of the NPC saved as `name`, e.g. {'backstory': ...}; a 'name' entry renames
+        it in place. Returns False if there is no such NPC, so callers can use save_npc; raises if the write fails.
+        """
+        original = self._compress_portrait(changes) if changes.get('image_data') else None
+        try:
+            thumbnails = self._make_thumbnails(changes['image_data'], name) if 'image_data' in changes else None
+            stored = self._stored_portrait(changes)
+            with self.transaction() as conn:
+                updated = self._update_npc(conn, name, stored)
+                if updated:
+                    self._store_portrait_original(conn, changes.get('name', name), original)
+                    self._store_thumbnails(conn, changes.get('name', name), thumbnails)
+                    self._record_change("npc", changes.get('name', name), name)
+            if updated: logging.info(f"Updated {sorted(changes)} of NPC '{name}'.")
+            return updated
+        except sqlite3.Error as e:
+            logging.error(f"Failed to update NPC '{name}': {e}")
+            raise
+
+    def _compress_portrait(self, npc_data):
+        """
+        Applies the portrait storage policy to npc_data['image_data'] in place, before any transaction is open.
+        Returns the original image when the policy keeps originals and it was replaced, else None.
+        """
+        image_bytes = npc_data.get('image_data')
+        compressed = compress_portrait(image_bytes, self.portrait_policy)
+        if compressed is image_bytes: return None
+        npc_data['image_data'] = compressed
+        return image_bytes if self.portrait_policy.keep_originals else None
+
+    def _stored_portrait(self, values):
+        """
+        `values` as they should be written: with the blob store on, a portrait in 'image_data' is saved there and
+        replaced by its 'portrait_hash'. Any 'image_data' given also sets 'portrait_hash', so the two never disagree.
+        The caller's dict is left alone; it keeps the image for display.
+        """
+        if 'image_data' not in values: return values
+        image_bytes = values['image_data']
+        if image_bytes and self.use_blob_store:
+            return dict(values, image_data=None, portrait_hash=self.blobs.put(image_bytes))
+        return dict(values, portrait_hash=None)
+
+    def _portrait_of(self, row):
+        """The portrait bytes of a row holding image_data and portrait_hash: inline, or read from the blob store."""
+        if row['image_data'] is not None or not row['portrait_hash']: return row['image_data']
+        return self.blobs.read(row['portrait_hash'])
+
+    def _with_portrait(self, row):
+        """dict(row) with image_data filled in from the blob store where the row only holds the hash."""
+        npc = dict(row)
+        if 'portrait_hash' in npc:
+            npc['image_data'] = self._portrait_of(npc)
+            del npc['portrait_hash']
+        return npc
+
+    @staticmethod
+    def _store_portrait_original(conn, name, original):
+        if original is None: return
+        row = conn.execute("SELECT npc_id FROM npcs WHERE name = ?", (name,)).fetchone()
+        if row is not None: store_original(conn, row['npc_id'], original)
+
+    def _make_thumbnails(self, image_bytes, name=None):
+        """
+        Thumbnails for a portrait about to be written, as (portrait hash, {size: bytes}), made before the write's
+        transaction opens. None if the NPC saved as `name` already has thumbnails of this exact portrait.
+        """
+        image_hash = portrait_hash(image_bytes)
+        if image_hash and name is not None:
+            row = self._get_connection().execute(
+                "SELECT t.portrait_hash FROM npc_thumbnails t JOIN npcs n ON n.npc_id = t.npc_id WHERE n.name = ? "
+                "LIMIT 1", (name,)).fetchone()
+            if row is not None and row['portrait_hash'] == image_hash: return None
+        return image_hash, make_thumbnails(image_bytes)
+
+    @staticmethod
+    def _store_thumbnails(conn, name, thumbnails):
+        if thumbnails is None: return
+        row = conn.execute("SELECT npc_id FROM npcs WHERE name = ?", (name,)).fetchone()
+        if row is not None: store_thumbnails(conn, row['npc_id'], *thumbnails)
+
+    @staticmethod
+    def _update_npc(conn, name, changes):
+        """Updates the row saved as `name` in place, replacing any other NPC already called its new name."""
+        changes = {col: value for col, value in changes.items() if col in NPC_STORED_COLUMNS}
+        row = conn.execute("SELECT npc_id FROM npcs WHERE name = ?", (name,)).fetchone()
+        if row is None: return False
+        if not changes: return True
+        if changes.get('name', name) != name: conn.execute("DELETE FROM npcs WHERE name = ?", (changes['name'],))
+        assignments = ", ".join(f"{col} = ?" for col in changes)
+        conn.execute(f"UPDATE npcs SET {assignments} WHERE npc_id = ?", tuple(changes.values()) + (row['npc_id'],))
+        return True
+
+    @staticmethod
+    def _unique_npc_name(conn, name):
+        candidate, suffix = name, 2
+        while conn.execute("SELECT 1 FROM npcs WHERE name = ?", (candidate,)).fetchone():
+            candidate = f"{name} ({suffix})"
+            suffix += 1
+        return candidate
+
+    @timed_query
+    def search_npcs(self, query="", facets=None, limit=50, offset=None, count_facets=True):
+        """
+        Full-text search over NPC text with optional facet filters, e.g. facets={'race': 'Elf'}.
 
+        Results are ordered by name and paginated by keyset: pass the returned 'next_offset' (the last
+        name on this page) as `offset` to fetch the next page. Facet counts are only computed for the
+        first page and exclude each facet's own filter, so every menu shows its alternatives.
+        """
+        facets = {col: value for col, value in (facets or {}).items() if col in NPC_FACET_COLUMNS and value}
+        match_query = self._build_match_query(query)
+
+        def where_clause(skip_facet=None):
+            # The IN (subquery) form lets SQLite walk the name or facet index and stop at LIMIT,
+            # which is far cheaper than joining and sorting every match for broad queries.
+            conditions, params = [], []
+            if match_query:
+                conditions.append("npc_id IN (SELECT rowid FROM npcs_fts WHERE npcs_fts MATCH ?)")
+                params.append(match_query)
+            for col, value in facets.items():
+                if col == skip_facet: continue
+                conditions.append(f"{col} = ? COLLATE NOCASE")
+                params.append(value)
+            return conditions, params
+
+        conditions, params = where_clause()
+        page_conditions = conditions + (["name > ?"] if offset else [])
+        page_params = params + ([offset] if offset else [])
+        where = f" WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+        sql = (f"SELECT {', '.join(NPC_SUMMARY_COLUMNS)}, {HAS_PORTRAIT} AS has_portrait FROM npcs{where} "
+               f"ORDER BY name LIMIT ?")
+        try:
+            conn = self._get_connection()
+            results = [dict(row) for row in conn.execute(sql, page_params + [limit]).fetchall()]
+            facet_counts = {}
+            if count_facets and not offset:
+                for col in NPC_FACET_COLUMNS:
+                    facet_conditions, facet_params = where_clause(skip_facet=col)
+                    facet_where = f" WHERE {' AND '.join(facet_conditions)}" if facet_conditions else ""
+                    rows = conn.execute(f"SELECT {col} AS value, COUNT(*) AS count FROM npcs{facet_where} "
+                                        f"GROUP BY {col} COLLATE NOCASE", facet_params).fetchall()
+                    facet_counts[col] = {row['value']: row['count'] for row in rows if row['value']}
+            next_offset = results[-1]['name'] if len(results) == limit else None
+            return {"results": results, "facet_counts": facet_counts, "next_offset": next_offset}
+        except sqlite3.Error as e:
+            logging.error(f"NPC search failed for query '{query}': {e}")
+            return {"results": [], "facet_counts": {}, "next_offset": None}
+
+    @staticmethod
+    def _build_match_query(query):
+        """Turns free text into an FTS5 query that prefix-matches every word."""
+        tokens = re.findall(r"\w+", query or "")
+        return " ".join(f'"{token}"*' for token in tokens)
+
+    @timed_query
+    def save_npcs(self, npc_list):
+        """Saves several new or updated NPCs in a single transaction: all of them, or none and raises."""
+        try:
+            with self.transaction():
+                for npc_data in npc_list: self.save_npc(npc_data)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to save a batch of {len(npc_list)} NPCs; none were saved: {e}")
+            raise
+        logging.info(f"Saved a batch of {len(npc_list)} NPCs.")
+
+    @timed_query
     def delete_npc(self, npc_name):
         sql = "DELETE FROM npcs WHERE name = ?"
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, (npc_name,))
-                conn.commit()
+            with self.transaction() as conn:
+                if conn.execute(sql, (npc_name,)).rowcount: self._record_change("npc", npc_name, deleted=True)
             logging.info(f"Successfully deleted NPC '{npc_name}' from the database.")
         except sqlite3.Error as e:
             logging.error(f"Failed to delete NPC '{npc_name}': {e}")
+            raise
 
+    @timed_query
     def load_campaigns(self):
         campaigns_dict = {}
         try:
-            with self._get_connection() as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM campaigns")
-                rows = cursor.fetchall()
-                for row in rows: campaigns_dict[row['campaign_name']] = dict(row)
+            rows = self._get_connection().execute("SELECT * FROM campaigns").fetchall()
+            for row in rows: campaigns_dict[row['campaign_name']] = dict(row)
             logging.info(f"Successfully loaded {len(campaigns_dict)} campaigns.")
             return campaigns_dict
         except sqlite3.Error as e:
             logging.error(f"Failed to load campaigns from database: {e}")
             return {}
 
+    @timed_query
+    def get_campaign(self, campaign_name):
+        try:
+            row = self._get_connection().execute("SELECT * FROM campaigns WHERE campaign_name = ?",
+                                                 (campaign_name,)).fetchone()
+            return dict(row) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load campaign '{campaign_name}': {e}")
+            return None
+
+    @timed_query
     def save_campaign(self, campaign_data, old_name=None):
-        if old_name and old_name != campaign_data['campaign_name']: self.delete_campaign(old_name)
-        sql = "INSERT OR REPLACE INTO campaigns (campaign_name, campaign_lore, party_info, session_history) VALUES (?, ?, ?, ?)"
+        rename_sql = "UPDATE campaigns SET campaign_name = ?, campaign_lore = ?, party_info = ?, session_history = ? WHERE campaign_name = ?"
         values = (campaign_data['campaign_name'], campaign_data.get('campaign_lore'), campaign_data.get('party_info'),
                   campaign_data.get('session_history'))
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, values)
-                conn.commit()
+            with self.transaction() as conn:
+                renamed = False
+                if old_name and old_name != campaign_data['campaign_name']:
+                    # A rename keeps the campaign's id; a campaign already using the new name is replaced.
+                    conn.execute("DELETE FROM campaigns WHERE campaign_name = ?", (campaign_data['campaign_name'],))
+                    renamed = conn.execute(rename_sql, values + (old_name,)).rowcount > 0
+                if not renamed: self._upsert_campaign(conn, campaign_data)
+                self._record_change("campaign", campaign_data['campaign_name'], old_name if renamed else None)
             logging.info(f"Successfully saved campaign '{campaign_data['campaign_name']}'.")
         except sqlite3.Error as e:
             logging.error(f"Failed to save campaign '{campaign_data['campaign_name']}': {e}")
+            raise
 
+    @staticmethod
+    def _upsert_campaign(conn, campaign_data):
+        updates = ", ".join(f"{col} = excluded.{col}" for col in CAMPAIGN_COLUMNS if col != "campaign_name")
+        conn.execute(f"INSERT INTO campaigns ({', '.join(CAMPAIGN_COLUMNS)}) VALUES (?, ?, ?, ?) "
+                     f"ON CONFLICT(campaign_name) DO UPDATE SET {updates}",
+                     tuple(campaign_data.get(col) for col in CAMPAIGN_COLUMNS))
+
+    @timed_query
     def delete_campaign(self, campaign_name):
         sql = "DELETE FROM campaigns WHERE campaign_name = ?"
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(sql, (campaign_name,))
-                conn.commit()
+            with self.transaction() as conn:
+                if conn.execute(sql, (campaign_name,)).rowcount:
+                    self._record_change("campaign", campaign_name, deleted=True)
             logging.info(f"Successfully deleted campaign '{campaign_name}'.")
         except sqlite3.Error as e:
             logging.error(f"Failed to delete campaign '{campaign_name}': {e}")
+            raise
+
+
+    # --- Jobs ---
+
+    @timed_query
+    def enqueue_job(self, kind, payload, priority, owner=None):
+        """Records a queued job and returns its id, or None if it could not be stored."""
+        sql = "INSERT INTO jobs (kind, owner, status, priority, payload, created_at) VALUES (?, ?, 'queued', ?, ?, ?)"
+        try:
+            with self.transaction() as conn:
+                return conn.execute(sql, (kind, owner, priority, json.dumps(payload), time.time())).lastrowid
+        except sqlite3.Error as e:
+            logging.error(f"Failed to enqueue {kind} job: {e}")
+            return None
+
+    @timed_query
+    def enqueue_jobs(self, kind, payloads, priority, owner=None):
+        """Records several queued jobs in one transaction and returns their ids, or None if they could not be stored."""
+        sql = "INSERT INTO jobs (kind, owner, status, priority, payload, created_at) VALUES (?, ?, 'queued', ?, ?, ?)"
+        try:
+            with self.transaction() as conn:
+                now = time.time()
+                return [conn.execute(sql, (kind, owner, priority, json.dumps(payload), now)).lastrowid
+                        for payload in payloads]
+        except sqlite3.Error as e:
+            logging.error(f"Failed to enqueue {len(payloads)} {kind} jobs: {e}")
+            return None
+
+    @timed_query
+    def start_job(self, job_id):
+        sql = "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?"
+        try:
+            with self.transaction() as conn:
+                conn.execute(sql, (time.time(), job_id))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to mark job {job_id} as running: {e}")
+
+    @timed_query
+    def complete_job(self, job_id, result, result_blob=None, npc_data=None):
+        """
+        Stores a job's result and marks it done. If `npc_data` is given, the NPC is saved to the roster in the
+        same transaction under a free name, which is written back into it and into result['npc'], and the job
+        counts as delivered. Returns True once committed, False if the NPC's portrait couldn't be stored or the
+        write failed.
+        """
+        try:
+            original = self._compress_portrait(npc_data) if npc_data is not None else None
+            thumbnails = self._make_thumbnails(npc_data.get('image_data')) if npc_data is not None else None
+            stored = self._stored_portrait(npc_data) if npc_data is not None else None
+            with self.transaction() as conn:
+                if npc_data is not None:
+                    npc_data['name'] = self._unique_npc_name(conn, npc_data.get('name') or "Unnamed NPC")
+                    self._upsert_npc(conn, dict(stored, name=npc_data['name']))
+                    self._store_portrait_original(conn, npc_data['name'], original)
+                    self._store_thumbnails(conn, npc_data['name'], thumbnails)
+                    self._record_change("npc", npc_data['name'])
+                    if isinstance(result.get('npc'), dict): result['npc']['name'] = npc_data['name']
+                conn.execute("UPDATE jobs SET status = 'done', result = ?, result_blob = ?, error = NULL, "
+                             "delivered = ?, finished_at = ? WHERE id = ?",
+                             (json.dumps(result), result_blob, int(npc_data is not None), time.time(), job_id))
+            return True
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.error(f"Failed to store the result of job {job_id}: {e}")
+            return False
+
+    @timed_query
+    def fail_job(self, job_id, error):
+        sql = "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?"
+        try:
+            with self.transaction() as conn:
+                conn.execute(sql, (str(error), time.time(), job_id))
+        except sqlite3.Error as e:
+            logging.error(f"Failed to mark job {job_id} as failed: {e}")
+
+    @timed_query
+    def requeue_interrupted_jobs(self, max_attempts):
+        """
+        Puts jobs left 'running' by a crash or exit back in the queue, failing those already tried
+        `max_attempts` times, and returns every queued job (oldest first) for the workers to pick up.
+        """
+        try:
+            with self.transaction() as conn:
+                conn.execute("UPDATE jobs SET status = 'failed', error = 'Interrupted too many times', "
+                             "finished_at = ? WHERE status = 'running' AND attempts >= ?", (time.time(), max_attempts))
+                conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+            rows = self._get_connection().execute(
+                "SELECT id, kind, owner, status, priority, payload, attempts FROM jobs WHERE status = 'queued' "
+                "ORDER BY id").fetchall()
+            return [self._job_from_row(row) for row in rows]
+        except sqlite3.Error as e:
+            logging.error(f"Failed to requeue interrupted jobs: {e}")
+            return []
+
+    @timed_query
+    def get_job(self, job_id):
+        try:
+            row = self._get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self._job_from_row(row) if row else None
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load job {job_id}: {e}")
+            return None
+
+    @timed_query
+    def load_undelivered_jobs(self, kind, owner):
+        """Finished jobs whose results no window has shown yet, newest first."""
+        sql = "SELECT * FROM jobs WHERE kind = ? AND owner = ? AND status = 'done' AND delivered = 0 ORDER BY id DESC"
+        try:
+            return [self._job_from_row(row) for row in self._get_connection().execute(sql, (kind, owner)).fetchall()]
+        except sqlite3.Error as e:
+            logging.error(f"Failed to load undelivered {kind} jobs: {e}")
+            return []
+
+    @timed_query
+    def mark_jobs_delivered(self, job_ids):
+        try:
+            with self.transaction() as conn:
+                conn.executemany("UPDATE jobs SET delivered = 1 WHERE id = ?", [(job_id,) for job_id in job_ids])
+        except sqlite3.Error as e:
+            logging.error(f"Failed to mark jobs {job_ids} as delivered: {e}")
+
+    @timed_query
+    def job_stats(self, window_seconds):
+        """Job counts by status, plus how many finished within the last `window_seconds`."""
+        stats = {"queued": 0, "running": 0, "done": 0, "failed": 0, "finished_recently": 0}
+        try:
+            conn = self._get_connection()
+            for row in conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"):
+                stats[row['status']] = row['count']
+            stats["finished_recently"] = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('done', 'failed') AND finished_at >= ?",
+                (time.time() - window_seconds,)).fetchone()[0]
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read job statistics: {e}")
+        return stats
+
+    @timed_query
+    def prune_jobs(self, older_than_seconds):
+        """Deletes finished jobs older than the cutoff, keeping any result no window has picked up yet."""
+        sql = "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ? AND (delivered = 1 OR status = 'failed')"
+        try:
+            with self.transaction() as conn:
+                removed = conn.execute(sql, (time.time() - older_than_seconds,)).rowcount
+            if removed: logging.info(f"Pruned {removed} old jobs.")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to prune old jobs: {e}")
+
+    @staticmethod
+    def _job_from_row(row):
+        job = dict(row)
+        for field in ("payload", "result"):
+            if job.get(field) is not None: job[field] = json.loads(job[field])
+        return job
+
+
+class ResponseCache:
+    """
+    An opt-in, SQLite-backed cache of Gemini responses, keyed on the model plus a hash of the fully rendered
+    prompt and request config. Entries expire after `ttl_seconds`, and the least recently used ones are
+    evicted once the cache grows past `max_bytes`. Binary responses are stored once per content hash.
+    """
+
+    def __init__(self, data_manager, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.db = data_manager
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model, kind, prompt, config=None):
+        payload = json.dumps({"model": model, "kind": kind, "prompt": prompt, "config": config}, sort_keys=True,
+                             default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key):
+        """Returns the cached text or bytes for `cache_key`, or None on a miss."""
+        sql = ("SELECT response_cache.text_value, response_blobs.data, response_cache.created_at FROM response_cache "
+               "LEFT JOIN response_blobs ON response_blobs.blob_hash = response_cache.blob_hash "
+               "WHERE response_cache.cache_key = ?")
+        try:
+            row = self.db._get_connection().execute(sql, (cache_key,)).fetchone()
+            if row and time.time() - row['created_at'] <= self.ttl_seconds:
+                with self.db.transaction() as conn:
+                    conn.execute("UPDATE response_cache SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key))
+                self._count(hit=True)
+                return row['data'] if row['data'] is not None else row['text_value']
+        except sqlite3.Error as e:
+            logging.error(f"Response cache lookup failed: {e}")
+        self._count(hit=False)
+        return None
+
+    def put(self, cache_key, model, kind, value):
+        """Stores a text (str) or binary (bytes) response."""
+        now = time.time()
+        text_value, blob_hash = (value, None) if isinstance(value, str) else (None, hashlib.sha256(value).hexdigest())
+        size = len(text_value.encode("utf-8")) if text_value is not None else len(value)
+        try:
+            with self.db.transaction() as conn:
+                if blob_hash:
+                    conn.execute("INSERT OR IGNORE INTO response_blobs (blob_hash, data, size) VALUES (?, ?, ?)",
+                                 (blob_hash, value, size))
+                conn.execute("INSERT OR REPLACE INTO response_cache (cache_key, model, kind, text_value, blob_hash, "
+                             "size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (cache_key, model, kind, text_value, blob_hash, size, now, now))
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            logging.error(f"Failed to store response in cache: {e}")
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache WHERE text_value IS NOT NULL"
+                             ).fetchone()[0] + conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_blobs"
+                                                            ).fetchone()[0]
+        if total > self.max_bytes:
+            rows = conn.execute("SELECT cache_key, size FROM response_cache ORDER BY last_used").fetchall()
+            doomed = []
+            for row in rows:
+                if total <= self.max_bytes: break
+                doomed.append((row['cache_key'],))
+                total -= row['size']
+            conn.executemany("DELETE FROM response_cache WHERE cache_key = ?", doomed)
+            logging.info(f"Evicted {len(doomed)} entries from the response cache.")
+        conn.execute("DELETE FROM response_blobs WHERE blob_hash NOT IN "
+                     "(SELECT blob_hash FROM response_cache WHERE blob_hash IS NOT NULL)")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        try:
+            with self.db.transaction() as conn:
+                conn.execute("DELETE FROM response_cache")
+                conn.execute("DELETE FROM response_blobs")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to clear the response cache: {e}")
+
+
+def format_stage_timings(timings):
+    """Renders pipeline timings as a one-line summary, including how much the two stages overlapped."""
+    parts = []
+    if 'text_end' in timings:
+        parts.append(f"text {timings['text_end'] - timings.get('text_start', 0):.1f}s")
+    if 'portrait_end' in timings:
+        parts.append(f"portrait {timings['portrait_end'] - timings['portrait_start']:.1f}s "
+                     f"(started at {timings['portrait_start']:.1f}s)")
+        overlap = min(timings['text_end'], timings['portrait_end']) - timings['portrait_start']
+        if overlap > 0: parts.append(f"overlap {overlap:.1f}s")
+    if 'total' in timings: parts.append(f"total {timings['total']:.1f}s")
+    return ", ".join(parts)
+
+
+class RateLimiter:
+    """A thread-safe token bucket: `rate_per_minute` sustained, with bursts of up to `burst` calls."""
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or max(1, rate_per_minute // 10))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a call is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+# Scheduler priority classes; lower runs first.
+PRIORITY_INTERACTIVE = 0  # table-side simulations
+PRIORITY_WORKSHOP = 1  # generation the user is waiting on in the workshop
+PRIORITY_BACKGROUND = 2  # batch items and other work nobody is watching
+
+
+class CancellationToken(threading.Event):
+    """Set to abandon a task; queued work is dropped and waits for a model slot stop early."""
+
+    def cancel(self):
+        self.set()
+
+    @property
+    def cancelled(self):
+        return self.is_set()
+
+
+class RequestScheduler:
+    """
+    Runs AI tasks on a shared pool of worker threads, highest priority first.
+
+    Background tasks may occupy at most `background_limit` workers, so interactive and workshop work always
+    finds one free. Each API call additionally takes a slot for its model (see slot()); when a model is at
+    its concurrency limit the slot goes to the highest-priority waiter, so a live simulation overtakes
+    queued batch calls. Identical calls already in flight are shared through coalesce().
+    """
+
+    def __init__(self, model_limits, workers=SCHEDULER_WORKERS, background_limit=BATCH_MAX_WORKERS):
+        self.model_limits = dict(model_limits)
+        self.workers = workers
+        self.background_limit = min(background_limit, workers - 1)
+        self._condition = threading.Condition()
+        self._queue = []  # heap of (priority, sequence, job)
+        self._sequence = itertools.count()
+        self._threads = []
+        self._idle = 0
+        self._running_background = 0
+        self._active = {}  # model -> calls holding a slot
+        self._waiters = {}  # model -> heap of (priority, sequence) waiting for a slot
+        self._inflight = {}  # coalescing key -> Future
+        self._local = threading.local()
+
+    # --- Tasks ---
+
+    def submit(self, fn, *args, priority=PRIORITY_WORKSHOP, token=None, name=None, **kwargs):
+        """Queues fn(*args, **kwargs) and returns a Future for its result."""
+        future = Future()
+        job = (fn, args, kwargs, priority, token, name or getattr(fn, "__name__", "task"), future)
+        with self._condition:
+            heapq.heappush(self._queue, (priority, next(self._sequence), job))
+            if self._idle == 0 and len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"ai-worker-{len(self._threads) + 1}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._condition.notify_all()
+        return future
+
+    def _next_job(self):
+        """Pops the best runnable job; background jobs wait while the background share is in use."""
+        deferred, job = [], None
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            if entry[0] >= PRIORITY_BACKGROUND and self._running_background >= self.background_limit:
+                deferred.append(entry)
+                continue
+            job = entry[2]
+            break
+        for entry in deferred: heapq.heappush(self._queue, entry)
+        return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._idle += 1
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                self._idle -= 1
+                fn, args, kwargs, priority, token, name, future = job
+                if priority >= PRIORITY_BACKGROUND: self._running_background += 1
+            try:
+                if token is not None and token.is_set():
+                    future.cancel()
+                elif future.set_running_or_notify_cancel():
+                    with self.context(priority, token):
+                        try:
+                            future.set_result(fn(*args, **kwargs))
+                        except BaseException as e:
+                            future.set_exception(e)
+            finally:
+                with self._condition:
+                    if priority >= PRIORITY_BACKGROUND: self._running_background -= 1
+                    self._condition.notify_all()
+
+    @contextmanager
+    def context(self, priority, token=None):
+        """Makes calls on this thread use `priority` and `token`, e.g. for helper threads a task starts."""
+        previous = getattr(self._local, "context", None)
+        self._local.context = (priority, token)
+        try:
+            yield
+        finally:
+            self._local.context = previous
+
+    def current(self):
+        """(priority, token) of the task running on this thread; unscheduled threads count as workshop work."""
+        return getattr(self._local, "context", None) or (PRIORITY_WORKSHOP, None)
+
+    def check_cancelled(self):
+        token = self.current()[1]
+        if token is not None and token.is_set(): raise CancelledError("The request was cancelled.")
+
+    # --- Per-model slots ---
+
+    def acquire(self, model):
+        """Blocks until `model` has a free slot and no higher-priority call is waiting; returns a release callable."""
+        priority, token = self.current()
+        limit = self.model_limits.get(model, 1)
+        ticket = (priority, next(self._sequence))
+        with self._condition:
+            waiters = self._waiters.setdefault(model, [])
+            heapq.heappush(waiters, ticket)
+            try:
+                while self._active.get(model, 0) >= limit or waiters[0] != ticket:
+                    if token is not None and token.is_set(): raise CancelledError("The request was cancelled.")
+                    self._condition.wait(timeout=0.25)  # tokens are plain events, so poll for cancellation
+            finally:
+                waiters.remove(ticket)
+                heapq.heapify(waiters)
+                self._condition.notify_all()
+            self._active[model] = self._active.get(model, 0) + 1
+        released = threading.Event()
+
+        def release():
+            if released.is_set(): return
+            released.set()
+            with self._condition:
+                self._active[model] -= 1
+                self._condition.notify_all()
+
+        return release
+
+    @contextmanager
+    def slot(self, model):
+        release = self.acquire(model)
+        try:
+            yield
+        finally:
+            release()
+
+    # --- Coalescing ---
+
+    def coalesce(self, key, fn):
+        """Runs fn() unless an identical call (same `key`) is in flight, in which case its result is shared."""
+        with self._condition:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                future.set_running_or_notify_cancel()
+                self._inflight[key] = future
+        if not owner:
+            logging.info("Joining an identical request that is already in flight.")
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._condition:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        with self._condition:
+            return {"queued": len(self._queue), "workers": len(self._threads), "idle": self._idle,
+                    "background_running": self._running_background, "active_calls": dict(self._active)}
+
+
+class _SlotStream:
+    """
+    A streaming response that gives its model slot back once it is exhausted or closed, then reports
+    (first_chunk_ms, received_bytes, last_chunk, error) to `on_finish`.
+    """
+
+    def __init__(self, stream, release, started, on_finish=None):
+        self._stream = stream
+        self._release = release
+        self._started = started
+        self._on_finish = on_finish
+        self._first_chunk_ms = None
+        self._received_bytes = 0
+        self._last_chunk = None
+        self._error = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._stream)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self._error = e
+            self.close()
+            raise
+        if self._first_chunk_ms is None: self._first_chunk_ms = (time.perf_counter() - self._started) * 1000
+        self._received_bytes += len((getattr(chunk, "text", None) or "").encode("utf-8"))
+        self._last_chunk = chunk
+        return chunk
+
+    def close(self):
+        if self._release is None: return
+        try:
+            if hasattr(self._stream, "close"): self._stream.close()
+        finally:
+            self._release()
+            self._release = None
+            if self._on_finish:
+                self._on_finish(self._first_chunk_ms, self._received_bytes, self._last_chunk, self._error)
+
+
+def _usage_tokens(response):
+    """(input, output) token counts reported by the API, or None for each when the response has no usage data."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", None), getattr(usage, "candidates_token_count", None)
+
+
+def _response_bytes(response):
+    images = getattr(response, "generated_images", None)
+    if images: return sum(len(image.image.image_bytes or b"") for image in images)
+    return len((getattr(response, "text", None) or "").encode("utf-8"))
+
+
+def _load_sdk():
+    """
+    Imports the google-genai SDK on first use rather than at startup: it is by far the slowest import in
+    the app, and windows that never call the API (campaigns, stats) should not wait for it.
+    """
+    from google import genai
+    return genai
 
 
 class GeminiService:
-    def __init__(self, api_key, text_model_name, image_model_name):
+    def __init__(self, api_key, text_model_name, image_model_name, response_cache=None, context_builder=None,
+                 client=None, resilience=None, metrics=None):
         self.api_key = api_key
         self.text_model_name = text_model_name
         self.image_model_name = image_model_name
-        self.client = None
-        self._configure_api()
+        self.response_cache = response_cache
+        self.context_builder = context_builder
+        self.last_prompt_tokens = {}  # token estimate of the most recent prompt, per request kind
+        self._client = client  # an injected client (e.g. fake_gemini.FakeGeminiClient) skips API key setup
+        self._client_error = None
+        self._client_lock = threading.Lock()
+        self._key_looks_valid = client is not None or self._is_api_key_format_valid()
+        self.rate_limiters = {
+            text_model_name: RateLimiter(TEXT_REQUESTS_PER_MINUTE),
+            image_model_name: RateLimiter(IMAGE_REQUESTS_PER_MINUTE),
+        }
+        self.resilience = resilience or ResilientCaller()
+        self.metrics = metrics
+        self.scheduler = RequestScheduler({text_model_name: TEXT_MODEL_CONCURRENCY,
+                                           image_model_name: IMAGE_MODEL_CONCURRENCY})
+        self.deadlines = {text_model_name: TEXT_REQUEST_DEADLINE_SECONDS,
+                          image_model_name: IMAGE_REQUEST_DEADLINE_SECONDS}
+
+    @property
+    def client(self):
+        """The API client, created (and the SDK imported) on first use. Raises ValueError if that failed."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None and self._client_error is None: self._configure_api()
+        if self._client is None: raise ValueError("API Client not configured. Check your API key.")
+        return self._client
 
     def _configure_api(self):
-        if self._is_api_key_format_valid():
+        if not self._key_looks_valid:
+            self._client_error = "API key is missing or a placeholder."
+            return
+        started = time.perf_counter()
+        try:
+            genai = _load_sdk()
+            self._client = genai.Client(api_key=self.api_key)
+            logging.info(f"Gemini API Client configured in {(time.perf_counter() - started) * 1000:.0f}ms.")
+        except Exception as e:
+            logging.error(f"Failed to instantiate Gemini API client: {e}")
+            self._client_error = str(e)
+
+    def warm_up(self, on_ready=None):
+        """
+        Imports the SDK and creates the client on a background thread, so the first AI request doesn't pay
+        for it. `on_ready(seconds)` is called from that thread once done (whether or not it succeeded).
+        """
+
+        def create():
+            started = time.perf_counter()
             try:
-                self.client = genai.Client(api_key=self.api_key)
-                logging.info("Gemini API Client configured.")
-            except Exception as e:
-                logging.error(f"Failed to instantiate Gemini API client: {e}")
-                self.client = None
+                self.client
+            except ValueError:
+                pass
+            if on_ready: on_ready(time.perf_counter() - started)
+
+        threading.Thread(target=create, name="gemini-warm-up", daemon=True).start()
 
     def _is_api_key_format_valid(self):
         is_valid = self.api_key and "INSERT" not in self.api_key and len(self.api_key) > 10
@@ -161,35 +1190,91 @@ class GeminiService:
         return is_valid
 
     def is_api_key_valid(self):
-        return self.client is not None
+        """True while AI calls can be attempted; doesn't force the client to be created."""
+        return self._client is not None or (self._key_looks_valid and self._client_error is None)
 
-    def generate_npc(self, params, campaign_data=None, include_party=True, include_session=True):
-        """Generates an NPC using the Gemini API based on given parameters and full campaign context."""
-        if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
-        campaign_data = campaign_data or {}
+    def submit(self, fn, *args, priority=PRIORITY_WORKSHOP, token=None, **kwargs):
+        """Runs fn on the shared AI scheduler; see RequestScheduler.submit."""
+        return self.scheduler.submit(fn, *args, priority=priority, token=token, **kwargs)
 
-        lore_context = campaign_data.get('campaign_lore', '')
-        party_context = campaign_data.get('party_info', '') if include_party else ""
-        session_context = campaign_data.get('session_history', '') if include_session else ""
-        custom_prompt_text = params.get('custom_prompt', '')
+    def _call(self, model, request, operation, prompt="", config=None):
+        """
+        Runs one API request in a model slot, through the rate limiter, retry policy and circuit breaker.
+        `request(config)` gets `config` with each attempt's share of the model's deadline as its HTTP timeout.
+        """
 
-        campaign_context_section = f"\n**Campaign Lore (Follow this lore closely):**\n{lore_context}\n" if lore_context else ""
-        party_context_section = f"\n**Player Party Information (Consider their impact):**\n{party_context}\n" if party_context else ""
-        session_context_section = f"\n**Recent Session History (The NPC may be aware of these events):**\n{session_context}\n" if session_context else ""
-        custom_prompt_section = f"\n**Additional Custom Prompt:**\n- {custom_prompt_text}\n" if custom_prompt_text else ""
+        def attempt(timeout):
+            return request(self._attempt_config(model, config, timeout))
 
-        prompt = NPC_GENERATION_PROMPT.format(
-            gender=params['gender'], attitude=params['attitude'], rarity=params['rarity'],
-            environment=params['environment'], race=params['race'], character_class=params['character_class'],
-            background=params['background'],
-            campaign_context=campaign_context_section,
-            party_context=party_context_section,
-            session_context=session_context_section,
-            custom_prompt_section=custom_prompt_section
-        )
+        self.scheduler.check_cancelled()
+        started = time.perf_counter()
+        try:
+            with self.scheduler.slot(model):
+                response = self.resilience.call(model, attempt, self.deadlines.get(model))
+        except Exception as e:
+            self._record_call(operation, model, started, prompt, error=e)
+            raise
+        self._record_call(operation, model, started, prompt, response=response)
+        return response
+
+    def _open_stream(self, model, start_stream, operation, prompt="", config=None):
+        """Like _call for streaming requests; only failures before the first chunk are retried."""
+
+        def attempt(timeout):
+            return start_stream(self._attempt_config(model, config, timeout))
+
+        def on_finish(first_chunk_ms, received_bytes, last_chunk, error):
+            self._record_call(operation, model, started, prompt, response=last_chunk, streamed=True,
+                              ttfb_ms=first_chunk_ms, response_bytes=received_bytes, error=error)
+
+        self.scheduler.check_cancelled()
+        started = time.perf_counter()
+        release = self.scheduler.acquire(model)
+        try:
+            stream = self.resilience.open_stream(model, attempt, self.deadlines.get(model))
+        except BaseException as e:
+            release()
+            self._record_call(operation, model, started, prompt, streamed=True, error=e)
+            raise
+        return _SlotStream(stream, release, started, on_finish)
+
+    def _attempt_config(self, model, config, timeout):
+        """
+        Waits for the rate limiter, then returns `config` (a dict or None) with the SDK's per-request HTTP timeout
+        set to what is left of `timeout` seconds, so a hung request ends at the deadline instead of outliving it.
+        """
+        waiting_since = time.monotonic()
+        self.rate_limiters[model].acquire()
+        if timeout is None: return config
+        timeout -= time.monotonic() - waiting_since
+        if timeout <= 0: raise DeadlineExceededError(f"'{model}' was rate limited past its deadline.")
+        return dict(config or {}, http_options={"timeout": max(1, int(timeout * 1000))})  # milliseconds
+
+    def _record_call(self, operation, model, started, prompt, response=None, streamed=False, ttfb_ms=None,
+                     response_bytes=None, error=None):
+        if self.metrics is None: return
+        wall_ms = (time.perf_counter() - started) * 1000
+        if not streamed and error is None: ttfb_ms = wall_ms  # a non-streaming response arrives all at once
+        input_tokens, output_tokens = _usage_tokens(response)
+        if response_bytes is None and response is not None: response_bytes = _response_bytes(response)
+        if output_tokens is None and response_bytes and model == self.text_model_name:
+            output_tokens = -(-response_bytes // CHARS_PER_TOKEN)
+        if input_tokens is None: input_tokens = estimate_tokens(prompt)
+        self.metrics.record("ai", operation, wall_ms, model=model, ttfb_ms=ttfb_ms, input_tokens=input_tokens,
+                            output_tokens=output_tokens, response_bytes=response_bytes, cache_hit=False, error=error)
+
+    def call_stats(self):
+        """Per-model counts of attempts, retries and outcomes, plus each circuit breaker's state."""
+        return self.resilience.stats()
+
+    def generate_npc(self, params, campaign_data=None, include_party=True, include_session=True):
+        """Generates an NPC using the Gemini API based on given parameters and full campaign context."""
+        if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
+        prompt = self._build_generation_prompt(params, campaign_data, include_party, include_session)
 
         logging.info(f"Sending generation request to model '{self.text_model_name}'.")
-        response = self.client.models.generate_content(model=self.text_model_name, contents=prompt)
+        response = self._call(self.text_model_name, lambda config: self.client.models.generate_content(
+            model=self.text_model_name, contents=prompt, config=config), "generation", prompt)
         raw_text = response.text
         logging.info(f"Received raw response from Gemini:\n{raw_text}")
         try:
@@ -210,19 +1295,198 @@ class GeminiService:
             raise ValueError(
                 f"The AI returned a malformed description. Please try generating again. Details: {e}") from e
 
-    def simulate_reaction(self, npc_data, situation, campaign_data=None, sim_type="Short"):
+    def _build_generation_prompt(self, params, campaign_data, include_party, include_session):
+        sections = ["campaign_lore"] + (["party_info"] if include_party else []) + \
+                   (["session_history"] if include_session else [])
+        context, section_tokens = self._assemble_context(campaign_data, sections)
+
+        lore_context = context.get('campaign_lore', '')
+        party_context = context.get('party_info', '')
+        session_context = context.get('session_history', '')
+        custom_prompt_text = params.get('custom_prompt', '')
+
+        campaign_context_section = f"\n**Campaign Lore (Follow this lore closely):**\n{lore_context}\n" if lore_context else ""
+        party_context_section = f"\n**Player Party Information (Consider their impact):**\n{party_context}\n" if party_context else ""
+        session_context_section = f"\n**Recent Session History (The NPC may be aware of these events):**\n{session_context}\n" if session_context else ""
+        custom_prompt_section = f"\n**Additional Custom Prompt:**\n- {custom_prompt_text}\n" if custom_prompt_text else ""
+
+        prompt = NPC_GENERATION_PROMPT.format(
+            gender=params['gender'], attitude=params['attitude'], rarity=params['rarity'],
+            environment=params['environment'], race=params['race'], character_class=params['character_class'],
+            background=params['background'],
+            campaign_context=campaign_context_section,
+            party_context=party_context_section,
+            session_context=session_context_section,
+            custom_prompt_section=custom_prompt_section
+        )
+        self._report_prompt_tokens("generation", prompt, section_tokens)
+        return prompt
+
+    def generate_npc_stream(self, params, campaign_data=None, include_party=True, include_session=True,
+                            on_field=None, cancel_event=None):
+        """
+        Streams an NPC as schema-constrained JSON, calling `on_field(key, value)` from this thread as soon as
+        each field is complete. Fields the stream left missing or malformed are requested again on their own,
+        rather than regenerating the whole NPC. Returns (npc_data, raw_text) like generate_npc.
+        """
+        if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
+        cancel_event = cancel_event or self.scheduler.current()[1]
+        prompt = self._build_generation_prompt(params, campaign_data, include_party, include_session)
+        parser = IncrementalObjectParser()
+
+        logging.info(f"Streaming generation request to model '{self.text_model_name}'.")
+        config = self._npc_json_config(NPC_FIELDS)
+        stream = self._open_stream(self.text_model_name, lambda config: self.client.models.generate_content_stream(
+            model=self.text_model_name, contents=prompt, config=config), "generation", prompt, config)
+        try:
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InterruptedError("NPC generation was cancelled.")
+                for key, value in parser.feed(chunk.text or ""):
+                    if on_field: on_field(key, value)
+        finally:
+            if hasattr(stream, "close"): stream.close()
+        logging.info(f"Received streamed response from Gemini:\n{parser.text}")
+
+        npc_data = dict(parser.fields)
+        for attempt in range(NPC_FIELD_RETRIES):
+            missing = [field for field in NPC_FIELDS if not isinstance(npc_data.get(field), str)]
+            if not missing: break
+            logging.warning(f"Streamed NPC is missing {missing}; requesting only those fields (attempt {attempt + 1}).")
+            for key, value in self._complete_npc_fields(prompt, npc_data, missing).items():
+                npc_data[key] = value
+                if on_field: on_field(key, value)
+        missing = [field for field in NPC_FIELDS if not isinstance(npc_data.get(field), str)]
+        if missing:
+            raise ValueError(f"The AI returned a malformed description. Please try generating again. "
+                             f"Details: missing fields {', '.join(missing)}")
+        return npc_data, parser.text
+
+    def _complete_npc_fields(self, prompt, partial_npc, missing):
+        completion_prompt = NPC_COMPLETION_PROMPT.format(original_prompt=prompt,
+                                                         partial_json=json.dumps(partial_npc, indent=2),
+                                                         missing_fields=", ".join(missing))
+        config = self._npc_json_config(missing)
+        response = self._call(self.text_model_name, lambda config: self.client.models.generate_content(
+            model=self.text_model_name, contents=completion_prompt, config=config), "field_completion",
+                              completion_prompt, config)
+        try:
+            parsed = json.loads(response.text)
+        except (json.JSONDecodeError, TypeError) as e:
+            logging.error(f"Field completion returned malformed JSON: {e}")
+            return {}
+        return {key: value for key, value in parsed.items() if key in missing and isinstance(value, str)}
+
+    @staticmethod
+    def _npc_json_config(fields):
+        # Property ordering follows NPC_FIELDS, so 'appearance' streams early and the rest fills in after it.
+        schema = {
+            "type": "OBJECT",
+            "properties": {field: {"type": "STRING"} for field in fields},
+            "required": list(fields),
+            "propertyOrdering": list(fields),
+        }
+        # A plain dict, which the SDK accepts in place of GenerateContentConfig, so building it doesn't import it.
+        return {"response_mime_type": "application/json", "response_schema": schema}
+
+    def _cache_lookup(self, kind, model, prompt, config, bypass_cache):
+        """Returns (cache_key, cached_value); the key is None when caching is off or bypassed."""
+        if self.response_cache is None or bypass_cache: return None, None
+        started = time.perf_counter()
+        cache_key = self.response_cache.make_key(model, kind, prompt, config)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None and self.metrics is not None:
+            size = len(cached) if isinstance(cached, bytes) else len(cached.encode("utf-8"))
+            self.metrics.record("ai", kind, (time.perf_counter() - started) * 1000, model=model, response_bytes=size,
+                                cache_hit=True)
+        return cache_key, cached
+
+    def simulate_reaction(self, npc_data, situation, campaign_data=None, sim_type="Short", bypass_cache=False):
         """Simulates an NPC's reaction to a given situation."""
         if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
+        prompt = self._build_simulation_prompt(npc_data, situation, campaign_data, sim_type)
+        cache_key, cached = self._cache_lookup("simulation", self.text_model_name, prompt, None, bypass_cache)
+        if cached is not None:
+            logging.info(f"Serving '{sim_type}' simulation for {npc_data.get('name')} from the response cache.")
+            return cached
+        logging.info(f"Sending '{sim_type}' simulation request for {npc_data.get('name')}.")
+        response = self._call(self.text_model_name, lambda config: self.client.models.generate_content(
+            model=self.text_model_name, contents=prompt, config=config), "simulation", prompt)
+        if cache_key and response.text:
+            self.response_cache.put(cache_key, self.text_model_name, "simulation", response.text)
+        return response.text
+
+    def simulate_reaction_stream(self, npc_data, situation, campaign_data=None, sim_type="Short", cancel_event=None,
+                                 bypass_cache=False):
+        """
+        Streaming variant of simulate_reaction that yields text chunks as the model produces them.
+        Setting `cancel_event` stops the stream at the next chunk and releases the connection.
+        """
+        if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
+        cancel_event = cancel_event or self.scheduler.current()[1]
+        prompt = self._build_simulation_prompt(npc_data, situation, campaign_data, sim_type)
+        cache_key, cached = self._cache_lookup("simulation", self.text_model_name, prompt, None, bypass_cache)
+        if cached is not None:
+            logging.info(f"Serving '{sim_type}' simulation for {npc_data.get('name')} from the response cache.")
+            yield cached
+            return
+        logging.info(f"Streaming '{sim_type}' simulation request for {npc_data.get('name')}.")
+        stream = self._open_stream(self.text_model_name, lambda config: self.client.models.generate_content_stream(
+            model=self.text_model_name, contents=prompt, config=config), "simulation", prompt)
+        received = []
+        try:
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    logging.info(f"Simulation stream for {npc_data.get('name')} cancelled.")
+                    return
+                if chunk.text:
+                    received.append(chunk.text)
+                    yield chunk.text
+        finally:
+            if hasattr(stream, "close"): stream.close()
+        # Only complete, uncancelled responses reach this point.
+        if cache_key and received:
+            self.response_cache.put(cache_key, self.text_model_name, "simulation", "".join(received))
+
+    def _assemble_context(self, campaign_data, sections):
+        """Fits the requested campaign sections into their token budgets, when a context builder is configured."""
         campaign_data = campaign_data or {}
+        if self.context_builder is None:
+            context = {section: campaign_data.get(section) or '' for section in sections}
+            return context, {section: estimate_tokens(text) for section, text in context.items()}
+        return self.context_builder.build(campaign_data, self.summarize_text, sections)
+
+    def _report_prompt_tokens(self, kind, prompt, section_tokens):
+        total = estimate_tokens(prompt)
+        self.last_prompt_tokens[kind] = total
+        breakdown = ", ".join(f"{section} ~{tokens}" for section, tokens in section_tokens.items())
+        logging.info(f"Assembled {kind} prompt: ~{total} tokens ({breakdown}).")
+
+    def summarize_text(self, text, target_tokens, section_label):
+        """Condenses campaign notes to roughly `target_tokens`; used by the context builder."""
+        if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
+        prompt = CONTEXT_SUMMARY_PROMPT.format(section_label=section_label, target_words=int(target_tokens * 0.75),
+                                               text=text)
+        logging.info(f"Summarizing ~{estimate_tokens(text)} tokens of {section_label}.")
+        # Batch items often need the same summary at once; only one of them asks for it.
+        return self.scheduler.coalesce(("summary", self.text_model_name, prompt), lambda: self._call(
+            self.text_model_name,
+            lambda config: self.client.models.generate_content(model=self.text_model_name, contents=prompt,
+                                                               config=config),
+            "summary", prompt).text)
+
+    def _build_simulation_prompt(self, npc_data, situation, campaign_data, sim_type):
+        context, section_tokens = self._assemble_context(campaign_data,
+                                                         ["campaign_lore", "party_info", "session_history"])
 
         full_context = (f"Appearance: {npc_data.get('appearance', 'N/A')}\n"
                         f"Personality: {npc_data.get('personality', 'N/A')}\n"
                         f"Backstory: {npc_data.get('backstory', 'N/A')}\n"
                         f"Roleplaying Tips: {npc_data.get('roleplaying_tips', 'N/A')}")
 
-        lore_context = campaign_data.get('campaign_lore', '')
-        party_context = campaign_data.get('party_info', '')
-        session_context = campaign_data.get('session_history', '')
+        lore_context = context['campaign_lore']
+        party_context = context['party_info']
+        session_context = context['session_history']
 
         prompt_template = NPC_SIMULATION_SHORT_PROMPT if sim_type == "Short" else NPC_SIMULATION_LONG_PROMPT
 
@@ -233,26 +1497,131 @@ class GeminiService:
             party_context=party_context,
             session_context=session_context
         )
+        self._report_prompt_tokens("simulation", prompt, section_tokens)
+        return prompt
 
-        logging.info(f"Sending '{sim_type}' simulation request for {npc_data.get('name')}.")
-        response = self.client.models.generate_content(model=self.text_model_name, contents=prompt)
-        return response.text
-
-    def generate_npc_portrait(self, appearance_prompt):
+    def generate_npc_portrait(self, appearance_prompt, bypass_cache=False):
         if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
-        logging.info(f"Sending image generation request to model '{self.image_model_name}'.")
         prompt = NPC_PORTRAIT_PROMPT.format(appearance_prompt=appearance_prompt)
+        cache_key, cached = self._cache_lookup("portrait", self.image_model_name, prompt, {"number_of_images": 1},
+                                               bypass_cache)
+        if cached is not None:
+            logging.info("Serving portrait from the response cache.")
+            return cached
+        logging.info(f"Sending image generation request to model '{self.image_model_name}'.")
         try:
-            response = self.client.models.generate_images(model=self.image_model_name, prompt=prompt,
-                                                          config=types.GenerateImagesConfig(number_of_images=1))
+            config = {"number_of_images": 1}  # accepted by the SDK for GenerateImagesConfig, without importing it
+            # A second click on "Generate portrait" for the same appearance shares the first request.
+            response = self.scheduler.coalesce(
+                ("portrait", self.image_model_name, prompt),
+                lambda: self._call(self.image_model_name, lambda config: self.client.models.generate_images(
+                    model=self.image_model_name, prompt=prompt, config=config), "portrait", prompt, config))
             if hasattr(response, 'generated_images') and response.generated_images:
-                return response.generated_images[0].image.image_bytes
+                image_bytes = response.generated_images[0].image.image_bytes
+                if cache_key: self.response_cache.put(cache_key, self.image_model_name, "portrait", image_bytes)
+                return image_bytes
             else:
                 raise Exception("Image generation call succeeded, but no images were returned.")
-        except google_exceptions.PermissionDenied as e:
-            logging.error(f"Image generation failed due to a permission error (likely billing): {e}")
-            raise PermissionError(
-                "Image generation failed. This model often requires a billed Google Cloud account.") from e
         except Exception as e:
+            if status_code(e) == 403:  # PermissionDenied, from either SDK's exception types
+                logging.error(f"Image generation failed due to a permission error (likely billing): {e}")
+                raise PermissionError(
+                    "Image generation failed. This model often requires a billed Google Cloud account.") from e
             logging.error(f"An unexpected error occurred during image generation: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def generate_npc_pipelined(self, params, campaign_data=None, include_party=True, include_session=True,
+                               on_field=None, with_portrait=True):
+        """
+        Streams an NPC and starts its portrait as soon as the 'appearance' field is complete, so the image
+        request overlaps the rest of the text. A failed portrait does not discard the NPC.
+
+        Returns a dict with 'npc', 'portrait_error' (None on success) and 'timings', which holds the
+        start and end of each stage in seconds since the call began.
+        """
+        started = time.perf_counter()
+        timings = {}
+        portrait_thread = None
+        portrait_result = {}
+
+        def elapsed():
+            return round(time.perf_counter() - started, 3)
+
+        context = self.scheduler.current()
+
+        def run_portrait(appearance):
+            timings['portrait_start'] = elapsed()
+            try:
+                with self.scheduler.context(*context):
+                    portrait_result['image_data'] = self.generate_npc_portrait(appearance)
+            except Exception as e:
+                portrait_result['error'] = e
+            timings['portrait_end'] = elapsed()
+
+        def start_portrait(appearance):
+            nonlocal portrait_thread
+            if portrait_thread is not None or not with_portrait: return
+            portrait_thread = threading.Thread(target=run_portrait, args=(appearance,), name="portrait-pipeline",
+                                               daemon=True)
+            portrait_thread.start()
+
+        def handle_field(key, value):
+            timings.setdefault('text_first_field', elapsed())
+            if key == 'appearance' and value: start_portrait(value)
+            if on_field: on_field(key, value)
+
+        timings['text_start'] = elapsed()
+        try:
+            npc_data, _ = self.generate_npc_stream(params, campaign_data=campaign_data, include_party=include_party,
+                                                   include_session=include_session, on_field=handle_field)
+        finally:
+            timings['text_end'] = elapsed()
+            if portrait_thread is not None: portrait_thread.join()
+        # 'appearance' may only have arrived through a field retry; the portrait still needs to happen.
+        if portrait_thread is None and with_portrait:
+            start_portrait(npc_data.get('appearance', ''))
+            portrait_thread.join()
+        npc_data['custom_prompt'] = params.get('custom_prompt', '')
+        if 'image_data' in portrait_result: npc_data['image_data'] = portrait_result['image_data']
+        timings['total'] = elapsed()
+        logging.info(f"NPC pipeline timings: {format_stage_timings(timings)}")
+        return {'npc': npc_data, 'portrait_error': portrait_result.get('error'), 'timings': timings}
+
+    def generate_npc_batch(self, params, count, campaign_data=None, include_party=True, include_session=True,
+                           with_portraits=True, on_progress=None, token=None):
+        """
+        Generates `count` NPCs as background tasks on the shared scheduler, so they run at most
+        BATCH_MAX_WORKERS at a time and yield API slots to interactive work.
+
+        `on_progress(result)` is called from a worker thread as each item finishes. Every result is a dict
+        with 'index', 'npc' (None if text generation failed) and 'error' (None on full success; a portrait
+        failure keeps the NPC and records the error). Setting `token` drops the items not yet started.
+        Returns all results ordered by index.
+        """
+        if not self.is_api_key_valid(): raise ValueError("API Client not configured. Check your API key.")
+
+        def generate_one(index):
+            try:
+                result = self.generate_npc_pipelined(params, campaign_data=campaign_data, include_party=include_party,
+                                                     include_session=include_session, with_portrait=with_portraits)
+            except (CancelledError, InterruptedError) as e:
+                return {'index': index, 'npc': None, 'error': e}
+            except Exception as e:
+                logging.error(f"Batch item {index + 1}/{count} failed during text generation: {e}")
+                return {'index': index, 'npc': None, 'error': e}
+            if result['portrait_error']:
+                logging.warning(f"Batch item {index + 1}/{count} has no portrait: {result['portrait_error']}")
+            return {'index': index, 'npc': result['npc'], 'error': result['portrait_error']}
+
+        futures = [self.submit(generate_one, index, priority=PRIORITY_BACKGROUND, token=token,
+                               name=f"batch-npc-{index + 1}") for index in range(count)]
+        results = []
+        for future in as_completed(futures):
+            if future.cancelled(): continue
+            result = future.result()
+            results.append(result)
+            if on_progress: on_progress(result)
+        failures = sum(1 for result in results if result['npc'] is None)
+        logging.info(f"Batch generation finished: {len(results) - failures}/{count} NPCs generated. "
+                     f"API calls so far: {self.call_stats()}")
+        return sorted(results, key=lambda result: result['index'])
@@ -0,0 +1,100 @@
+import customtkinter
+
+from async_data_manager import when_done
+
+TIME_WINDOWS = {"Last hour": 60 * 60, "Last 24 hours": 24 * 60 * 60, "All recorded": None}
+
+
+def _format_ms(value):
+    if value is None: return "-"
+    return f"{value / 1000:.1f}s" if value >= 10000 else f"{value:.0f}ms" if value >= 10 else f"{value:.1f}ms"
+
+
+def _format_bytes(value):
+    for unit in ("B", "KB", "MB"):
+        if value < 1024: return f"{value:.0f}{unit}"
+        value /= 1024
+    return f"{value:.1f}GB"
+
+
+class StatsPanelApp(customtkinter.CTkToplevel):
+    """
+    A small dashboard of recorded metrics: latency percentiles, time to first byte, tokens, bytes and
+    cache hits for AI calls, query times and row counts for database calls, and API retry counters.
+    """
+
+    def __init__(self, master, data_manager, api_service, async_data):
+        super().__init__(master)
+        self.master = master
+        self.db = data_manager
+        self.ai = api_service
+        self.data = async_data
+
+        self.title("Performance Stats")
+        self.geometry("980x560")
+        self.minsize(700, 400)
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+
+        self._create_widgets()
+        self.refresh()
+
+    def _create_widgets(self):
+        controls = customtkinter.CTkFrame(self, fg_color="transparent")
+        controls.grid(row=0, column=0, padx=10, pady=(10, 0), sticky="ew")
+        controls.grid_columnconfigure(1, weight=1)
+
+        self.window_var = customtkinter.StringVar(value="Last hour")
+        customtkinter.CTkOptionMenu(controls, variable=self.window_var, values=list(TIME_WINDOWS),
+                                    command=lambda _: self.refresh()).grid(row=0, column=0, sticky="w")
+        customtkinter.CTkButton(controls, text="Refresh", width=100, command=self.refresh).grid(row=0, column=2,
+                                                                                              padx=(10, 0))
+        customtkinter.CTkButton(controls, text="Clear", width=100, fg_color="#D32F2F", hover_color="#B71C1C",
+                                command=self.clear).grid(row=0, column=3, padx=(10, 0))
+
+        self.stats_textbox = customtkinter.CTkTextbox(self, wrap="none", state="disabled",
+                                                      font=customtkinter.CTkFont(family="Courier", size=12))
+        self.stats_textbox.grid(row=1, column=0, padx=10, pady=10, sticky="nsew")
+
+    def refresh(self):
+        if self.db.metrics is None:
+            self._update_textbox("Metrics are disabled. Set METRICS_ENABLED in config.py to record them.")
+            return
+        when_done(self, self.data.read(self.db.metrics.summary, TIME_WINDOWS[self.window_var.get()]), self._show_stats)
+
+    def _show_stats(self, future):
+        if future.exception() is not None:
+            self._update_textbox(f"Metrics could not be read: {future.exception()}")
+            return
+        summaries = future.result()
+        header = f"{'Operation':<28}{'Calls':>7}{'Errors':>8}{'Cached':>8}{'p50':>9}{'p95':>9}{'p99':>9}" \
+                 f"{'TTFB p50':>10}{'Tokens in/out':>16}{'Size':>9}"
+        lines = []
+        for source, title in (("ai", "AI calls"), ("db", "Database calls")):
+            rows = [summary for summary in summaries if summary['source'] == source]
+            lines += [title, header, "-" * len(header)]
+            if not rows: lines.append("  (none recorded)")
+            for row in rows:
+                tokens = f"{row['input_tokens']}/{row['output_tokens']}" if source == "ai" else ""
+                size = _format_bytes(row['response_bytes']) if source == "ai" else f"{row['rows']} rows"
+                lines.append(f"{row['operation']:<28}{row['count']:>7}{row['errors']:>8}{row['cache_hits']:>8}"
+                             f"{_format_ms(row['p50_ms']):>9}{_format_ms(row['p95_ms']):>9}"
+                             f"{_format_ms(row['p99_ms']):>9}{_format_ms(row['ttfb_p50_ms']):>10}"
+                             f"{tokens:>16}{size:>9}")
+            lines.append("")
+        lines.append("API retries (this session)")
+        for model, counts in sorted(self.ai.call_stats().items()):
+            details = ", ".join(f"{outcome} {count}" for outcome, count in sorted(counts.items()))
+            lines.append(f"  {model}: {details}")
+        self._update_textbox("\n".join(lines))
+
+    def clear(self):
+        if self.db.metrics is None: return
+        when_done(self, self.data.write(self.db.metrics.clear), lambda _: self.refresh())
+
+    def _update_textbox(self, text):
+        self.stats_textbox.configure(state="normal")
+        self.stats_textbox.delete("1.0", "end")
+        self.stats_textbox.insert("1.0", text)
+        self.stats_textbox.configure(state="disabled")
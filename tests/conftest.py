@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The app is a set of top-level modules rather than a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_gemini import FakeGeminiClient
+from resilience import ResilientCaller
+from services import DataManager, GeminiService, RateLimiter
+
+TEXT_MODEL = "fake-text"
+IMAGE_MODEL = "fake-image"
+
+
+@pytest.fixture
+def db(tmp_path):
+    data_manager = DataManager(str(tmp_path / "test.db"))
+    yield data_manager
+    data_manager.close()
+
+
+@pytest.fixture
+def fake_client():
+    return FakeGeminiClient()
+
+
+@pytest.fixture
+def service(fake_client):
+    """A GeminiService on the fake client that retries without sleeping and isn't rate limited."""
+    ai = GeminiService("test-key", TEXT_MODEL, IMAGE_MODEL, client=fake_client,
+                       resilience=ResilientCaller(sleep=lambda seconds: None))
+    ai.rate_limiters = {TEXT_MODEL: RateLimiter(60000, 1000), IMAGE_MODEL: RateLimiter(60000, 1000)}
+    return ai
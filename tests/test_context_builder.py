@@ -0,0 +1,80 @@
+import pytest
+
+from context_builder import ContextBuilder, estimate_tokens
+
+
+class Summarizer:
+    """Stands in for GeminiService.summarize_text and records which chunks it was asked about."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def __call__(self, text, target_tokens, section_label):
+        self.chunks.append(text)
+        return f"Summary of {section_label} #{len(self.chunks)}."
+
+
+def paragraphs(count, prefix="Session"):
+    return "\n\n".join(f"{prefix} {i}: " + "The party argued about the map. " * 8 for i in range(count)).strip()
+
+
+@pytest.fixture
+def builder(db):
+    return ContextBuilder(db, budgets={"campaign_lore": 200, "party_info": 200, "session_history": 200},
+                          chunk_tokens=100)
+
+
+def test_text_within_budget_is_left_alone(builder):
+    summarize = Summarizer()
+    fitted, tokens = builder.build({"campaign_lore": "Short lore.", "party_info": None}, summarize)
+    assert fitted == {"campaign_lore": "Short lore.", "party_info": "", "session_history": ""}
+    assert tokens["campaign_lore"] == estimate_tokens("Short lore.")
+    assert summarize.chunks == []
+
+
+def test_long_lore_is_summarized_to_fit(builder):
+    summarize = Summarizer()
+    lore = paragraphs(20, prefix="Lore")
+    fitted, tokens = builder.build({"campaign_lore": lore}, summarize, sections=("campaign_lore",))
+    assert tokens["campaign_lore"] <= 200
+    assert summarize.chunks
+    assert fitted["campaign_lore"].startswith("Summary of campaign lore")
+
+
+def test_session_history_keeps_the_newest_sessions_verbatim(builder):
+    history = paragraphs(20)
+    fitted = builder.fit("session_history", history, Summarizer())
+    assert fitted.endswith("\n\n" + history.split("\n\n")[-1])
+    assert fitted.startswith("Summary of session history")
+    assert estimate_tokens(fitted) <= 200
+
+
+def test_summaries_are_cached_and_appending_only_summarizes_new_chunks(builder):
+    history = paragraphs(20)
+    builder.fit("session_history", history, Summarizer())
+    again = Summarizer()
+    builder.fit("session_history", history, again)
+    assert again.chunks == []
+    appended = Summarizer()
+    builder.fit("session_history", history + "\n\n" + paragraphs(6, prefix="Later"), appended)
+    # Only sessions that were kept verbatim before, the new ones and the summaries of summaries are sent.
+    assert appended.chunks
+    assert not any(chunk.startswith(f"Session {i}:") for chunk in appended.chunks for i in range(19))
+
+
+def test_failed_summarizer_falls_back_to_truncation(builder):
+    def broken(text, target_tokens, section_label):
+        raise ConnectionError("offline")
+
+    fitted = builder.fit("campaign_lore", paragraphs(20, prefix="Lore"), broken)
+    assert fitted.startswith("Lore 0:")
+    assert fitted.endswith("…")
+    assert estimate_tokens(fitted) <= 200
+
+
+def test_chunks_are_paragraph_aligned_and_bounded(builder):
+    text = paragraphs(10) + "\n\n" + "One very long sentence. " * 100
+    chunks = builder._split(text)
+    assert all(len(chunk) <= builder.chunk_tokens * 4 for chunk in chunks)
+    assert chunks[0].startswith("Session 0:")
+    assert "".join(chunks).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")
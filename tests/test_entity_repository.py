@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+
+from entity_repository import EntityRepository
+
+
+@pytest.fixture
+def repo(db):
+    db.save_npcs([{"name": "Ada", "race": "Human"}, {"name": "Bram", "race": "Dwarf"}])
+    db.save_campaign({"campaign_name": "Greywater", "campaign_lore": "Fog."})
+    return EntityRepository(db)
+
+
+def test_copies_are_handed_out(repo):
+    repo.get_npc("Ada")["race"] = "Changed"
+    repo.npc_summary("Ada")["race"] = "Changed"
+    repo.get_campaign("Greywater")["campaign_lore"] = "Changed"
+    assert repo.get_npc("Ada")["race"] == "Human"
+    assert repo.npc_summary("Ada")["race"] == "Human"
+    assert repo.get_campaign("Greywater")["campaign_lore"] == "Fog."
+
+
+def test_committed_changes_are_read_again(repo, db):
+    assert repo.get_npc("Ada")["race"] == "Human"
+    db.update_npc("Ada", {"race": "Elf"})
+    db.save_npc({"name": "Cora"})
+    db.save_npc({"name": "Bramwell", "race": "Dwarf"}, old_name="Bram")
+    db.delete_campaign("Greywater")
+    assert repo.get_npc("Ada")["race"] == "Elf"
+    assert repo.npc_summary("Ada")["race"] == "Elf"
+    assert repo.npc_names() == ["Ada", "Bramwell", "Cora"]
+    assert repo.get_npc("Bram") is None
+    assert repo.campaign_names() == []
+
+
+def test_queries_run_outside_the_lock(repo, db, monkeypatch):
+    repo.npc_names()
+    loading, release = threading.Event(), threading.Event()
+    get_npc = db.get_npc
+
+    def slow_get_npc(name):
+        loading.set()
+        release.wait(5)
+        return get_npc(name)
+
+    monkeypatch.setattr(db, "get_npc", slow_get_npc)
+    reader = threading.Thread(target=repo.get_npc, args=("Ada",))
+    reader.start()
+    try:
+        assert loading.wait(5)
+        answered = []
+        served = threading.Thread(target=lambda: answered.append(repo.has_npc("Bram")))
+        served.start()
+        served.join(1)
+        assert answered == [True]  # served from memory while the record is still loading
+    finally:
+        release.set()
+        reader.join()
+
+
+def test_a_load_that_straddles_a_change_is_not_kept(repo, db, monkeypatch):
+    load_npc_summaries = db.load_npc_summaries
+
+    def load_then_change():
+        summaries = load_npc_summaries()
+        db.save_npc({"name": "Late"})  # commits after the rows were read
+        return summaries
+
+    monkeypatch.setattr(db, "load_npc_summaries", load_then_change)
+    assert "Late" not in repo.npc_names()
+    monkeypatch.setattr(db, "load_npc_summaries", load_npc_summaries)
+    assert "Late" in repo.npc_names()
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from job_queue import JobQueue
+from services import PRIORITY_BACKGROUND
+
+NPC_PARAMS = {"gender": "Female", "attitude": "Friendly", "rarity": "Commoner", "environment": "Tavern",
+              "race": "Halfling", "character_class": "Bard", "background": "Entertainer"}
+TIMEOUT = 10
+
+
+@pytest.fixture
+def jobs(db, service):
+    return JobQueue(db, service)
+
+
+def simulation(situation="A fight breaks out."):
+    return {"npc_data": {"name": "Pip"}, "situation": situation}
+
+
+def test_simulation_job_streams_and_stores_its_result(jobs, db):
+    chunks = []
+    job_id, future = jobs.submit("simulation", simulation(), owner="Pip", hooks={"on_chunk": chunks.append})
+    job = future.result(timeout=TIMEOUT)
+    assert job["status"] == "done"
+    assert job["result"]["text"] == "".join(chunks)
+    stored = db.get_job(job_id)
+    assert stored["status"] == "done"
+    assert stored["result"] == job["result"]
+    assert stored["attempts"] == 1
+
+
+def test_results_stay_undelivered_until_marked(jobs):
+    job_id, future = jobs.submit("simulation", simulation(), owner="Pip")
+    future.result(timeout=TIMEOUT)
+    assert [job["id"] for job in jobs.undelivered("simulation", "Pip")] == [job_id]
+    assert [job["id"] for job in jobs.undelivered("simulation", "Pip")] == [job_id]  # reading doesn't deliver
+    assert jobs.undelivered("simulation", "someone else") == []
+    jobs.mark_delivered(job_id)
+    assert jobs.undelivered("simulation", "Pip") == []
+
+
+def test_batch_npcs_are_saved_with_their_jobs(jobs, db):
+    payloads = [{"params": NPC_PARAMS, "save": True, "with_portrait": False}] * 3
+    submitted = jobs.submit_many("npc", payloads, priority=PRIORITY_BACKGROUND, owner="batch")
+    assert len({job_id for job_id, _ in submitted}) == 3
+    finished = [future.result(timeout=TIMEOUT) for _, future in submitted]
+    saved = db.load_npc_summaries()
+    assert sorted(job["result"]["npc"]["name"] for job in finished) == sorted(saved)
+    assert len(saved) == 3  # the fake gives every NPC the same name; saves keep them apart
+    assert jobs.stats()["done"] == 3
+
+
+def test_failed_job_is_recorded(jobs, db, fake_client):
+    fake_client.errors = [400]
+    job_id, future = jobs.submit("simulation", simulation(), owner="Pip")
+    with pytest.raises(Exception):
+        future.result(timeout=TIMEOUT)
+    stored = db.get_job(job_id)
+    assert stored["status"] == "failed"
+    assert "400" in stored["error"]
+    assert jobs.undelivered("simulation", "Pip") == []
+
+
+def test_result_that_cannot_be_stored_fails_the_job(jobs, db, monkeypatch):
+    monkeypatch.setattr(db, "complete_job", lambda *args, **kwargs: False)
+    job_id, future = jobs.submit("simulation", simulation(), owner="Pip")
+    with pytest.raises(RuntimeError):
+        future.result(timeout=TIMEOUT)
+    assert db.get_job(job_id)["status"] == "failed"
+
+
+def test_interrupted_jobs_are_resumed(db, service):
+    running = db.enqueue_job("simulation", simulation("Resumed"), 0, "Pip")
+    db.start_job(running)
+    exhausted = db.enqueue_job("simulation", simulation("Gave up"), 0, "Pip")
+    for _ in range(3): db.start_job(exhausted)
+    jobs = JobQueue(db, service)  # a new session
+    assert jobs.resume() == 1
+    deadline = time.monotonic() + TIMEOUT
+    while db.get_job(running)["status"] != "done" and time.monotonic() < deadline: time.sleep(0.01)
+    assert db.get_job(running)["status"] == "done"
+    assert db.get_job(running)["attempts"] == 2
+    assert db.get_job(exhausted)["status"] == "failed"
+
+
+def test_jobs_name_their_campaign_and_read_it_when_they_run(jobs, db):
+    db.save_campaign({"campaign_name": "Greywater", "session_history": "The fog rolled in. " * 200})
+    plain = jobs.submit("simulation", simulation(), owner="Pip")[1].result(timeout=TIMEOUT)
+    payload = dict(simulation(), campaign_name="Greywater")
+    job_id, future = jobs.submit("simulation", payload, owner="Pip")
+    in_campaign = future.result(timeout=TIMEOUT)
+    assert db.get_job(job_id)["payload"] == payload  # no copy of the campaign text
+    assert in_campaign["result"]["text"] != plain["result"]["text"]  # the prompt carried the campaign
@@ -0,0 +1,55 @@
+from json_stream import IncrementalObjectParser
+
+
+def feed_all(parser, chunks):
+    completed = []
+    for chunk in chunks: completed += parser.feed(chunk)
+    return completed
+
+
+def test_members_are_reported_as_they_complete():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"name": "Ada", "age"') == [("name", "Ada")]
+    assert parser.feed(': 41, "town": "Bree"') == [("age", 41)]
+    assert parser.feed("}") == [("town", "Bree")]
+    assert parser.complete
+    assert parser.fields == {"name": "Ada", "age": 41, "town": "Bree"}
+
+
+def test_one_character_at_a_time():
+    text = '{"a": "x, y", "b": [1, {"c": "}"}], "d": null}'
+    completed = feed_all(IncrementalObjectParser(), text)
+    assert completed == [("a", "x, y"), ("b", [1, {"c": "}"}]), ("d", None)]
+
+
+def test_leading_fence_is_skipped():
+    parser = IncrementalObjectParser()
+    feed_all(parser, ['```json\n{"name"', ': "Bo"}\n```'])
+    assert parser.fields == {"name": "Bo"}
+    assert parser.complete
+
+
+def test_escaped_quotes_and_braces_stay_inside_strings():
+    parser = IncrementalObjectParser()
+    feed_all(parser, [r'{"quote": "She said \"{hi}\"", ', r'"path": "C:\\dir\\"}'])
+    assert parser.fields == {"quote": 'She said "{hi}"', "path": "C:\\dir\\"}
+
+
+def test_top_level_array_is_not_taken_for_the_object():
+    parser = IncrementalObjectParser()
+    feed_all(parser, ['[1, 2] {"k": 1}'])
+    assert parser.fields == {"k": 1}
+
+
+def test_malformed_member_is_skipped_and_the_rest_kept():
+    parser = IncrementalObjectParser()
+    completed = feed_all(parser, ['{"good": 1, "bad": nope, "also_good": true}'])
+    assert completed == [("good", 1), ("also_good", True)]
+    assert parser.complete
+
+
+def test_text_after_the_object_is_ignored():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"a": 1}') == [("a", 1)]
+    assert parser.feed(', "b": 2}') == []
+    assert parser.fields == {"a": 1}
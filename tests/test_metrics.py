@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from metrics import MetricsRecorder, percentile
+
+
+def stored_count(db):
+    return db._get_connection().execute("SELECT COUNT(*) FROM metrics").fetchone()[0]
+
+
+@pytest.fixture
+def recorder(db):
+    db.metrics.close()  # keep the DataManager's own records out of these counts
+    db.metrics = None
+    recorder = MetricsRecorder(db, max_rows=10, flush_size=1000, flush_interval=60)
+    yield recorder
+    recorder.close()
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile(values, 0.99) == 99
+    assert percentile([7], 0.99) == 7
+    assert percentile([], 0.5) is None
+
+
+def test_records_are_buffered_until_flushed(recorder, db):
+    recorder.record("ai", "simulation", 120.0, model="m", ttfb_ms=40.0, input_tokens=10, output_tokens=20)
+    assert stored_count(db) == 0
+    recorder.flush()
+    assert stored_count(db) == 1
+
+
+def test_summary_aggregates_per_operation(recorder):
+    for wall_ms in (10, 20, 30, 40):
+        recorder.record("db", "get_npc", wall_ms, row_count=1)
+    recorder.record("ai", "portrait", 900, response_bytes=2048, cache_hit=True)
+    recorder.record("ai", "portrait", 1100, error=ValueError("blocked"))
+    summaries = {summary["operation"]: summary for summary in recorder.summary()}
+    assert summaries["get_npc"]["count"] == 4
+    assert summaries["get_npc"]["p50_ms"] == 20
+    assert summaries["get_npc"]["p99_ms"] == 40
+    assert summaries["get_npc"]["rows"] == 4
+    assert summaries["portrait"]["errors"] == 1
+    assert summaries["portrait"]["cache_hits"] == 1
+    assert summaries["portrait"]["response_bytes"] == 2048
+
+
+def test_summary_leaves_the_writing_to_the_background_thread(recorder, db, monkeypatch):
+    writers = []
+    write_buffer = recorder._write_buffer
+    def recording_write():
+        writers.append(threading.current_thread().name)
+        write_buffer()
+    monkeypatch.setattr(recorder, "_write_buffer", recording_write)
+    recorder.record("db", "op", 1.0)
+    assert recorder.summary()[0]["count"] == 1
+    assert writers and set(writers) == {"metrics-flusher"}
+
+
+def test_only_the_newest_rows_are_kept(recorder, db):
+    for index in range(25):
+        recorder.record("db", "op", index)
+    recorder.flush()
+    assert stored_count(db) == 10
+    assert recorder.summary()[0]["p50_ms"] == 19
+
+
+def test_flush_inside_a_transaction_leaves_it_to_the_background_thread(recorder, db):
+    recorder.record("db", "op", 1.0)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            recorder.flush()
+            raise RuntimeError("the caller's writes roll back")
+    recorder.close()
+    assert stored_count(db) == 1
+
+
+def test_full_buffer_is_written_in_the_background(db):
+    db.metrics.close()
+    db.metrics = None
+    recorder = MetricsRecorder(db, flush_size=3, flush_interval=60)
+    for _ in range(3): recorder.record("db", "op", 1.0)
+    deadline = time.monotonic() + 5
+    while stored_count(db) < 3 and time.monotonic() < deadline: time.sleep(0.01)
+    assert stored_count(db) == 3
+    recorder.close()
+
+
+def test_clear_removes_stored_and_buffered_records(recorder, db):
+    recorder.record("db", "op", 1.0)
+    recorder.flush()
+    recorder.record("db", "op", 1.0)
+    recorder.clear()
+    recorder.flush()
+    assert stored_count(db) == 0
+
+
+def test_only_the_outermost_database_call_is_timed(db):
+    db.save_npcs([{"name": "One"}, {"name": "Two"}])
+    operations = {summary["operation"]: summary["count"] for summary in db.metrics.summary()}
+    assert operations["save_npcs"] == 1
+    assert "save_npc" not in operations
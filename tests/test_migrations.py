@@ -0,0 +1,123 @@
+import sqlite3
+
+import migrations
+from migrations import LATEST_VERSION
+from services import DataManager
+
+LEGACY_SCHEMA = [
+    "CREATE TABLE npcs (name TEXT PRIMARY KEY, race_class TEXT, appearance TEXT, personality TEXT, backstory TEXT, "
+    "plot_hooks TEXT, attitude TEXT, rarity TEXT, race TEXT, character_class TEXT, environment TEXT, "
+    "background TEXT, gender TEXT, image_data BLOB, custom_prompt TEXT, roleplaying_tips TEXT)",
+    "CREATE TABLE campaigns (campaign_name TEXT PRIMARY KEY, campaign_lore TEXT, party_info TEXT, "
+    "session_history TEXT)",
+]
+
+
+def make_legacy_database(path, npc_count):
+    """A database as the app wrote it before schema versioning: text keys and no user_version."""
+    conn = sqlite3.connect(path)
+    for statement in LEGACY_SCHEMA: conn.execute(statement)
+    conn.executemany("INSERT INTO npcs (name, race, appearance, attitude) VALUES (?, ?, ?, ?)",
+                     [(f"NPC {i:03d}", "Elf" if i % 2 else "Dwarf", f"A scarred traveller number {i}", "Neutral")
+                      for i in range(npc_count)])
+    conn.execute("INSERT INTO npcs (name, race) VALUES (NULL, 'Gnome')")
+    conn.execute("INSERT INTO campaigns VALUES ('Old Campaign', 'Lore', 'Party', 'History')")
+    conn.commit()
+    conn.close()
+
+
+def user_version(db):
+    return db._get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_new_database_starts_at_the_latest_version(db):
+    assert db.schema_version == LATEST_VERSION
+    assert user_version(db) == LATEST_VERSION
+
+
+def test_version_one_is_the_original_schema(tmp_path, monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:1])
+    db = DataManager(str(tmp_path / "v1.db"))
+    try:
+        tables = {row[0] for row in db._get_connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")}
+        assert db.schema_version == 1
+        assert tables == {"npcs", "campaigns"}
+    finally:
+        db.close()
+
+
+def test_legacy_database_is_upgraded_with_its_data(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    make_legacy_database(path, 25)
+    db = DataManager(path)
+    try:
+        assert db.schema_version == LATEST_VERSION
+        names = db.load_npc_summaries()
+        assert len(names) == 26
+        assert "NPC 000" in names
+        assert any(name.startswith("Unnamed") for name in names)  # NULL names got one
+        assert db.get_campaign("Old Campaign")["party_info"] == "Party"
+        columns = {row["name"] for row in db._get_connection().execute("PRAGMA table_info(npcs)")}
+        assert {"npc_id", "portrait_hash"} <= columns
+        # The full-text index covers the copied rows.
+        assert [row["name"] for row in db.search_npcs("traveller 7")["results"]] == ["NPC 007"]
+    finally:
+        db.close()
+
+
+def test_unnamed_rows_get_a_name_nobody_has(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    make_legacy_database(path, 3)  # its unnamed row is rowid 4
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO npcs (name) VALUES ('Unnamed 4'), ('Unnamed 4 (2)')")
+    conn.execute("INSERT INTO campaigns (campaign_name) VALUES (NULL)")
+    conn.commit()
+    conn.close()
+    db = DataManager(path)
+    try:
+        assert db.schema_version == LATEST_VERSION
+        names = db.load_npc_summaries()
+        assert len(names) == 6
+        assert "Unnamed 4 (3)" in names
+        assert len(db.load_campaigns()) == 2
+    finally:
+        db.close()
+
+
+def test_migrating_again_changes_nothing(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    make_legacy_database(path, 3)
+    DataManager(path).close()
+    db = DataManager(path)
+    try:
+        assert db.schema_version == LATEST_VERSION
+        assert len(db.load_npc_summaries()) == 4
+    finally:
+        db.close()
+
+
+def test_interrupted_upgrade_resumes_where_it_stopped(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    make_legacy_database(path, 10)
+    def fail(conn):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    # A first run whose table swap failed, after copying only some of the rows.
+    npc_keys = next(index for index, step in enumerate(migrations.MIGRATIONS) if step.prepare is migrations._copy_npcs)
+    patched = list(migrations.MIGRATIONS)
+    patched[npc_keys] = patched[npc_keys]._replace(apply=fail)
+    monkeypatch.setattr(migrations, "MIGRATIONS", patched)
+    db = DataManager(path)
+    assert db.schema_version == npc_keys
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM npcs_rebuild WHERE npc_id > 4")
+    db.close()
+
+    monkeypatch.undo()
+    db = DataManager(path)
+    try:
+        assert db.schema_version == LATEST_VERSION
+        assert len(db.load_npc_summaries()) == 11
+    finally:
+        db.close()
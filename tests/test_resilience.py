@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from fake_gemini import FakeAPIError, FakeGeminiClient
+from resilience import CircuitOpenError, DeadlineExceededError, ResilientCaller, is_retryable, retry_after
+
+MODEL = "fake-text"
+
+
+def ask(client, config=None):
+    """A request callable for ResilientCaller.call, passing the attempt's time left as the HTTP timeout."""
+
+    def request(timeout):
+        attempt_config = dict(config or {})
+        if timeout is not None: attempt_config["http_options"] = {"timeout": int(timeout * 1000)}
+        return client.models.generate_content(model=MODEL, contents="hello", config=attempt_config)
+
+    return request
+
+
+def test_transient_errors_are_retried():
+    sleeps = []
+    client = FakeGeminiClient(errors=[503, 429])
+    caller = ResilientCaller(sleep=sleeps.append)
+    assert "fake response" in caller.call(MODEL, ask(client)).text
+    assert len(client.calls) == 3
+    assert len(sleeps) == 2
+    stats = caller.stats()[MODEL]
+    assert stats["attempts"] == 3
+    assert stats["retries"] == 2
+    assert stats["succeeded_after_retry"] == 1
+    assert stats["circuit"] == "closed"
+
+
+def test_client_errors_are_not_retried():
+    client = FakeGeminiClient(errors=[400])
+    caller = ResilientCaller(sleep=lambda seconds: None)
+    with pytest.raises(FakeAPIError):
+        caller.call(MODEL, ask(client))
+    assert len(client.calls) == 1
+    assert caller.stats()[MODEL]["failed"] == 1
+
+
+def test_gives_up_after_max_attempts():
+    client = FakeGeminiClient(errors=[503] * 5)
+    caller = ResilientCaller(max_attempts=3, sleep=lambda seconds: None)
+    with pytest.raises(FakeAPIError):
+        caller.call(MODEL, ask(client))
+    assert len(client.calls) == 3
+
+
+def test_server_retry_hint_is_honoured():
+    sleeps = []
+    client = FakeGeminiClient(errors=[FakeAPIError(429, retry_after=7)])
+    caller = ResilientCaller(base_delay=0.01, max_delay=30, sleep=sleeps.append)
+    caller.call(MODEL, ask(client))
+    assert sleeps == [7]
+
+
+def test_retry_hint_sources():
+    assert retry_after(FakeAPIError(429, retry_after="2.5")) == 2.5
+    assert retry_after(Exception("429 {'retryDelay': '12s'}")) == 12
+    assert retry_after(Exception("no hint")) is None
+    assert is_retryable(TimeoutError())
+    assert not is_retryable(DeadlineExceededError())
+    assert not is_retryable(FakeAPIError(403))
+
+
+def test_circuit_opens_and_rejects_without_calling():
+    client = FakeGeminiClient(errors=[503, 503])
+    caller = ResilientCaller(max_attempts=1, failure_threshold=2, reset_seconds=60, sleep=lambda seconds: None)
+    for _ in range(2):
+        with pytest.raises(FakeAPIError):
+            caller.call(MODEL, ask(client))
+    with pytest.raises(CircuitOpenError):
+        caller.call(MODEL, ask(client))
+    assert len(client.calls) == 2
+    assert caller.stats()[MODEL]["circuit"] == "open"
+    assert caller.stats()[MODEL]["rejected"] == 1
+
+
+def test_probe_closes_the_circuit_after_the_reset_time():
+    client = FakeGeminiClient(errors=[503])
+    caller = ResilientCaller(max_attempts=1, failure_threshold=1, reset_seconds=0.05, sleep=lambda seconds: None)
+    with pytest.raises(FakeAPIError):
+        caller.call(MODEL, ask(client))
+    time.sleep(0.06)
+    caller.call(MODEL, ask(client))
+    assert caller.stats()[MODEL]["circuit"] == "closed"
+
+
+def test_a_hung_request_ends_at_the_deadline():
+    client = FakeGeminiClient(latency=5)
+    caller = ResilientCaller(sleep=lambda seconds: None)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        caller.call(MODEL, ask(client), deadline=0.2)
+    assert time.monotonic() - started < 1
+
+
+def test_stream_is_retried_until_the_first_chunk():
+    client = FakeGeminiClient(errors=[503], stream_chunk_chars=5)
+    caller = ResilientCaller(sleep=lambda seconds: None)
+
+    def start(timeout):
+        return client.models.generate_content_stream(model=MODEL, contents="hello")
+
+    text = "".join(chunk.text for chunk in caller.open_stream(MODEL, start))
+    assert text.startswith("A fake response")
+    assert len(client.calls) == 2
+
+
+def test_service_bounds_calls_by_the_model_deadline(service, fake_client):
+    fake_client.latency = 5
+    service.deadlines[service.text_model_name] = 0.2
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceededError):
+        service.simulate_reaction({"name": "Bob"}, "A dragon lands in the square.")
+    assert time.monotonic() - started < 1
+
+
+def test_service_retries_through_the_fake_client(service, fake_client):
+    fake_client.errors = [503]
+    assert "fake response" in service.simulate_reaction({"name": "Bob"}, "A dragon lands in the square.")
+    assert service.call_stats()[service.text_model_name]["retries"] == 1
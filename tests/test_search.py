@@ -0,0 +1,69 @@
+import pytest
+
+NPCS = [
+    {"name": "Aldric", "race": "Human", "character_class": "Fighter", "attitude": "Friendly",
+     "appearance": "A towering knight in dented plate", "backstory": "Slew a dragon at Greywater."},
+    {"name": "Brenna", "race": "Dwarf", "character_class": "Cleric", "attitude": "Neutral",
+     "appearance": "Braided red beard", "personality": "Gruff but kind"},
+    {"name": "Corwin", "race": "Elf", "character_class": "Wizard", "attitude": "Hostile",
+     "appearance": "Pale and thin", "plot_hooks": "Hunts the dragon cult"},
+    {"name": "Dara", "race": "elf", "character_class": "Rogue", "attitude": "Friendly",
+     "appearance": "Hooded", "roleplaying_tips": "Whispers everything"},
+]
+
+
+@pytest.fixture
+def roster(db):
+    db.save_npcs(NPCS)
+    return db
+
+
+def names(result):
+    return [npc["name"] for npc in result["results"]]
+
+
+def test_empty_query_lists_everyone_by_name(roster):
+    assert names(roster.search_npcs()) == ["Aldric", "Brenna", "Corwin", "Dara"]
+
+
+def test_words_prefix_match_across_text_fields(roster):
+    assert names(roster.search_npcs("drag")) == ["Aldric", "Corwin"]
+    assert names(roster.search_npcs("dragon cult")) == ["Corwin"]
+    assert names(roster.search_npcs("whisper")) == ["Dara"]
+    assert names(roster.search_npcs("nobody-matches-this")) == []
+
+
+def test_punctuation_in_the_query_is_not_fts_syntax(roster):
+    assert names(roster.search_npcs('knight" (*')) == ["Aldric"]
+
+
+def test_facets_filter_case_insensitively(roster):
+    assert names(roster.search_npcs(facets={"race": "ELF"})) == ["Corwin", "Dara"]
+    assert names(roster.search_npcs("dragon", facets={"race": "Elf"})) == ["Corwin"]
+    assert names(roster.search_npcs(facets={"unknown_column": "x"})) == ["Aldric", "Brenna", "Corwin", "Dara"]
+
+
+def test_facet_counts_leave_out_their_own_filter(roster):
+    counts = roster.search_npcs(facets={"attitude": "Friendly"})["facet_counts"]
+    assert counts["attitude"] == {"Friendly": 2, "Neutral": 1, "Hostile": 1}
+    assert sum(counts["race"].values()) == 2  # the Friendly NPCs only
+    assert counts["character_class"] == {"Fighter": 1, "Rogue": 1}
+
+
+def test_pages_follow_the_returned_offset(roster):
+    first = roster.search_npcs(limit=3)
+    assert names(first) == ["Aldric", "Brenna", "Corwin"]
+    second = roster.search_npcs(limit=3, offset=first["next_offset"])
+    assert names(second) == ["Dara"]
+    assert second["next_offset"] is None
+    assert second["facet_counts"] == {}
+
+
+def test_index_follows_edits_renames_and_deletes(roster):
+    roster.update_npc("Brenna", {"personality": "Sings sea shanties"})
+    assert names(roster.search_npcs("shanties")) == ["Brenna"]
+    assert names(roster.search_npcs("gruff")) == []
+    roster.save_npc(dict(NPCS[2], name="Corwin the Grey"), old_name="Corwin")
+    assert names(roster.search_npcs("grey")) == ["Aldric", "Corwin the Grey"]
+    roster.delete_npc("Aldric")
+    assert names(roster.search_npcs("dragon")) == ["Corwin the Grey"]
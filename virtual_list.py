@@ -0,0 +1,284 @@
+import bisect
+import logging
+import math
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import customtkinter
+
+from async_data_manager import when_done
+from image_cache import avatar_cache, blank_image
+
+THUMBNAILS_KEPT = 500  # thumbnail bytes remembered for rows scrolled past, so scrolling back needs no query
+
+
+class VirtualList(customtkinter.CTkFrame):
+    """
+    A scrollable list of selectable buttons that only creates widgets for the rows on screen.
+
+    Items are kept as a sorted list of keys. Inserts, removals and renames update that list in place
+    and redraw the visible window, and moving the selection reconfigures at most two buttons.
+
+    With a `thumbnail_loader(keys, pixels)` returning {key: image bytes}, or a Future of it, rows show an
+    avatar of `thumbnail_size`; the loader is called once per redraw for the visible rows not seen before.
+    """
+
+    def __init__(self, master, command=None, label_text=None, empty_text="", row_height=38, on_end_reached=None,
+                 thumbnail_loader=None, thumbnail_size=32, **kwargs):
+        super().__init__(master, **kwargs)
+        self.command = command
+        self.on_end_reached = on_end_reached  # called once per list contents when the last row comes into view
+        self.thumbnail_loader = thumbnail_loader
+        self.thumbnail_size = thumbnail_size
+        self._thumbnails = OrderedDict()  # key -> thumbnail bytes, or None if it has none
+        self._thumbnails_pending = {}  # key -> the loader Future that will bring its thumbnail
+        self._blank_avatar = blank_image((thumbnail_size, thumbnail_size)) if thumbnail_loader else None
+        self._end_reported = False
+        self.row_height = row_height
+        self._items = []
+        self._selected_key = None
+        self._first_index = 0
+        self._slots = []  # pooled buttons, reused as the list scrolls
+        self._slot_keys = []  # key currently shown by each pooled button
+        self._slot_selected = []  # whether each pooled button is drawn highlighted
+        self._slot_avatars = []  # key whose avatar each pooled button shows
+
+        self.grid_columnconfigure(0, weight=1)
+        body_row = 0
+        if label_text:
+            customtkinter.CTkLabel(self, text=label_text, font=customtkinter.CTkFont(weight="bold")).grid(
+                row=0, column=0, columnspan=2, padx=5, pady=(5, 0), sticky="ew")
+            body_row = 1
+        self.grid_rowconfigure(body_row, weight=1)
+
+        self._body = customtkinter.CTkFrame(self, fg_color="transparent")
+        self._body.grid(row=body_row, column=0, padx=(5, 0), pady=5, sticky="nsew")
+        self._scrollbar = customtkinter.CTkScrollbar(self, command=self._on_scrollbar)
+        self._scrollbar.grid(row=body_row, column=1, pady=5, sticky="ns")
+        self._empty_label = customtkinter.CTkLabel(self._body, text=empty_text)
+
+        self._body.bind("<Configure>", lambda event: self._render())
+        self._bind_mousewheel(self._body)
+
+    # --- Public API ---
+
+    @property
+    def items(self):
+        return self._items
+
+    def set_items(self, keys):
+        """Replaces the whole list. Use the incremental methods for single changes."""
+        self._items = sorted(keys)
+        self._end_reported = False
+        self._first_index = min(self._first_index, self._max_first_index())
+        self._render()
+
+    def extend(self, keys):
+        """Adds a page of keys that sort after the current ones, e.g. the next page of search results."""
+        self._items.extend(keys)
+        self._items.sort()
+        self._end_reported = False
+        self._render()
+
+    def insert(self, key):
+        index = bisect.bisect_left(self._items, key)
+        if index < len(self._items) and self._items[index] == key: return
+        self._items.insert(index, key)
+        self._render()
+
+    def remove(self, key):
+        index = self.index(key)
+        if index is None: return
+        del self._items[index]
+        self._thumbnails.pop(key, None)
+        if key == self._selected_key: self._selected_key = None
+        self._first_index = min(self._first_index, self._max_first_index())
+        self._render()
+
+    def rename(self, old_key, new_key):
+        was_selected = old_key == self._selected_key
+        index = self.index(old_key)
+        if index is not None: del self._items[index]
+        if self.index(new_key) is None: bisect.insort(self._items, new_key)
+        self._thumbnails.pop(old_key, None)
+        self._thumbnails.pop(new_key, None)
+        if was_selected: self._selected_key = new_key
+        self._render()
+
+    def refresh_thumbnail(self, key):
+        """Reloads the avatar of `key`, e.g. after its portrait changed."""
+        self._thumbnails.pop(key, None)
+        self._thumbnails_pending.pop(key, None)  # a load already under way may predate the change
+        slot = self._slot_for_key(key)
+        if slot is not None: self._slot_avatars[slot] = None
+        if self.thumbnail_loader: self._show_thumbnails()
+
+    def index(self, key):
+        index = bisect.bisect_left(self._items, key)
+        if index < len(self._items) and self._items[index] == key: return index
+        return None
+
+    def select(self, key):
+        """Highlights `key`, touching only the old and new rows if they are on screen."""
+        if key == self._selected_key: return
+        previous, self._selected_key = self._selected_key, key
+        for changed_key in (previous, key):
+            slot = self._slot_for_key(changed_key)
+            if slot is not None: self._paint_slot(slot)
+
+    def see(self, key):
+        """Scrolls just far enough to make `key` visible."""
+        index = self.index(key)
+        if index is None: return
+        visible = self._visible_count()
+        if index < self._first_index:
+            self._scroll_to(index)
+        elif index >= self._first_index + visible:
+            self._scroll_to(index - visible + 1)
+
+    # --- Rendering ---
+
+    def _visible_count(self):
+        height = self._body.winfo_height()
+        return max(1, math.ceil(height / self.row_height))
+
+    def _max_first_index(self):
+        return max(0, len(self._items) - self._visible_count() + 1)
+
+    def _ensure_slots(self, count):
+        while len(self._slots) < count:
+            slot = len(self._slots)
+            button = customtkinter.CTkButton(self._body, text="", height=self.row_height - 6,
+                                             command=lambda s=slot: self._on_slot_clicked(s))
+            if self.thumbnail_loader: button.configure(image=self._blank_avatar, compound="left", anchor="w")
+            self._bind_mousewheel(button)
+            self._slots.append(button)
+            self._slot_keys.append(None)
+            self._slot_selected.append(False)
+            self._slot_avatars.append(None)
+
+    def _render(self):
+        visible = self._visible_count()
+        self._ensure_slots(visible)
+        if self._items:
+            self._empty_label.place_forget()
+        else:
+            self._empty_label.place(relx=0.5, y=20, anchor="n")
+        for slot, button in enumerate(self._slots):
+            index = self._first_index + slot
+            if slot >= visible or index >= len(self._items):
+                if self._slot_keys[slot] is not None:
+                    button.place_forget()
+                    self._slot_keys[slot] = None
+                continue
+            key = self._items[index]
+            if self._slot_keys[slot] is None:
+                button.place(x=0, y=slot * self.row_height + 3, relwidth=1.0)
+            if self._slot_keys[slot] != key:
+                button.configure(text=key)
+                self._slot_keys[slot] = key
+            self._paint_slot(slot)
+        if self.thumbnail_loader: self._show_thumbnails()
+        self._update_scrollbar(visible)
+        if self.on_end_reached and self._items and not self._end_reported and \
+                self._first_index + visible >= len(self._items):
+            self._end_reported = True
+            self.after_idle(self.on_end_reached)
+
+    def _show_thumbnails(self):
+        """Fetches the visible rows' thumbnails in one loader call and puts each on its button."""
+        shown = [key for key in self._slot_keys if key is not None]
+        missing = [key for key in shown if key not in self._thumbnails and key not in self._thumbnails_pending]
+        if missing:
+            scaling = customtkinter.ScalingTracker.get_widget_scaling(self)
+            found = self.thumbnail_loader(missing, round(self.thumbnail_size * scaling))
+            if isinstance(found, Future):
+                for key in missing: self._thumbnails_pending[key] = found
+                when_done(self, found, lambda done: self._on_thumbnails_loaded(missing, done))
+            else:
+                for key in missing: self._thumbnails[key] = found.get(key)
+        for key in shown:
+            if key in self._thumbnails: self._thumbnails.move_to_end(key)
+        while len(self._thumbnails) > max(THUMBNAILS_KEPT, len(shown)): self._thumbnails.popitem(last=False)
+        for slot, key in enumerate(self._slot_keys):
+            if key is None or self._slot_avatars[slot] == key: continue
+            if key not in self._thumbnails:
+                # Still loading: don't leave the avatar of the row this button showed before.
+                if self._slot_avatars[slot] is not None: self._slots[slot].configure(image=self._blank_avatar)
+                self._slot_avatars[slot] = None
+                continue
+            self._slot_avatars[slot] = key
+            self._show_avatar(slot, key, self._thumbnails[key])
+
+    def _on_thumbnails_loaded(self, keys, future):
+        keys = [key for key in keys if self._thumbnails_pending.get(key) is future]
+        if not keys: return
+        try:
+            found = future.result()
+        except Exception as e:
+            logging.error(f"Failed to load list thumbnails: {e}")
+            found = {}
+        for key in keys:
+            del self._thumbnails_pending[key]
+            self._thumbnails[key] = found.get(key)
+        self._show_thumbnails()
+
+    def _show_avatar(self, slot, key, image_bytes):
+        def apply(ctk_image):
+            if self._slot_keys[slot] != key: return  # the row scrolled away while decoding
+            self._slots[slot].configure(image=ctk_image or self._blank_avatar)
+
+        if not avatar_cache.request(self, image_bytes, (self.thumbnail_size, self.thumbnail_size), apply):
+            self._slots[slot].configure(image=self._blank_avatar)
+
+    def _paint_slot(self, slot):
+        is_selected = self._slot_keys[slot] is not None and self._slot_keys[slot] == self._selected_key
+        if is_selected == self._slot_selected[slot]: return
+        self._slot_selected[slot] = is_selected
+        theme = customtkinter.ThemeManager.theme["CTkButton"]
+        self._slots[slot].configure(fg_color=theme["hover_color"] if is_selected else theme["fg_color"])
+
+    def _slot_for_key(self, key):
+        index = self.index(key) if key is not None else None
+        if index is None: return None
+        slot = index - self._first_index
+        if 0 <= slot < len(self._slots) and self._slot_keys[slot] == key: return slot
+        return None
+
+    def _on_slot_clicked(self, slot):
+        key = self._slot_keys[slot]
+        if key is not None and self.command: self.command(key)
+
+    # --- Scrolling ---
+
+    def _update_scrollbar(self, visible):
+        total = len(self._items)
+        if total == 0 or total <= visible - 1:
+            self._scrollbar.set(0.0, 1.0)
+        else:
+            self._scrollbar.set(self._first_index / total, min(1.0, (self._first_index + visible - 1) / total))
+
+    def _scroll_to(self, first_index):
+        first_index = max(0, min(int(first_index), self._max_first_index()))
+        if first_index == self._first_index: return
+        self._first_index = first_index
+        self._render()
+
+    def _on_scrollbar(self, *args):
+        if not args: return
+        if args[0] == "moveto":
+            self._scroll_to(round(float(args[1]) * len(self._items)))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if len(args) > 2 and args[2] == "pages": step *= max(1, self._visible_count() - 1)
+            self._scroll_to(self._first_index + step)
+
+    def _bind_mousewheel(self, widget):
+        widget.bind("<MouseWheel>", self._on_mousewheel, add="+")
+        widget.bind("<Button-4>", lambda event: self._scroll_to(self._first_index - 3), add="+")
+        widget.bind("<Button-5>", lambda event: self._scroll_to(self._first_index + 3), add="+")
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS reports small deltas.
+        step = -int(event.delta / 120) if abs(event.delta) >= 120 else -int(event.delta)
+        self._scroll_to(self._first_index + step * 3)
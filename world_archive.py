@@ -0,0 +1,202 @@
+import hashlib
+import io
+import json
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+import zipfile
+
+from config import ARCHIVE_IMPORT_BATCH_SIZE
+from services import NPC_COLUMNS, NPC_STORED_COLUMNS, CAMPAIGN_COLUMNS, DataManager
+
+ARCHIVE_FORMAT = "dnd-toolkit-world"
+ARCHIVE_VERSION = 1
+MANIFEST = "manifest.json"
+NPC_MEMBER = "npcs.jsonl"
+CAMPAIGN_MEMBER = "campaigns.jsonl"
+PORTRAIT_PREFIX = "portraits/"
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def record_hash(record):
+    """A hash of a record's fields (portraits by their hash), used to recognize records already imported."""
+    fields = {key: value for key, value in record.items() if key != "hash"}
+    return content_hash(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+
+
+def _npc_record(row):
+    record = {col: row[col] for col in NPC_COLUMNS if col != "image_data"}
+    record["portrait"] = content_hash(row["image_data"]) if row["image_data"] else None
+    record["hash"] = record_hash(record)
+    return record
+
+
+def _campaign_record(row):
+    record = {col: row[col] for col in CAMPAIGN_COLUMNS}
+    record["hash"] = record_hash(record)
+    return record
+
+
+def _has_member(archive, name):
+    try:
+        archive.getinfo(name)
+        return True
+    except KeyError:
+        return False
+
+
+def export_world(db, path, on_progress=None):
+    """
+    Writes every campaign and NPC to a zip archive at `path`, one record at a time, and returns the manifest.
+
+    Records go to line-delimited JSON members; each distinct portrait is stored once, uncompressed, as
+    portraits/<sha256>. Memory use does not grow with the size of the world. `on_progress(done, total)` is
+    called as NPCs are written.
+    """
+    conn = db._get_connection()
+    counts = {"campaigns": 0, "npcs": 0, "portraits": 0}
+    with db.transaction(write=False):  # one read snapshot for the whole export
+        total = conn.execute("SELECT COUNT(*) FROM npcs").fetchone()[0]
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+            with archive.open(CAMPAIGN_MEMBER, "w") as member:
+                for row in conn.execute(f"SELECT {', '.join(CAMPAIGN_COLUMNS)} FROM campaigns ORDER BY campaign_id"):
+                    member.write(json.dumps(_campaign_record(row), ensure_ascii=False).encode("utf-8") + b"\n")
+                    counts["campaigns"] += 1
+            # A zip can only have one member open for writing, so the NPC lines are spooled to a temporary
+            # file while the portraits are written, then copied in.
+            with tempfile.TemporaryFile() as spool:
+                for row in conn.execute(f"SELECT {', '.join(NPC_STORED_COLUMNS)} FROM npcs ORDER BY npc_id"):
+                    row = db._with_portrait(row)
+                    record = _npc_record(row)
+                    portrait_name = PORTRAIT_PREFIX + record["portrait"] if record["portrait"] else None
+                    if portrait_name and not _has_member(archive, portrait_name):
+                        archive.writestr(portrait_name, row["image_data"], compress_type=zipfile.ZIP_STORED)
+                        counts["portraits"] += 1
+                    spool.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                    counts["npcs"] += 1
+                    if on_progress and counts["npcs"] % 100 == 0: on_progress(counts["npcs"], total)
+                spool.seek(0)
+                with archive.open(NPC_MEMBER, "w") as member:
+                    shutil.copyfileobj(spool, member)
+            manifest = {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "export_id": uuid.uuid4().hex,
+                        "created_at": time.time(), "schema_version": getattr(db, "schema_version", None),
+                        "counts": counts}
+            archive.writestr(MANIFEST, json.dumps(manifest, indent=2))
+    if on_progress: on_progress(counts["npcs"], total)
+    logging.info(f"Exported {counts['campaigns']} campaigns, {counts['npcs']} NPCs and {counts['portraits']} "
+                 f"portraits to {path}.")
+    return manifest
+
+
+class WorldImporter:
+    """
+    Reads an archive written by export_world back into the database, in transactions of `batch_size` records.
+
+    Progress is committed with each batch in the 'archive_imports' table, so running the same archive again
+    after an interruption continues where it stopped. A record identical to one already in the database (by
+    content hash) is skipped; a different record whose name is taken is imported under a free name.
+    """
+
+    def __init__(self, db, path, batch_size=ARCHIVE_IMPORT_BATCH_SIZE, on_progress=None):
+        self.db = db
+        self.path = path
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.stats = {"campaigns": 0, "npcs": 0, "duplicates": 0, "renamed": 0, "missing_portraits": 0}
+
+    def run(self):
+        """Imports the archive and returns the counts of what was added, skipped and renamed."""
+        with zipfile.ZipFile(self.path) as archive:
+            manifest = json.loads(archive.read(MANIFEST))
+            if manifest.get("format") != ARCHIVE_FORMAT or manifest.get("version", 0) > ARCHIVE_VERSION:
+                raise ValueError(f"{self.path} is not a world archive this version can read.")
+            self.export_id = manifest["export_id"]
+            self.total = manifest["counts"]["npcs"]
+            self._import_member(archive, CAMPAIGN_MEMBER, self._import_campaign)
+            self._import_member(archive, NPC_MEMBER, lambda conn, record: self._import_npc(conn, archive, record))
+        logging.info(f"Imported {self.path}: {self.stats}")
+        return self.stats
+
+    def _import_member(self, archive, member_name, import_record):
+        lines_done, finished = self._progress(member_name)
+        if finished: return
+        with archive.open(member_name) as member:
+            lines = io.TextIOWrapper(member, encoding="utf-8")
+            for _ in range(lines_done): next(lines)  # already imported by an interrupted run
+            while True:
+                batch = [json.loads(line) for _, line in zip(range(self.batch_size), lines)]
+                with self.db.transaction() as conn:
+                    for record in batch: import_record(conn, record)
+                    lines_done += len(batch)
+                    conn.execute("INSERT INTO archive_imports (export_id, member, lines_done, finished_at) "
+                                 "VALUES (?, ?, ?, ?) ON CONFLICT(export_id, member) DO UPDATE SET "
+                                 "lines_done = excluded.lines_done, finished_at = excluded.finished_at",
+                                 (self.export_id, member_name, lines_done,
+                                  time.time() if len(batch) < self.batch_size else None))
+                if member_name == NPC_MEMBER and self.on_progress: self.on_progress(lines_done, self.total)
+                if len(batch) < self.batch_size: break
+
+    def _progress(self, member_name):
+        row = self.db._get_connection().execute(
+            "SELECT lines_done, finished_at FROM archive_imports WHERE export_id = ? AND member = ?",
+            (self.export_id, member_name)).fetchone()
+        return (row['lines_done'], row['finished_at'] is not None) if row else (0, False)
+
+    def _import_campaign(self, conn, record):
+        existing = conn.execute(f"SELECT {', '.join(CAMPAIGN_COLUMNS)} FROM campaigns WHERE campaign_name = ?",
+                                (record['campaign_name'],)).fetchone()
+        campaign = {col: record.get(col) for col in CAMPAIGN_COLUMNS}
+        if existing is not None:
+            if _campaign_record(existing)["hash"] == record["hash"]:
+                self.stats["duplicates"] += 1
+                return
+            campaign['campaign_name'] = self._free_name(conn, "campaigns", "campaign_name", record['campaign_name'])
+            self.stats["renamed"] += 1
+        DataManager._upsert_campaign(conn, campaign)
+        self.db._record_change("campaign", campaign['campaign_name'])
+        self.stats["campaigns"] += 1
+
+    def _import_npc(self, conn, archive, record):
+        existing = conn.execute(f"SELECT {', '.join(NPC_STORED_COLUMNS)} FROM npcs WHERE name = ?",
+                                (record['name'],)).fetchone()
+        if existing is not None and _npc_record(self.db._with_portrait(existing))["hash"] == record["hash"]:
+            self.stats["duplicates"] += 1
+            return
+        npc = {col: record.get(col) for col in NPC_COLUMNS if col != "image_data"}
+        npc['image_data'] = self._read_portrait(archive, record.get("portrait"))
+        if existing is not None:
+            npc['name'] = self._free_name(conn, "npcs", "name", record['name'])
+            self.stats["renamed"] += 1
+        DataManager._upsert_npc(conn, self.db._stored_portrait(npc))
+        self.db._record_change("npc", npc['name'])
+        self.stats["npcs"] += 1
+
+    def _read_portrait(self, archive, portrait_hash):
+        if not portrait_hash: return None
+        try:
+            image_bytes = archive.read(PORTRAIT_PREFIX + portrait_hash)
+        except KeyError:
+            image_bytes = None
+        if image_bytes is None or content_hash(image_bytes) != portrait_hash:
+            logging.warning(f"Portrait {portrait_hash} is missing or damaged in {self.path}; importing without it.")
+            self.stats["missing_portraits"] += 1
+            return None
+        return image_bytes
+
+    @staticmethod
+    def _free_name(conn, table, column, name):
+        candidate, suffix = name, 2
+        while conn.execute(f"SELECT 1 FROM {table} WHERE {column} = ?", (candidate,)).fetchone():
+            candidate = f"{name} ({suffix})"
+            suffix += 1
+        return candidate
+
+
+def import_world(db, path, on_progress=None):
+    """Imports an archive written by export_world; see WorldImporter. Returns the import counts."""
+    return WorldImporter(db, path, on_progress=on_progress).run()